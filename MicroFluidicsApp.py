@@ -2,11 +2,52 @@ import streamlit as st
 import plotly.graph_objects as go
 import numpy as np
 import pandas as pd
-from scipy.optimize import curve_fit
-from datetime import datetime
+from datetime import datetime, timedelta
 import time
+import os
+import json
 import io
-import streamlit_autorefresh
+
+from fcs_ingest import ingest_many, row_hashes
+from affinity_store import AffinityStore
+from affinity_fit import AUTO_MODEL, FitCache
+from analysis import rank_proteins
+from pump_driver import connect_pump_driver
+from experiment_store import ExperimentStore, file_hash
+import metrics
+from system_log import LEVELS, SUBSYSTEMS, SystemLog, paginate
+from kinetics import fit_curve
+from procedure import STEP_TYPES, critical_path, load_procedure, topological_order
+from controller import ControllerError, PlatformController
+from topology import load_topology
+from titration import TitrationError, describe_plan, plan_procedures, plan_titration
+from clock import SYSTEM_CLOCK, ScaledClock
+from recorder import TraceRecorder
+
+PUMP_PANEL_REFRESH = "2s"
+PROCEDURE_PANEL_REFRESH = "5s"
+MONITORING_PANEL_REFRESH = "2s"
+LOG_PANEL_REFRESH = "5s"
+LOG_PAGE_SIZE = 50
+PERFORMANCE_PANEL_REFRESH = "5s"
+CHIP_OVERVIEW_REFRESH = "2s"
+PUMP_COLUMNS = 4
+NOTICE_REFRESH = "2s"
+NOTICE_SECONDS = 5
+
+# Affinity chart: above WEBGL_POINT_THRESHOLD markers switch to WebGL (Scattergl);
+# "auto" display reduces proteins with more than DISPLAY_MAX_POINTS points
+WEBGL_POINT_THRESHOLD = 5000
+DISPLAY_MAX_POINTS = 2000
+DISPLAY_MODES = {
+    "auto": "Auto",
+    "all": "All points",
+    "aggregate": "Mean ± SD per concentration",
+    "decimate": f"Subsample (≤{DISPLAY_MAX_POINTS} points per protein)"
+}
+
+DEFAULT_PROCEDURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "procedures", "protein_reaction_detection.json")
+DEFAULT_TOPOLOGY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "devices", "default.json")
 
 st.set_page_config(
     page_title="Microfluidic Test Platform Control Software",
@@ -14,274 +55,503 @@ st.set_page_config(
     layout="wide"
 )
 
-if 'message_display' not in st.session_state:
-    st.session_state.message_display = {
-        'show': False,
-        'type': '',  # 'warning' or 'success'
-        'content': '',
-        'timestamp': 0
-    }
+script_started = time.perf_counter()
+metrics.incr("script_runs_total")
+metrics.start_exporters(
+    port=os.environ.get("APP_METRICS_PORT"),
+    path=os.environ.get("APP_METRICS_FILE"),
+    host=os.environ.get("APP_METRICS_HOST", "127.0.0.1")
+)
+
+@st.cache_resource(show_spinner=False)
+def get_controller(data_dir):
+    """The platform controller shared by every session of this server process.
+    
+    Pumps, procedures, experiment progress and the system log live here, so all
+    browser tabs watch and drive the same hardware. The chips and their pumps
+    come from the device topology ($PLATFORM_TOPOLOGY, default
+    devices/default.json). $PLATFORM_CLOCK_SPEED runs the simulated platform
+    faster than real time and $PLATFORM_TRACE records it for replay.py.
+    Uploaded data, fits and charts stay per session.
+    """
+    speed = float(os.environ.get("PLATFORM_CLOCK_SPEED", 1))
+    if speed != 1 and os.environ.get("PUMP_SERIAL_PORT"):
+        raise RuntimeError("PLATFORM_CLOCK_SPEED only works with the simulated pumps; unset PUMP_SERIAL_PORT")
+    clock = ScaledClock(speed) if speed != 1 else SYSTEM_CLOCK
+    trace_path = os.environ.get("PLATFORM_TRACE")
+    if trace_path and os.path.dirname(trace_path):
+        os.makedirs(os.path.dirname(trace_path), exist_ok=True)
+    recorder = TraceRecorder(trace_path, clock) if trace_path else None
+    topology = load_topology(os.environ.get("PLATFORM_TOPOLOGY", DEFAULT_TOPOLOGY_PATH))
+    procedure = load_procedure(DEFAULT_PROCEDURE_PATH)
+    procedures = {chip["id"]: load_procedure(chip["procedure"]) for chip in topology["chips"] if chip.get("procedure")}
+    addresses = [pump["address"] for chip in topology["chips"] for pump in chip["pumps"]]
+    system_log = SystemLog(path=os.path.join(data_dir, "logs", "system_log.jsonl"), clock=clock)
+    system_log.log(f"System startup completed: {len(topology['chips'])} chip(s), {len(addresses)} pumps")
+    system_log.log(f"Loaded experiment procedure: {procedure['name']}", subsystem="procedure")
+    if speed != 1:
+        system_log.log(f"Simulation clock running at {speed:g}x real time")
+    if recorder:
+        system_log.log(f"Recording control trace to {trace_path}")
+    return PlatformController(topology, procedure, connect_pump_driver(addresses), system_log, procedures,
+                              clock=clock, recorder=recorder)
 
 if 'app_state' not in st.session_state:
+    data_dir = os.environ.get("EXPERIMENT_DATA_DIR", "data")
     st.session_state.app_state = {
-        "pumps": {
-            1: { "running": False, "flow": 50, "time": 10, "name": "Protein A", "completed": False },
-            2: { "running": False, "flow": 30, "time": 15, "name": "Protein B", "completed": False },
-            3: { "running": False, "flow": 40, "time": 20, "name": "Buffer" }
-        },
-        "experiment": {
-            "current_step": 0,
-            "total_steps": 5,
-            "progress": 0,
-            "remaining_time": "--minutes",
-            "steps_completed": {1: False, 2: False, 3: False, 4: False, 5: False}
-        },
-        "system_log": [
-            "[14:28:15] System startup completed",
-            "[14:28:30] Loaded experiment procedure: Protein reaction detection"
-        ],
-        "last_update": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "affinity_data": [],
-        "uploaded_files": [] ,
-        "emergency_status": False
+        "controller": get_controller(data_dir),
+        "affinity_data": AffinityStore(),
+        "experiment_store": ExperimentStore(data_dir),
+        "history_window": None,
+        "fit_cache": FitCache(),
+        "figure_cache": {},
+        "uploaded_files": set()
     }
 
-def add_system_log(message):
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    st.session_state.app_state["system_log"].append(f"[{timestamp}] {message}")
-    if len(st.session_state.app_state["system_log"]) > 50:
-        st.session_state.app_state["system_log"].pop(0)
+def platform_state():
+    """Read-only snapshot of the shared pump and experiment state"""
+    return st.session_state.app_state["controller"].snapshot()
 
-def update_last_update():
-    st.session_state.app_state["last_update"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def selected_chip():
+    """ID of the chip this session is looking at (the first chip until one is picked)"""
+    chips = platform_state()["chips"]
+    chip_id = st.session_state.get("selected_chip")
+    return chip_id if chip_id in chips else next(iter(chips))
 
-def parse_fcs_data(uploaded_file):
-    """Parse CSV data file exported by FCS instrument"""
+def send_command(command, *args):
+    """Run a controller command and wait for it; refusals are shown to the operator"""
     try:
-        df = pd.read_csv(uploaded_file)
-        
-        required_columns = ['protein', 'concentration', 'affinity']
-        if not all(col in df.columns for col in required_columns):
-            return None, f"CSV file missing necessary columns. Must include: {', '.join(required_columns)}"
-        
-        data = []
-        for _, row in df.iterrows():
-            data.append({
-                "protein": str(row['protein']),
-                "concentration": float(row['concentration']),
-                "affinity": float(row['affinity']),
-                "experiment_id": f"EXP{datetime.now().strftime('%y%m%d')}{len(st.session_state.app_state['affinity_data']) + 1}",
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
-        
-        return data, "Parsing successful"
-    except Exception as e:
-        return None, f"Parsing failed: {str(e)}"
+        return st.session_state.app_state["controller"].execute(command, *args)
+    except ControllerError as e:
+        st.error(str(e))
+    except TimeoutError:
+        st.error(f"Controller did not answer: {command} may still be applied")
 
-def fit_affinity_curve(concentrations, affinities):
-    """Fit concentration-affinity curve"""
-    def binding_model(c, kd, bmax):
-        """Typical binding model: Y = (Bmax * C) / (Kd + C)"""
-        return (bmax * c) / (kd + c)
+def add_system_log(message, level="INFO", subsystem="system", pump_id=None, step_id=None):
+    st.session_state.app_state["controller"].log(message, level, subsystem, pump_id, step_id)
+
+def update_last_update():
+    st.session_state.app_state["controller"].submit("touch")
+
+HISTORY_WINDOWS = {"Today": 0, "Last 7 days": 7, "Last 30 days": 30, "All runs": None}
+# Archived records preselected for loading; larger windows start with no proteins picked
+HISTORY_AUTOLOAD_ROWS = 1_000_000
+
+@metrics.timed()
+def import_fcs_files(uploaded_files, reduction=None):
+    """Parse a batch of exports (CSV or binary .fcs) in parallel and commit them to the affinity data together.
+    
+    Files are deduplicated by content hash, rows by their (protein, concentration,
+    affinity) hash against the loaded data and earlier files of the batch. New rows
+    are archived in one catalog transaction, then appended. Returns a summary with
+    one entry per file plus the imported frames. reduction configures how binary
+    FCS events become records (see fcs_binary.DEFAULT_REDUCTION).
+    """
+    start = time.perf_counter()
+    app_state = st.session_state.app_state
+    affinity_data = app_state["affinity_data"]
+    
+    contents = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+    hashes = [file_hash(data) for _, data in contents]
+    archived = app_state["experiment_store"].known_files(hashes)
+    entries = [{"file": name, "status": "", "rows": 0, "duplicate_rows": 0, "message": ""} for name, _ in contents]
+    
+    pending = []
+    for entry, (name, data), content_hash in zip(entries, contents, hashes):
+        if content_hash in app_state["uploaded_files"] or any(content_hash == h for _, _, _, h in pending):
+            entry.update(status="skipped", message="Same content already imported")
+        else:
+            pending.append((entry, name, data, content_hash))
+    # IDs come from the archive catalog, so sessions and restarts on the same day never reuse one
+    experiment_ids = app_state["experiment_store"].reserve_experiment_ids(len(pending)) if pending else []
+    for (entry, _, _, _), experiment_id in zip(pending, experiment_ids):
+        entry["experiment_id"] = experiment_id
+    
+    results = ingest_many([(name, data, entry["experiment_id"]) for entry, name, data, _ in pending], reduction=reduction)
+    
+    batch, batch_hashes = [], []
+    for (entry, name, _, content_hash), result in zip(pending, results):
+        if result["error"]:
+            entry.update(status="failed", message=f"Parsing failed: {result['error']}")
+            continue
+        data = result["data"]
+        row_keys = row_hashes(data)
+        duplicate = affinity_data.known_rows(row_keys)
+        if batch_hashes:
+            duplicate |= np.isin(row_keys, np.concatenate(batch_hashes))
+        if duplicate.any():
+            data, row_keys = data[~duplicate].reset_index(drop=True), row_keys[~duplicate]
+        entry["duplicate_rows"] = int(duplicate.sum())
+        app_state["uploaded_files"].add(content_hash)
+        if len(data) == 0:
+            entry.update(status="skipped", message="No new rows")
+            continue
+        batch_hashes.append(row_keys)
+        batch.append((entry, name, content_hash, data, row_keys))
+    
+    # Files already in the archive (e.g. re-uploaded after clearing the view) are only loaded, not archived again
+    to_archive = [(data, name, content_hash) for _, name, content_hash, data, _ in batch if content_hash not in archived]
+    if to_archive:
+        try:
+            app_state["experiment_store"].append_many(to_archive)
+        except Exception as e:
+            for entry, _, content_hash, _, _ in batch:
+                entry.update(status="failed", message=f"Archive write failed: {e}")
+                app_state["uploaded_files"].discard(content_hash)
+            batch = []
+    
+    proteins = set()
+    for entry, _, content_hash, data, row_keys in batch:
+        affinity_data.append(data, row_keys)
+        proteins.update(data["protein"].unique())
+        entry.update(status="imported", rows=len(data))
+        if content_hash in archived:
+            entry["message"] = "Already archived; loaded into view"
+    app_state["fit_cache"].invalidate(proteins)
     
+    seconds = time.perf_counter() - start
+    total_rows = sum(entry["rows"] for entry in entries)
+    return {
+        "files": entries,
+        "imported": sum(entry["status"] == "imported" for entry in entries),
+        "skipped": sum(entry["status"] == "skipped" for entry in entries),
+        "failed": sum(entry["status"] == "failed" for entry in entries),
+        "rows": total_rows,
+        "duplicate_rows": sum(entry["duplicate_rows"] for entry in entries),
+        "seconds": seconds,
+        "rows_per_sec": total_rows / seconds if seconds > 0 else 0.0,
+        "frames": [data for _, _, _, data, _ in batch],
+    }
+
+def describe_import(summary):
+    return (f"{summary['imported']} file(s) imported, {summary['skipped']} skipped, {summary['failed']} failed; "
+            f"{summary['rows']:,} new records, {summary['duplicate_rows']:,} duplicate rows dropped "
+            f"({summary['rows_per_sec']:,.0f} rows/s)")
+
+def parse_fcs_data(uploaded_file, reduction=None):
+    """Import a single export (CSV or binary .fcs); returns (imported rows or None, message)"""
+    summary = import_fcs_files([uploaded_file], reduction)
+    entry = summary["files"][0]
+    if entry["status"] != "imported":
+        return None, entry["message"]
+    return summary["frames"][0], describe_import(summary)
+
+def parse_gate(text):
+    """'FSC-A:100:900, SSC-A:0:5e4' -> {channel: (low, high)}; raises ValueError"""
+    gate = {}
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        channel, low, high = part.rsplit(":", 2)
+        gate[channel.strip()] = (float(low), float(high))
+    return gate
+
+def fcs_reduction_settings():
+    """Binary FCS reduction options from the upload panel widgets"""
     try:
-        params, _ = curve_fit(binding_model, concentrations, affinities, p0=[1, 100], maxfev=10000)
-        return {
-            "params": params,  # [Kd, Bmax]
-            "model": binding_model
-        }
-    except Exception as e:
-        st.warning(f"Curve fitting failed: {str(e)}")
-        return None
+        gate = parse_gate(st.session_state.get("fcs_gate", ""))
+    except ValueError:
+        st.warning("Gate ignored: use channel:low:high entries separated by commas")
+        gate = {}
+    return {
+        "channel": st.session_state.get("fcs_channel") or None,
+        "statistic": st.session_state.get("fcs_statistic", "median"),
+        "protein_keyword": st.session_state.get("fcs_protein_keyword") or "PROTEIN",
+        "concentration_keyword": st.session_state.get("fcs_concentration_keyword") or "CONCENTRATION",
+        "group_channel": st.session_state.get("fcs_group_channel") or None,
+        "gate": gate
+    }
 
-def start_pump(pump_id):
-    pump = st.session_state.app_state["pumps"][pump_id]
-    pump["running"] = True
-    add_system_log(f"Pump {pump_id} started: {pump['flow']}μL/min, {pump['time']} seconds")
-    update_last_update()
-    
-    st.session_state.app_state[f"pump_{pump_id}_start_time"] = time.time()
-    st.session_state.app_state[f"pump_{pump_id}_duration"] = pump["time"]/5
-    
-    st.info(f"Pump {pump_id} running...")
-
-def check_pump_status():
-    for pump_id in st.session_state.app_state["pumps"]:
-        if (st.session_state.app_state["pumps"][pump_id]["running"] and 
-            f"pump_{pump_id}_start_time" in st.session_state.app_state):
-            elapsed = time.time() - st.session_state.app_state[f"pump_{pump_id}_start_time"]
-            if elapsed >= st.session_state.app_state[f"pump_{pump_id}_duration"]:
-                st.session_state.app_state["pumps"][pump_id]["running"] = False
-                add_system_log(f"Pump {pump_id} stopped")
-                if pump_id in [1, 2]:
-                    st.session_state.app_state["pumps"][pump_id]["completed"] = True
-
-                    completed_pumps = 0
-                    for p in [1, 2]:
-                        if st.session_state.app_state["pumps"][p]["completed"]:
-                            completed_pumps += 1
-                    
-                    if completed_pumps > st.session_state.app_state["experiment"]["current_step"]:
-                        st.session_state.app_state["experiment"]["current_step"] = completed_pumps
-                        st.session_state.app_state["experiment"]["steps_completed"][completed_pumps] = True
-                        st.session_state.app_state["experiment"]["progress"] = 20 * completed_pumps
-                
-                update_last_update()
-                
-                del st.session_state.app_state[f"pump_{pump_id}_start_time"]
-                del st.session_state.app_state[f"pump_{pump_id}_duration"]
+def history_since(window):
+    days = HISTORY_WINDOWS[window]
+    return None if days is None else (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
 
-def stop_pump(pump_id):
-    st.session_state.app_state["pumps"][pump_id]["running"] = False
-    add_system_log(f"Pump {pump_id} manually stopped")
-    update_last_update()
-
-def run_experiment():
-    add_system_log("Starting experiment procedure: Protein reaction detection")
-    update_last_update()
-    st.session_state.app_state["experiment"]["current_step"] = 3
-    st.session_state.app_state["experiment"]["progress"] = 40
-    st.session_state.app_state["experiment"]["experiment_start_time"] = time.time()
-    st.session_state.app_state["experiment"]["current_step_start_time"] = time.time()
-    st.session_state.app_state["experiment"]["running"] = True
-
-def check_experiment_progress():
-    if not st.session_state.app_state["experiment"].get("running", False):
+def load_affinity_history(window, proteins):
+    """Load the selected proteins' archived runs for the history window into this session.
+    
+    Only the catalog's partitions for those proteins and dates are read. Adding
+    proteins to the selection reads just theirs; a new window or a removed
+    protein reloads the selection.
+    """
+    app_state = st.session_state.app_state
+    proteins = frozenset(proteins)
+    loaded_window, loaded = app_state["history_window"] or (None, frozenset())
+    if loaded_window == window and proteins == loaded:
         return
     
-    current_step = st.session_state.app_state["experiment"]["current_step"]
-    step_start_time = st.session_state.app_state["experiment"]["current_step_start_time"]
+    affinity_data = app_state["affinity_data"]
+    if loaded_window == window and proteins > loaded:
+        wanted = proteins - loaded
+    else:
+        affinity_data.clear()
+        app_state["fit_cache"].clear()
+        wanted = proteins
+    partitions = app_state["experiment_store"].iter_partitions(wanted, since=history_since(window)) if wanted else []
+    if affinity_data:
+        # Adding to loaded data: rows this session imported may already be there
+        partitions = list(partitions)
+        if partitions:
+            batch = pd.concat(partitions, ignore_index=True)
+            row_keys = row_hashes(batch)
+            new = ~affinity_data.known_rows(row_keys)
+            affinity_data.append(batch[new].reset_index(drop=True), row_keys[new])
+    else:
+        for partition in partitions:
+            affinity_data.append(partition)
+    app_state["fit_cache"].invalidate(wanted)
+    app_state["history_window"] = (window, proteins)
+
+def fit_affinity_curve(protein, concentrations, affinities):
+    """Fit concentration-affinity curve, reusing the cached fit when the points are unchanged"""
+    return fit_affinity_curves([(protein, concentrations, affinities)]).get(protein)
+
+@metrics.timed()
+def fit_affinity_curves(groups, failures=None):
+    """Fit all (protein, concentrations, affinities) groups in one batch; failed fits are reported and skipped.
     
-    step_durations = {
-        3: 10,
-        4: 10,
-        5: 1
+    Every protein is fitted against all registered binding models and keeps the lowest-AICc one.
+
+    Failure messages are also collected into the failures dict when one is given.
+    """
+    fit_cache = st.session_state.app_state["fit_cache"]
+    hits, misses = fit_cache.hits, fit_cache.misses
+    fits = fit_cache.get_or_fit_many(groups, AUTO_MODEL)
+    metrics.incr("fits_total", fit_cache.misses - misses, kind="point")
+    metrics.incr("fit_cache_hits_total", fit_cache.hits - hits, kind="point")
+    for protein, fit_result in fits.items():
+        if "error" in fit_result:
+            st.warning(f"Curve fitting failed for {protein}: {fit_result['error']}")
+            if failures is not None:
+                failures[protein] = fit_result["error"]
+    return {protein: fit_result for protein, fit_result in fits.items() if "error" not in fit_result}
+
+@metrics.timed()
+def bootstrap_affinity_curves(groups, n_resamples=2000):
+    """Bootstrap 95% Kd/Bmax confidence intervals for all groups; cached like the point fits"""
+    fit_cache = st.session_state.app_state["fit_cache"]
+    hits, misses = fit_cache.hits, fit_cache.misses
+    boots = fit_cache.get_or_bootstrap_many(groups, n_resamples)
+    metrics.incr("fits_total", fit_cache.misses - misses, kind="bootstrap")
+    metrics.incr("fit_cache_hits_total", fit_cache.hits - hits, kind="bootstrap")
+    return {protein: result for protein, result in boots.items() if "error" not in result}
+
+def start_pump(pump_id):
+    if send_command("start_pump", pump_id) is None and not platform_state()["pumps"][pump_id]["running"]:
+        return
+    st.info(f"Pump {platform_state()['pumps'][pump_id]['number']} running...")
+
+def stop_pump(pump_id):
+    send_command("stop_pump", pump_id)
+
+def update_pump_settings(pump_id):
+    send_command("set_pump", pump_id, st.session_state[f"flow_{pump_id}"], st.session_state[f"time_{pump_id}"])
+
+def run_experiment(chip_id):
+    send_command("run_procedure", chip_id)
+
+STEP_STATE_COLORS = {
+    "pending": ("#f5f5f5", "#8c8c8c"),
+    "running": ("#fff7e6", "#fa8c16"),
+    "done": ("#e6f7ff", "#1890ff"),
+    "failed": ("#fff1f0", "#ff4d4f"),
+    "cancelled": ("#fff1f0", "#ff4d4f")
+}
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    return f"{seconds//60}min{seconds%60}s"
+
+def chip_pump(chip, number):
+    """Shared state of a chip's pump by its number on the chip (as procedures refer to it)"""
+    return platform_state()["pumps"][chip["pumps"][number - 1]]
+
+def procedure_durations(chip):
+    """Step durations in seconds, taking pump steps without a duration from the pump settings"""
+    return {
+        step["id"]: float(step.get("duration") or chip_pump(chip, step["pump"])["time"]/5)
+        for step in chip["procedure"]["steps"]
     }
-    
-    if current_step in step_durations and time.time() - step_start_time >= step_durations[current_step]:
-        if current_step == 3:
-            add_system_log("Step 3 completed: Mixing reaction ended")
-            st.session_state.app_state["experiment"]["steps_completed"][3] = True
-            st.session_state.app_state["experiment"]["progress"] = 60
-        elif current_step == 4:
-            add_system_log("Step 4 completed: FCS data collection ended")
-            st.session_state.app_state["experiment"]["steps_completed"][4] = True
-            st.session_state.app_state["experiment"]["progress"] = 80
-        elif current_step == 5:
-            add_system_log("Step 5 completed: Affinity data analysis ended")
-            st.session_state.app_state["experiment"]["steps_completed"][5] = True
-            st.session_state.app_state["experiment"]["progress"] = 100
-            st.session_state.app_state["experiment"]["remaining_time"] = "0 minutes"
-            add_system_log("Experiment procedure completed")
-            st.session_state.app_state["experiment"]["running"] = False
-            st.success("Experiment procedure completed")
-        
-        update_last_update()
-        
-        if current_step < 5:
-            current_step += 1
-            st.session_state.app_state["experiment"]["current_step"] = current_step
-            st.session_state.app_state["experiment"]["current_step_start_time"] = time.time()
-            
-            if current_step == 4:
-                add_system_log("Step 4 started: FCS data collection, waiting 5 minutes")
-            elif current_step == 5:
-                add_system_log("Step 5 started: Affinity data analysis")
-    else:
-        if current_step in step_durations:
-            remaining = int(step_durations[current_step] - (time.time() - step_start_time))
-            st.session_state.app_state["experiment"]["remaining_time"] = f"{remaining//60}min{remaining%60}s"
+
+def describe_step(step, chip):
+    if step["type"] == "pump_injection":
+        pump = chip_pump(chip, step["pump"])
+        return f"Pump {step['pump']} | {step.get('flow', pump['flow'])}μL/min | {step.get('duration') or pump['time']/5:g}s"
+    return f"{STEP_TYPES[step['type']]} | {format_duration(step['duration'])}"
+
+def add_procedure_step(chip_id, name, step_type, pump_number, duration, after):
+    send_command("add_step", chip_id, name, step_type, pump_number, duration, after)
+
+def load_procedure_file(chip_id, uploaded_file):
+    try:
+        procedure = json.load(uploaded_file)
+    except ValueError as e:
+        st.error(f"Procedure not loaded: {e}")
+        return
+    if isinstance(procedure, dict):
+        procedure.setdefault("name", uploaded_file.name)
+    send_command("load_procedure", chip_id, procedure)
+
+def plan_titration_file(uploaded_file, chip_ids):
+    """Plan a screen definition on the chosen chips; problems are shown to the operator"""
+    try:
+        spec = json.loads(uploaded_file.getvalue())
+        return plan_titration(spec, st.session_state.app_state["controller"].topology, chip_ids)
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        st.error(f"No titration plan: {e}")
+
+def load_titration_plan(plan):
+    for chip_id, procedure in plan_procedures(plan).items():
+        chip = plan["chips"][chip_id]
+        send_command("load_procedure", chip_id, procedure,
+                     f"Loaded titration plan: {plan['name']} ({sum(len(block['conditions']) for block in chip['blocks'])} conditions)")
 
 def emergency_stop():
-    for pump_id in st.session_state.app_state["pumps"]:
-        if st.session_state.app_state["pumps"][pump_id]["running"]:
-            st.session_state.app_state["pumps"][pump_id]["running"] = False
-    st.session_state.app_state["emergency_status"] = True
-    add_system_log("System emergency stop executed")
-    update_last_update()
-    st.session_state.message_display = {
-        'show': True,
-        'type': 'warning',
-        'content': "Emergency stop executed, all devices stopped",
-        'timestamp': time.time()
-    }
+    st.session_state.app_state["controller"].emergency_stop()
 
 def reset_after_emergency():
-    st.session_state.app_state["emergency_status"] = False
-    st.session_state.app_state["experiment"] = {
-        "current_step": 0,
-        "total_steps": 5,
-        "progress": 0,
-        "remaining_time": "--minutes",
-        "steps_completed": {1: False, 2: False, 3: False, 4: False, 5: False}
-    }
-    for pump_id in [1, 2]:
-        if "completed" in st.session_state.app_state["pumps"][pump_id]:
-            st.session_state.app_state["pumps"][pump_id]["completed"] = False
-    
-    add_system_log("Emergency situation resolved, system returned to normal state")
-    update_last_update()
-    st.session_state.message_display = {
-        'show': True,
-        'type': 'success',
-        'content': "System returned to normal, experiment can be restarted",
-        'timestamp': time.time()
-    }
+    send_command("reset_emergency")
 
-def generate_realtime_chart():
-    x = list(range(20))
-    base = np.linspace(0.1, 0.6, 20)
-    noise = np.random.normal(0, 0.02, 20)
-    y = base + noise
+@metrics.timed()
+def generate_realtime_chart(chip_id, max_points=1000, kinetic_fit=None):
+    """A chip's absorbance trace from its acquisition ring buffer, LTTB-downsampled for display, with the live kinetic fit"""
+    t, y = st.session_state.app_state["controller"].chips[chip_id].acquisition.view(max_points)
     
     fig = go.Figure()
-    fig.add_trace(go.Scatter(x=x, y=y, mode='lines', name='Absorbance (527nm)',
+    fig.add_trace(go.Scattergl(x=t, y=y, mode='lines', name='Absorbance (527nm)',
                             line=dict(color='#165DFF'),
                             fill='tozeroy', fillcolor='rgba(22, 93, 255, 0.1)'))
+    if kinetic_fit is not None:
+        t_fit, y_fit = fit_curve(kinetic_fit)
+        fig.add_trace(go.Scatter(x=t_fit, y=y_fit, mode='lines', name='Kinetic fit',
+                                 line=dict(color='#fa8c16', dash='dash')))
     
     fig.update_layout(
         height=200,
         margin=dict(l=20, r=20, t=20, b=20),
-        xaxis_title='Time points',
+        xaxis_title='Time (s)',
         yaxis_title='Absorbance',
         showlegend=False
     )
     return fig
 
-def generate_affinity_chart():
+def describe_kinetics(kinetics):
+    """One-line summary of the live kon/koff/KD estimates"""
+    def rate(value, se, unit):
+        if value is None:
+            return "--"
+        return f"{value:.3g} ± {se:.2g} {unit}" if se is not None else f"{value:.3g} {unit}"
+    parts = [
+        f"kobs {rate(kinetics['kobs'], kinetics['kobs_se'], 's⁻¹')}",
+        f"koff {rate(kinetics['koff'], kinetics['koff_se'], 's⁻¹')}",
+        f"kon {rate(kinetics['kon'], None, 'μM⁻¹s⁻¹') if kinetics['concentration'] else '-- (no concentration)'}",
+        f"KD {rate(kinetics['kd'], None, 'μM')}",
+    ]
+    if kinetics["phase"]:
+        parts.append(f"fitting {kinetics['phase']}" + (", plateau reached" if kinetics["plateau"] else ""))
+    return " | ".join(parts)
+
+def cached_figure(name, key, build):
+    """Return build()'s result, reused while key (data version and options) is unchanged.
+
+    One entry per chart name, so a new data version replaces the old figure
+    instead of accumulating. Returns (result, hit).
+    """
+    figure_cache = st.session_state.app_state["figure_cache"]
+    entry = figure_cache.get(name)
+    if entry is not None and entry[0] == key:
+        metrics.incr("figure_cache_hits_total", chart=name)
+        return entry[1], True
+    result = build()
+    figure_cache[name] = (key, result)
+    metrics.incr("figure_builds_total", chart=name)
+    return result, False
+
+def display_points(concentrations, affinities, mode="auto", max_points=DISPLAY_MAX_POINTS):
+    """Points to draw for one protein as (x, y, y_sd); y_sd is None unless aggregated.
+
+    "aggregate" draws the mean ± SD at each concentration, "decimate" an evenly
+    strided subsample in concentration order. "auto" keeps small groups as they
+    are and otherwise aggregates, falling back to decimation when there are
+    too many distinct concentrations. Fits always use every point.
+    """
+    n = len(concentrations)
+    if mode == "all" or (mode == "auto" and n <= max_points):
+        return concentrations, affinities, None
+    
+    levels, inverse, counts = np.unique(concentrations, return_inverse=True, return_counts=True)
+    if mode == "aggregate" or (mode == "auto" and len(levels) <= max_points):
+        means = np.bincount(inverse, weights=affinities) / counts
+        sd = np.sqrt(np.bincount(inverse, weights=(affinities - means[inverse]) ** 2) / counts)
+        return levels, means, sd
+    
+    order = np.argsort(concentrations, kind="stable")[::-(-n // max_points)]
+    return concentrations[order], affinities[order], None
+
+@metrics.timed()
+def generate_affinity_chart(bootstrap=False, display="auto"):
     affinity_data = st.session_state.app_state["affinity_data"]
     if not affinity_data:
         return None
     
-    proteins = list(set(item["protein"] for item in affinity_data))
+    (fig, failures), hit = cached_figure(
+        "affinity_chart", (affinity_data.version, bootstrap, display),
+        lambda: build_affinity_chart(affinity_data, bootstrap, display)
+    )
+    if hit:
+        # A fresh build reports these from fit_affinity_curves
+        for protein, error in failures.items():
+            st.warning(f"Curve fitting failed for {protein}: {error}")
+    return fig
+
+def build_affinity_chart(affinity_data, bootstrap, display):
+    """(figure, fit failures) for the current data"""
+    groups = list(affinity_data.groups())
+    failures = {}
+    fits = fit_affinity_curves([group for group in groups if len(group[1]) >= 3], failures)
+    boots = bootstrap_affinity_curves([group for group in groups if group[0] in fits]) if bootstrap else {}
+    
+    points = [(protein, concentrations) + display_points(concentrations, affinities, display)
+              for protein, concentrations, affinities in groups]
+    scatter = go.Scattergl if sum(len(x) for _, _, x, _, _ in points) > WEBGL_POINT_THRESHOLD else go.Scatter
     
     fig = go.Figure()
     
-    for protein in proteins:
-        protein_data = [item for item in affinity_data if item["protein"] == protein]
-        concentrations = [item["concentration"] for item in protein_data]
-        affinities = [item["affinity"] for item in protein_data]
-        
-        fig.add_trace(go.Scatter(
-            x=concentrations,
-            y=affinities,
+    for protein, concentrations, x, y, y_sd in points:
+        fig.add_trace(scatter(
+            x=x,
+            y=y,
             mode='markers',
-            name=protein,
-            marker=dict(size=8)
+            name=protein if y_sd is None else f'{protein} (mean ± SD)',
+            marker=dict(size=8 if scatter is go.Scatter else 5),
+            error_y=None if y_sd is None else dict(type='data', array=y_sd, thickness=1)
         ))
         
-        if len(concentrations) >= 3:
-            fit_result = fit_affinity_curve(concentrations, affinities)
-            if fit_result:
-                x_fit = np.linspace(min(concentrations), max(concentrations), 100)
-                y_fit = fit_result["model"](x_fit, *fit_result["params"])
-                fig.add_trace(go.Scatter(
-                    x=x_fit,
-                    y=y_fit,
-                    mode='lines',
-                    name=f'{protein} Fitted Curve',
-                    line=dict(dash='dash')
-                ))
+        fit_result = fits.get(protein)
+        if fit_result:
+            x_fit = np.linspace(concentrations.min(), concentrations.max(), 100)
+            model = fit_result["model"]
+            y_fit = model(x_fit, *fit_result["params"])
+            fig.add_trace(go.Scatter(
+                x=x_fit,
+                y=y_fit,
+                mode='lines',
+                name=f'{protein} {model.label} fit',
+                hovertemplate=f'{model.label}: {model.describe(fit_result["params"])}<extra>{protein}</extra>',
+                line=dict(dash='dash')
+            ))
+        
+        boot = boots.get(protein)
+        if boot:
+            # Kd marker at half-maximal binding, with 95% CI error bars on Kd and Bmax/2
+            fig.add_trace(go.Scatter(
+                x=[boot["kd"]],
+                y=[boot["bmax"] / 2],
+                mode='markers',
+                name=f'{protein} Kd (95% CI)',
+                marker=dict(symbol='diamond', size=10),
+                error_x=dict(type='data', symmetric=False,
+                             array=[boot["kd_hi"] - boot["kd"]], arrayminus=[boot["kd"] - boot["kd_lo"]]),
+                error_y=dict(type='data', symmetric=False,
+                             array=[(boot["bmax_hi"] - boot["bmax"]) / 2], arrayminus=[(boot["bmax"] - boot["bmax_lo"]) / 2])
+            ))
     
     fig.update_layout(
         height=400,
@@ -292,29 +562,53 @@ def generate_affinity_chart():
         showlegend=True
     )
     
-    return fig
+    return fig, failures
 
-def generate_affinity_ranking():
+@metrics.timed()
+def generate_affinity_ranking(bootstrap=False):
     affinity_data = st.session_state.app_state["affinity_data"]
     if not affinity_data:
         return None, None
     
-    protein_avg = {}
-    for item in affinity_data:
-        if item["protein"] not in protein_avg:
-            protein_avg[item["protein"]] = []
-        protein_avg[item["protein"]].append(item["affinity"])
-    
-    protein_stats = []
-    for protein, values in protein_avg.items():
-        protein_stats.append({
-            "protein": protein,
-            "avg_affinity": np.mean(values),
-            "std_affinity": np.std(values),
-            "count": len(values)
-        })
+    return cached_figure(
+        "affinity_ranking", (affinity_data.version, bootstrap),
+        lambda: build_affinity_ranking(affinity_data, bootstrap)
+    )[0]
+
+def build_affinity_ranking(affinity_data, bootstrap):
+    """(figure, per-protein statistics) ranked by mean affinity, or by Kd upper bound with bootstrap"""
+    groups = list(affinity_data.groups())
+    fits = fit_affinity_curves([group for group in groups if len(group[1]) >= 3])
+    if bootstrap:
+        boots = bootstrap_affinity_curves([group for group in groups if group[0] in fits])
+        protein_stats = rank_proteins(affinity_data.statistics(), boots, fits)
+        if not protein_stats:
+            return None, None
+        
+        fig = go.Figure()
+        fig.add_trace(go.Bar(
+            x=[item["protein"] for item in protein_stats],
+            y=[item["kd"] for item in protein_stats],
+            error_y=dict(
+                type='data',
+                symmetric=False,
+                array=[item["kd_hi"] - item["kd"] for item in protein_stats],
+                arrayminus=[item["kd"] - item["kd_lo"] for item in protein_stats],
+                visible=True
+            ),
+            marker_color=np.linspace(0, 1, len(protein_stats))
+        ))
+        fig.update_layout(
+            height=350,
+            margin=dict(l=20, r=20, t=30, b=20),
+            xaxis_title='Protein Name',
+            yaxis_title='Kd (μM, 95% bootstrap CI)',
+            title='Affinity Ranking by Kd Upper Confidence Bound',
+            showlegend=False
+        )
+        return fig, protein_stats
     
-    protein_stats.sort(key=lambda x: x["avg_affinity"], reverse=True)
+    protein_stats = rank_proteins(affinity_data.statistics(), fits=fits)
     
     fig = go.Figure()
     fig.add_trace(go.Bar(
@@ -339,82 +633,44 @@ def generate_affinity_ranking():
     
     return fig, protein_stats
 
-check_experiment_progress()
-
-check_pump_status()
-
-st.title("🧪 Microfluidic Test Platform Control Software")
-st.caption(f"Last update: {st.session_state.app_state['last_update']}")
-
-if st.session_state.message_display['show']:
-    elapsed = time.time() - st.session_state.message_display['timestamp']
-    if elapsed < 5:
-        if st.session_state.message_display['type'] == 'warning':
-            st.warning(st.session_state.message_display['content'])
-        else:
-            st.success(st.session_state.message_display['content'])
-    else:
-        st.session_state.message_display['show'] = False
-
-top_row = st.columns([1, 4])
-with top_row[0]:
-    st.button("⚠️ Emergency Stop", on_click=emergency_stop, type="primary", use_container_width=True, key="emergency_stop_btn")
-    if st.session_state.app_state["emergency_status"]:
-        st.button("✅ Issue Resolved, Restart Experiment", on_click=reset_after_emergency, type="secondary", use_container_width=True, key="reset_emergency_btn")
-
-with top_row[1]:
-    status_cols = st.columns(3)
-    with status_cols[0]:
-        st.info("""
-        **Fluid Transfer System**  
-        Pumps × 3  
-        🟢 Operating normally
-        """, icon="💧")
-    with status_cols[1]:
-        st.info("""
-        **Data Analysis System**  
-        FCS data processing  
-        🟢 Operating normally
-        """, icon="📊")
-    with status_cols[2]:
-        st.info("""
-        **Current Task**  
-        Experiment ID: EXP-20230515-002  
-        🔄 In progress
-        """, icon="🔬")
-
-st.divider()
-
-workspace = st.columns([6, 7])
-
-with workspace[0]:
-    st.subheader("🔧 Experiment Control Center")
+# Live panels refresh on their own as fragments; the rest of the script (including the
+# analysis panels with curve fits) only reruns on user interaction
+@st.fragment(run_every=PUMP_PANEL_REFRESH)
+def pump_control_panel():
+    metrics.incr("fragment_runs_total", fragment="pump_control")
+    state = platform_state()
+    chip = state["chips"][selected_chip()]
+    chip_busy = chip["experiment"]["running"]
     
     with st.container(border=True):
-        st.markdown("### 💧 Pump Control")
-        pump_cols = st.columns(3)
-        for idx, pump_id in enumerate([1, 2, 3]):
-            with pump_cols[idx]:
-                pump = st.session_state.app_state["pumps"][pump_id]
-                st.markdown(f"**Pump {pump_id}**<br>{pump['name']}", unsafe_allow_html=True)
+        st.markdown(f"### 💧 Pump Control: {chip['name']}" if len(state["chips"]) > 1 else "### 💧 Pump Control")
+        # Only the selected chip's pumps are drawn, in rows of PUMP_COLUMNS
+        pump_cols = st.columns(min(len(chip["pumps"]), PUMP_COLUMNS))
+        for idx, pump_id in enumerate(chip["pumps"]):
+            with pump_cols[idx % PUMP_COLUMNS]:
+                pump = state["pumps"][pump_id]
+                st.markdown(f"**Pump {pump['number']}**<br>{pump['name']}", unsafe_allow_html=True)
                 
-                flow = st.number_input(
+                # Inputs follow the shared settings, so a change made in another session shows up here
+                st.session_state[f"flow_{pump_id}"] = pump["flow"]
+                st.session_state[f"time_{pump_id}"] = pump["time"]
+                st.number_input(
                     "Flow rate (μL/min)", 
                     min_value=0, 
                     max_value=1000, 
-                    value=pump["flow"],
-                    key=f"flow_{pump_id}"
+                    key=f"flow_{pump_id}",
+                    on_change=update_pump_settings,
+                    args=(pump_id,)
                 )
-                st.session_state.app_state["pumps"][pump_id]["flow"] = flow
                 
-                time_val = st.number_input(
+                st.number_input(
                     "Time (s)", 
                     min_value=1, 
                     max_value=3600, 
-                    value=pump["time"],
-                    key=f"time_{pump_id}"
+                    key=f"time_{pump_id}",
+                    on_change=update_pump_settings,
+                    args=(pump_id,)
                 )
-                st.session_state.app_state["pumps"][pump_id]["time"] = time_val
                 
                 run_col1, run_col2 = st.columns(2)
                 with run_col1:
@@ -422,7 +678,7 @@ with workspace[0]:
                         "Start", 
                         on_click=start_pump, 
                         args=(pump_id,),
-                        disabled=pump["running"] or st.session_state.app_state["emergency_status"],
+                        disabled=pump["running"] or state["emergency_status"] or chip_busy,
                         key=f"start_pump_{pump_id}",
                         type="primary",
                         use_container_width=True
@@ -438,97 +694,271 @@ with workspace[0]:
                         use_container_width=True
                     )
                 
-                status = "Running ⚠️" if pump["running"] else "Ready ✅"
+                status = "Running ⚠️" if pump["running"] else ("Held by procedure 🔒" if chip_busy else "Ready ✅")
                 st.caption(f"Status: {status}")
-    
+
+@st.fragment(run_every=PROCEDURE_PANEL_REFRESH)
+def procedure_panel():
+    metrics.incr("fragment_runs_total", fragment="procedure")
     with st.container(border=True):
         st.markdown("### 📋 Experiment Procedure Design")
-        with st.expander("Current procedure: Protein reaction detection", expanded=True):
-            st.markdown("Contains 5 steps | Estimated duration: 15 minutes")
+        state = platform_state()
+        chip_id = selected_chip()
+        chip = state["chips"][chip_id]
+        procedure = chip["procedure"]
+        experiment = chip["experiment"]
+        procedure_running = experiment["running"]
+        step_states = experiment["step_states"]
+        step_names = {step["id"]: step.get("name", step["id"]) for step in procedure["steps"]}
+        by_id = {step["id"]: step for step in procedure["steps"]}
+        
+        with st.expander(f"Current procedure: {procedure['name']}", expanded=True):
+            total_seconds, _ = critical_path(procedure["steps"], procedure_durations(chip))
+            st.markdown(f"Contains {len(procedure['steps'])} steps | Estimated duration: {format_duration(total_seconds)}")
             
-            for step in range(1, 6):
-                if step == 1:
-                    bg_color = "#e6f7ff" if st.session_state.app_state["pumps"][1]["completed"] else "#f5f5f5"
-                    step_num_color = "#1890ff" if st.session_state.app_state["pumps"][1]["completed"] else "#8c8c8c"
-                elif step == 2:
-                    bg_color = "#e6f7ff" if st.session_state.app_state["pumps"][2]["completed"] else "#f5f5f5"
-                    step_num_color = "#1890ff" if st.session_state.app_state["pumps"][2]["completed"] else "#8c8c8c"
-                else:
-                    bg_color = "#e6f7ff" if st.session_state.app_state["experiment"]["steps_completed"].get(step, False) else "#f5f5f5"
-                    step_num_color = "#1890ff" if st.session_state.app_state["experiment"]["steps_completed"].get(step, False) else "#8c8c8c"
-                
-                if step == 1:
-                    if st.session_state.app_state["pumps"][1]["completed"]:
-                        step_detail = f"Pump 1 | {st.session_state.app_state['pumps'][1]['flow']}μL/min | {st.session_state.app_state['pumps'][1]['time']}s"
-                    else:
-                        step_detail = "Pump 1 | --μL/min | --s"
-                elif step == 2:
-                    if st.session_state.app_state["pumps"][2]["completed"]:
-                        step_detail = f"Pump 2 | {st.session_state.app_state['pumps'][2]['flow']}μL/min | {st.session_state.app_state['pumps'][2]['time']}s"
-                    else:
-                        step_detail = "Pump 2 | --μL/min | --s"
-                else:
-                    step_detail = ["Incubation | 5min", "FCS detection", "Affinity analysis"][step-3]             
+            for number, step_id in enumerate(topological_order(procedure["steps"]), 1):
+                step = by_id[step_id]
+                bg_color, step_num_color = STEP_STATE_COLORS.get(step_states.get(step_id, "pending"), STEP_STATE_COLORS["pending"])
+                step_detail = describe_step(step, chip)
+                if step.get("after"):
+                    step_detail += " | after " + ", ".join(step_names[dep] for dep in step["after"])
                 
                 st.markdown(f"""
                 <div style="background-color: {bg_color}; padding: 10px; border-radius: 5px; margin: 5px 0;">
                     <div style="display: flex; align-items: center;">
                         <div style="background-color: {step_num_color}; color: white; width: 20px; height: 20px; border-radius: 50%; 
                                     display: flex; align-items: center; justify-content: center; margin-right: 10px;">
-                            {step}
+                            {number}
                         </div>
                         <div style="flex-grow: 1;">
-                            {
-                                ["Inject protein A", "Inject protein B", "Inject buffer", "Data collection", "Result analysis"][step-1]
-                            }
+                            {step_names[step_id]}
                             <div style="font-size: 12px; color: #666;">
                                 {step_detail}
                             </div>
                         </div>
-                        <div>
-                            <button style="background: none; border: none; color: #1890ff; cursor: pointer;">✏️</button>
-                            <button style="background: none; border: none; color: #ff4d4d; cursor: pointer;">🗑️</button>
-                        </div>
                     </div>
                 </div>
                 """, unsafe_allow_html=True)
             
             col_btn1, col_btn2 = st.columns(2)
             with col_btn1:
-                st.button("➕ Add Step", key="add_step_btn", use_container_width=True)
+                if st.button("➕ Add Step", key="add_step_btn", use_container_width=True, disabled=procedure_running):
+                    st.session_state.show_add_step = not st.session_state.get("show_add_step", False)
             with col_btn2:
-                can_run = st.session_state.app_state["pumps"][1]["completed"] and st.session_state.app_state["pumps"][2]["completed"]
-                st.button("▶️ Run Procedure", on_click=run_experiment, key="run_process_btn", 
+                can_run = not procedure_running and not state["emergency_status"]
+                st.button("▶️ Run Procedure", on_click=run_experiment, args=(chip_id,), key="run_process_btn", 
                          type="primary", use_container_width=True, disabled=not can_run)
+            
+            if st.session_state.get("show_add_step", False) and not procedure_running:
+                with st.form("add_step_form", clear_on_submit=True):
+                    new_name = st.text_input("Step name")
+                    new_type = st.selectbox("Step type", list(STEP_TYPES), format_func=STEP_TYPES.get)
+                    new_pump = st.selectbox("Pump (pump injections only)", range(1, len(chip["pumps"]) + 1),
+                                            format_func=lambda number: f"Pump {number}: {chip_pump(chip, number)['name']}")
+                    new_duration = st.number_input("Duration (s, 0 = pump setting)", min_value=0, max_value=3600, value=10)
+                    new_after = st.multiselect("Runs after", list(step_names), format_func=step_names.get)
+                    if st.form_submit_button("Add to procedure", type="primary"):
+                        add_procedure_step(chip_id, new_name, new_type, new_pump, new_duration, new_after)
+            
+            procedure_file = st.file_uploader("Load procedure definition (JSON)", type=["json"], key="procedure_uploader",
+                                              disabled=procedure_running)
+            if procedure_file is not None and st.session_state.get("loaded_procedure_file") != (chip_id, procedure_file.name, procedure_file.size):
+                st.session_state.loaded_procedure_file = (chip_id, procedure_file.name, procedure_file.size)
+                load_procedure_file(chip_id, procedure_file)
+
+def titration_panel():
+    with st.container(border=True):
+        st.markdown("### 🧮 Titration Planner")
+        state = platform_state()
+        with st.expander("Plan a titration screen", expanded=False):
+            screen_file = st.file_uploader("Screen definition (JSON)", type=["json"], key="titration_uploader")
+            idle = [chip_id for chip_id, chip in state["chips"].items() if not chip["experiment"]["running"]]
+            chip_ids = st.multiselect("Chips", idle, default=idle, key="titration_chips",
+                                      format_func=lambda chip_id: state["chips"][chip_id]["name"])
+            if screen_file is None or not chip_ids:
+                st.caption("Upload a screen definition (see screens/example_96.json) and pick idle chips to plan it on")
+                return
+            key = (screen_file.file_id, tuple(chip_ids))
+            if st.session_state.get("titration_plan_key") != key:
+                st.session_state.titration_plan_key = key
+                st.session_state.titration_plan = plan_titration_file(screen_file, chip_ids)
+            plan = st.session_state.titration_plan
+            if plan is None:
+                return
+            
+            st.markdown(describe_plan(plan))
+            st.dataframe(pd.DataFrame([
+                {
+                    "Chip": chip["name"],
+                    "Proteins": ", ".join(f"{block['protein']} (pump {block['pump']})" for block in chip["blocks"]),
+                    "Conditions": sum(len(block["conditions"]) for block in chip["blocks"]),
+                    "Duration": format_duration(chip["seconds"]),
+                    "Buffer (μL)": round(chip["buffer_volume"]),
+                }
+                for chip in plan["chips"].values()
+            ]), hide_index=True, use_container_width=True)
+            st.button("📥 Load plan into procedures", on_click=load_titration_plan, args=(plan,), key="load_titration_btn",
+                      type="primary", use_container_width=True,
+                      disabled=any(state["chips"][chip_id]["experiment"]["running"] for chip_id in plan["chips"]))
+
+@st.fragment(run_every=MONITORING_PANEL_REFRESH)
+def monitoring_panel():
+    metrics.incr("fragment_runs_total", fragment="monitoring")
+    state = platform_state()
+    chip_id = selected_chip()
+    chip = state["chips"][chip_id]
+    experiment = chip["experiment"]
     
     with st.container(border=True):
         st.markdown("### 🔍 Real-time Monitoring")
         progress_cols = st.columns([1, 2])
         with progress_cols[0]:
             st.markdown("#### Reaction Progress")
-            progress = st.session_state.app_state["experiment"]["progress"]
+            progress = experiment["progress"]
             st.progress(progress)
             
-            current_step = st.session_state.app_state["experiment"]["current_step"]
-            total_steps = st.session_state.app_state["experiment"]["total_steps"]
+            current_step = experiment["current_step"]
+            total_steps = experiment["total_steps"]
             st.markdown(f"Step {current_step}/{total_steps}")
             
-            if current_step == 0:
+            running_steps = experiment["running_steps"]
+            step_names = {step["id"]: step.get("name", step["id"]) for step in chip["procedure"]["steps"]}
+            if running_steps:
+                st.markdown("Executing: " + ", ".join(step_names.get(step_id, step_id) for step_id in running_steps))
+            elif current_step == 0:
                 st.markdown("Ready, waiting to start")
-            elif current_step in [1, 2]:
-                if st.session_state.app_state["pumps"][1]["running"]:
-                    st.markdown("Executing: Pump 1 injection")
-                elif st.session_state.app_state["pumps"][2]["running"]:
-                    st.markdown("Executing: Pump 2 injection")
-                else:
-                    completed_pumps = sum(1 for p in [1, 2] if st.session_state.app_state["pumps"][p]["completed"])
-                    st.markdown(f"Completed: {completed_pumps} pump injections")
+            else:
+                st.markdown(f"Completed: {current_step} steps")
             
-            st.markdown(f"Remaining time: {st.session_state.app_state['experiment']['remaining_time']}")
+            st.markdown(f"Remaining time: {experiment['remaining_time']}")
         
         with progress_cols[1]:
             st.markdown("#### Real-time Data")
-            st.plotly_chart(generate_realtime_chart(), use_container_width=True)
+            kinetics = chip["kinetics"]
+            st.plotly_chart(generate_realtime_chart(chip_id, kinetic_fit=kinetics["fit"] if kinetics["phase"] else None),
+                            use_container_width=True)
+            st.caption(describe_kinetics(kinetics))
+
+@st.fragment(run_every=LOG_PANEL_REFRESH)
+def system_log_panel():
+    metrics.incr("fragment_runs_total", fragment="system_log")
+    with st.container(border=True):
+        st.subheader("📝 System Log")
+        system_log = st.session_state.app_state["controller"].system_log
+        filter_cols = st.columns([2, 2, 3, 1])
+        with filter_cols[0]:
+            levels = st.multiselect("Level", LEVELS, default=["INFO", "WARNING", "ERROR"], key="log_levels")
+        with filter_cols[1]:
+            subsystems = st.multiselect("Subsystem", SUBSYSTEMS, key="log_subsystems", placeholder="All")
+        with filter_cols[2]:
+            search = st.text_input("Search", key="log_search", placeholder="Text in message")
+        
+        records = system_log.query(levels, subsystems, search)
+        with filter_cols[3]:
+            page = st.number_input("Page", min_value=1, value=1, key="log_page")
+        page_records, pages = paginate(records, page, LOG_PAGE_SIZE)
+        
+        st.dataframe(
+            pd.DataFrame(
+                [{
+                    "time": record["time"].strftime("%H:%M:%S"),
+                    "level": record["level"],
+                    "subsystem": record["subsystem"],
+                    "pump": "" if record["pump_id"] is None else str(record["pump_id"]),
+                    "step": record["step_id"] or "",
+                    "message": record["message"]
+                } for record in page_records],
+                columns=["time", "level", "subsystem", "pump", "step", "message"]
+            ),
+            hide_index=True, use_container_width=True, height=250
+        )
+        history = f" | full history in {system_log.path}" if system_log.path else ""
+        st.caption(f"{len(records)} matching of {len(system_log)} in memory | page {min(page, pages)}/{pages}{history}")
+
+@st.fragment(run_every=CHIP_OVERVIEW_REFRESH)
+def chip_overview_panel():
+    """One row per chip, so the whole platform is visible without drawing every pump"""
+    metrics.incr("fragment_runs_total", fragment="chip_overview")
+    state = platform_state()
+    pumps = state["pumps"]
+    rows = []
+    for chip_id, chip in state["chips"].items():
+        experiment = chip["experiment"]
+        running_pumps = sum(pumps[pump_id]["running"] for pump_id in chip["pumps"])
+        rows.append({
+            "chip": chip["name"],
+            "procedure": chip["procedure"].get("name", ""),
+            "status": "Running" if experiment["running"] else ("Done" if experiment["current_step"] == experiment["total_steps"] else "Idle"),
+            "progress": experiment["progress"],
+            "step": f"{experiment['current_step']}/{experiment['total_steps']}",
+            "remaining": experiment["remaining_time"] if experiment["running"] else "",
+            "pumps running": f"{running_pumps}/{len(chip['pumps'])}",
+        })
+    st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True,
+                 column_config={"progress": st.column_config.ProgressColumn(min_value=0, max_value=100, format="%d%%")})
+
+@st.fragment(run_every=NOTICE_REFRESH)
+def notice_panel():
+    """Last-update time and operator notices, shared by every session for NOTICE_SECONDS"""
+    state = platform_state()
+    st.caption(f"Last update: {state['last_update']}")
+    # Notice times are on the platform clock; NOTICE_SECONDS is real time for the operator
+    clock = st.session_state.app_state["controller"].clock
+    now = clock.time()
+    for notice in state["notices"]:
+        if clock.to_real(now - notice["time"]) < NOTICE_SECONDS:
+            {"success": st.success, "warning": st.warning, "error": st.error}[notice["kind"]](notice["message"])
+
+st.title("🧪 Microfluidic Test Platform Control Software")
+notice_panel()
+
+top_row = st.columns([1, 4])
+with top_row[0]:
+    st.button("⚠️ Emergency Stop", on_click=emergency_stop, type="primary", use_container_width=True, key="emergency_stop_btn")
+    if platform_state()["emergency_status"]:
+        st.button("✅ Issue Resolved, Restart Experiment", on_click=reset_after_emergency, type="secondary", use_container_width=True, key="reset_emergency_btn")
+
+with top_row[1]:
+    status_cols = st.columns(3)
+    with status_cols[0]:
+        topology_state = platform_state()
+        st.info(f"""
+        **Fluid Transfer System**  
+        Pumps × {len(topology_state["pumps"])} on {len(topology_state["chips"])} chip(s)  
+        🟢 Operating normally
+        """, icon="💧")
+    with status_cols[1]:
+        st.info("""
+        **Data Analysis System**  
+        FCS data processing  
+        🟢 Operating normally
+        """, icon="📊")
+    with status_cols[2]:
+        st.info("""
+        **Current Task**  
+        Experiment ID: EXP-20230515-002  
+        🔄 In progress
+        """, icon="🔬")
+
+st.divider()
+
+workspace = st.columns([6, 7])
+
+with workspace[0]:
+    st.subheader("🔧 Experiment Control Center")
+    
+    chips = platform_state()["chips"]
+    if len(chips) > 1:
+        # Panels below show the selected chip only; the overview covers the rest
+        with st.container(border=True):
+            st.markdown("### 🧩 Chips")
+            st.selectbox("Chip", list(chips), format_func=lambda chip_id: chips[chip_id]["name"], key="selected_chip")
+            chip_overview_panel()
+    
+    pump_control_panel()
+    procedure_panel()
+    titration_panel()
+    monitoring_panel()
 
 with workspace[1]:
     st.subheader("📈 FCS Affinity Data Analysis")
@@ -537,8 +967,18 @@ with workspace[1]:
         st.markdown("### 📂 Data Upload")
         upload_row = st.columns([3, 1])
         with upload_row[0]:
-            uploaded_file = st.file_uploader("Upload CSV data file from FCS instrument", type=["csv"], 
-                                            label_visibility="collapsed", key="fcs_file_uploader")
+            uploaded_files = st.file_uploader("Upload CSV or binary FCS data files from FCS instrument", type=["csv", "fcs"], accept_multiple_files=True,
+                                             label_visibility="collapsed", key="fcs_file_uploader")
+            history_window = st.selectbox("Archived runs to include", list(HISTORY_WINDOWS), index=1, key="history_window_select")
+            archived = st.session_state.app_state["experiment_store"].protein_rows(since=history_since(history_window))
+            archived_rows = sum(archived.values())
+            history_proteins = st.multiselect(
+                "Archived proteins to load", list(archived),
+                default=list(archived) if archived_rows <= HISTORY_AUTOLOAD_ROWS else [],
+                format_func=lambda protein: f"{protein} ({archived[protein]:,})", key=f"history_proteins_{history_window}",
+                placeholder=f"{archived_rows:,} archived records in this window: pick proteins to load"
+            )
+            load_affinity_history(history_window, history_proteins)
         
         with upload_row[1]:
             view_data = st.button("👀 View Current Data", type="secondary", use_container_width=True, key="view_data_btn")
@@ -559,47 +999,79 @@ with workspace[1]:
             ProteinB,0.1,1.9
             ProteinB,0.3,4.2
             ```
+            
+            Binary FCS 3.0/3.1 list-mode files (.fcs) are read directly and reduced to one
+            record per file (or per distinct value of a concentration channel) with the
+            settings below.
             """)
         
-        if uploaded_file is not None and uploaded_file.name not in st.session_state.app_state["uploaded_files"]:
-            data, message = parse_fcs_data(uploaded_file)
-            
-            if data:
-                st.session_state.app_state["affinity_data"].extend(data)
-                st.session_state.app_state["uploaded_files"].append(uploaded_file.name)
-                add_system_log(f"Uploaded FCS data file: {uploaded_file.name}, containing {len(data)} records")
-                update_last_update()
-                st.success(f"File uploaded successfully! {message}, added {len(data)} new records")
-            else:
+        with st.expander("⚙️ Binary FCS Reduction", expanded=False):
+            reduction_cols = st.columns(2)
+            with reduction_cols[0]:
+                st.text_input("Affinity channel ($PnN, empty = last channel)", key="fcs_channel")
+                st.selectbox("Statistic over events", ["median", "mean"], key="fcs_statistic")
+                st.text_input("Gate (channel:low:high, comma separated)", key="fcs_gate", placeholder="FSC-A:1000:250000")
+            with reduction_cols[1]:
+                st.text_input("Protein keyword", value="PROTEIN", key="fcs_protein_keyword")
+                st.text_input("Concentration keyword", value="CONCENTRATION", key="fcs_concentration_keyword")
+                st.text_input("Concentration channel (optional, one record per value)", key="fcs_group_channel")
+        
+        # Each upload is processed once; the uploader keeps returning it on every rerun
+        seen_uploads = st.session_state.setdefault("imported_uploads", set())
+        new_files = [f for f in uploaded_files or [] if (f.file_id, f.name) not in seen_uploads]
+        if new_files:
+            seen_uploads.update((f.file_id, f.name) for f in new_files)
+            summary = import_fcs_files(new_files, fcs_reduction_settings())
+            message = describe_import(summary)
+            add_system_log(f"Uploaded {len(new_files)} FCS data file(s): {message}", "ERROR" if summary["failed"] else "INFO", "data")
+            for entry in summary["files"]:
+                if entry["status"] == "failed":
+                    add_system_log(f"{entry['file']}: {entry['message']}", "ERROR", "data")
+            update_last_update()
+            if summary["imported"]:
+                st.success(f"Upload complete: {message}")
+            elif summary["failed"]:
                 st.error(f"File upload failed: {message}")
+            else:
+                st.info(f"Nothing new to import: {message}")
+            if len(summary["files"]) > 1 or summary["skipped"] or summary["failed"]:
+                st.dataframe(pd.DataFrame(summary["files"]).drop(columns="experiment_id", errors="ignore"),
+                             hide_index=True, use_container_width=True)
         
         col_data1, col_data2 = st.columns(2)
         with col_data1:
             if st.button("👀 View Current Data", type="secondary", use_container_width=True, key="view_current_data_btn"):
                 if st.session_state.app_state["affinity_data"]:
-                    df = pd.DataFrame(st.session_state.app_state["affinity_data"])
+                    df = st.session_state.app_state["affinity_data"].to_frame()
                     st.dataframe(df, use_container_width=True)
                 else:
                     st.info("No data available")
         
         with col_data2:
             if st.button("🗑️ Clear All Data", type="secondary", use_container_width=True, key="clear_all_data_btn"):
-                st.session_state.app_state["affinity_data"] = []
-                st.session_state.app_state["uploaded_files"] = []
-                add_system_log("All affinity data cleared")
+                st.session_state.app_state["affinity_data"].clear()
+                st.session_state.app_state["fit_cache"].clear()
+                st.session_state.app_state["uploaded_files"] = set()
+                add_system_log("All affinity data cleared from view (archived runs kept on disk)", subsystem="data")
                 st.success("All data has been cleared")
     
     with st.container(border=True):
         st.markdown("### 📉 Affinity Curve")
-        affin_fig = generate_affinity_chart()
+        col_ci, col_display = st.columns([3, 2])
+        with col_ci:
+            bootstrap_ci = st.toggle("Bootstrap confidence intervals (2000 resamples)", key="bootstrap_ci_toggle")
+        with col_display:
+            display_mode = st.selectbox("Displayed points", list(DISPLAY_MODES), format_func=DISPLAY_MODES.get,
+                                        key="affinity_display_mode")
+        affin_fig = generate_affinity_chart(bootstrap=bootstrap_ci, display=display_mode)
         if affin_fig:
             st.plotly_chart(affin_fig, use_container_width=True)
             
             st.markdown("""
             **Chart Notes**:  
             - Different colors represent affinity data for different proteins  
-            - Solid points indicate actual measured values  
-            - Dashed lines represent fitted curves based on binding models  
+            - Solid points indicate actual measured values (mean ± SD per concentration when aggregated)  
+            - Dashed lines represent the best binding model per protein (lowest AICc of one-site, one-site + nonspecific, Hill, two-site and ligand depletion); hover for its parameters  
             - Higher affinity values indicate stronger protein binding ability
             """)
         else:
@@ -607,24 +1079,56 @@ with workspace[1]:
     
     with st.container(border=True):
         st.markdown("### 🏆 Protein Affinity Ranking")
-        ranking_fig, protein_stats = generate_affinity_ranking()
+        ranking_fig, protein_stats = generate_affinity_ranking(bootstrap=bootstrap_ci)
         if ranking_fig and protein_stats:
             st.plotly_chart(ranking_fig, use_container_width=True)
             
             st.markdown("#### Detailed Statistical Results")
-            sorted_proteins = sorted(protein_stats, key=lambda x: x["avg_affinity"], reverse=True)
+            sorted_proteins = protein_stats if bootstrap_ci else sorted(protein_stats, key=lambda x: x["avg_affinity"], reverse=True)
             for i, item in enumerate(sorted_proteins, 1):
-                st.markdown(f"{i}. **{item['protein']}**: Average affinity = {item['avg_affinity']:.3f} ± {item['std_affinity']:.3f} (n={item['count']})")
+                line = f"{i}. **{item['protein']}**: Average affinity = {item['avg_affinity']:.3f} ± {item['std_affinity']:.3f} (n={item['count']})"
+                if "kd" in item:
+                    line += f", one-site Kd = {item['kd']:.3g} μM (95% CI {item['kd_lo']:.3g}–{item['kd_hi']:.3g})"
+                if "model" in item:
+                    line += f"; best model {item['model']}: {item['model_params']}"
+                st.markdown(line)
             
             top_protein = sorted_proteins[0]
-            st.success(f"Highest affinity protein: {top_protein['protein']} (Average: {top_protein['avg_affinity']:.3f})")
+            if bootstrap_ci and "kd" in top_protein:
+                # Bootstrap ranking orders by the upper Kd bound, so report the interval that decided it
+                st.success(f"Highest affinity protein: {top_protein['protein']} (one-site Kd = {top_protein['kd']:.3g} μM, "
+                           f"95% CI {top_protein['kd_lo']:.3g}–{top_protein['kd_hi']:.3g})")
+            else:
+                st.success(f"Highest affinity protein: {top_protein['protein']} (Average: {top_protein['avg_affinity']:.3f})")
         else:
             st.info("Insufficient data for ranking analysis")
 
+@st.fragment(run_every=PERFORMANCE_PANEL_REFRESH if metrics.ENABLED else None)
+def performance_panel():
+    with st.expander("⏱️ Performance", expanded=False):
+        if not metrics.ENABLED:
+            st.caption("Instrumentation is off. Start the app with APP_METRICS=1 to record timings "
+                       "(APP_METRICS_PORT / APP_METRICS_FILE export them in Prometheus format).")
+            return
+        spans = metrics.REGISTRY.summary()
+        if spans:
+            st.dataframe(pd.DataFrame(spans), hide_index=True, use_container_width=True,
+                         column_config={col: st.column_config.NumberColumn(format="%.2f")
+                                        for col in ("mean_ms", "p50_ms", "p95_ms", "max_ms")})
+        counters = metrics.REGISTRY.counters()
+        if counters:
+            st.dataframe(pd.DataFrame([
+                {"counter": name, "labels": ", ".join(f"{k}={v}" for k, v in labels), "value": value}
+                for (name, labels), value in sorted(counters.items())
+            ]), hide_index=True, use_container_width=True)
+        jitter = st.session_state.app_state["controller"].scheduler.jitter_stats()
+        cache = st.session_state.app_state["fit_cache"].stats()
+        st.caption(f"Scheduler jitter: mean {jitter['mean_ms']:.2f} ms, p99 {jitter['p99_ms']:.2f} ms, "
+                   f"max {jitter['max_ms']:.2f} ms over {jitter['count']} deadlines | "
+                   f"Fit cache: {cache['size']} entries, hit rate {cache['hit_rate']:.0%}")
+
 st.divider()
-with st.container(border=True):
-    st.subheader("📝 System Log")
-    log_text = "\n".join(reversed(st.session_state.app_state["system_log"]))
-    st.text_area("System operation records", log_text, height=150, disabled=True)
+system_log_panel()
+performance_panel()
 
-streamlit_autorefresh.st_autorefresh(interval=5000, key="auto_refresh")
\ No newline at end of file
+metrics.observe("span_seconds", time.perf_counter() - script_started, span="script_run")
@@ -0,0 +1,177 @@
+import threading
+
+import numpy as np
+
+from clock import SYSTEM_CLOCK
+
+
+class RingBuffer:
+    """Preallocated (time, value) ring buffer for one detector channel.
+
+    A single producer thread appends samples; readers take a snapshot() in
+    chronological order. Memory is fixed at capacity samples regardless of
+    run length.
+    """
+
+    def __init__(self, capacity=1_000_000):
+        self.capacity = capacity
+        self._t = np.zeros(capacity, dtype=np.float64)
+        self._y = np.zeros(capacity, dtype=np.float32)
+        self._head = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def extend(self, t, y):
+        t = np.asarray(t, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float32)
+        n = len(t)
+        if n == 0:
+            return
+        if n > self.capacity:
+            t, y, n = t[-self.capacity:], y[-self.capacity:], self.capacity
+        with self._lock:
+            end = self._head + n
+            if end <= self.capacity:
+                self._t[self._head:end] = t
+                self._y[self._head:end] = y
+            else:
+                split = self.capacity - self._head
+                self._t[self._head:] = t[:split]
+                self._y[self._head:] = y[:split]
+                self._t[:n - split] = t[split:]
+                self._y[:n - split] = y[split:]
+            self._head = end % self.capacity
+            self._count = min(self._count + n, self.capacity)
+
+    def snapshot(self):
+        """Copy of the buffered samples, oldest first"""
+        with self._lock:
+            if self._count < self.capacity:
+                return self._t[:self._count].copy(), self._y[:self._count].copy()
+            return (np.concatenate((self._t[self._head:], self._t[:self._head])),
+                    np.concatenate((self._y[self._head:], self._y[:self._head])))
+
+    def clear(self):
+        with self._lock:
+            self._head = 0
+            self._count = 0
+
+
+def lttb(t, y, n_out):
+    """Largest-Triangle-Three-Buckets downsampling to n_out points.
+
+    Keeps the visual shape (peaks, edges) of the trace. Vectorized per
+    bucket: each step scores all candidate points of a bucket at once.
+    """
+    n = len(t)
+    if n_out >= n or n_out < 3:
+        return t, y
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    # Bucket averages used as the third triangle vertex
+    sums_t = np.add.reduceat(t[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1].astype(np.float64), edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_t = sums_t / counts
+    avg_y = sums_y / counts
+
+    out = np.empty(n_out, dtype=np.int64)
+    out[0] = 0
+    out[-1] = n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        if i + 1 < n_out - 2:
+            next_t, next_y = avg_t[i + 1], avg_y[i + 1]
+        else:
+            next_t, next_y = t[n - 1], y[n - 1]
+        ct = t[start:stop]
+        cy = y[start:stop]
+        area = np.abs((t[prev] - next_t) * (cy - y[prev]) - (t[prev] - ct) * (next_y - y[prev]))
+        prev = start + int(np.argmax(area))
+        out[i + 1] = prev
+    return t[out], y[out]
+
+
+class DataSource:
+    """Detector interface: read() returns the (times, values) acquired since the last call"""
+
+    def read(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SyntheticAbsorbanceSource(DataSource):
+    """Synthetic 527 nm absorbance: saturating binding rise plus noise"""
+
+    def __init__(self, rate_hz=500.0, plateau=0.6, tau=60.0, noise=0.01, seed=None, clock=SYSTEM_CLOCK):
+        self.rate_hz = rate_hz
+        self.plateau = plateau
+        self.tau = tau
+        self.noise = noise
+        self._rng = np.random.default_rng(seed)
+        self._clock = clock
+        self._t0 = clock.monotonic()
+        self._emitted = 0
+
+    def read(self):
+        elapsed = self._clock.monotonic() - self._t0
+        total = int(elapsed * self.rate_hz)
+        n = total - self._emitted
+        if n <= 0:
+            return np.empty(0), np.empty(0)
+        t = (self._emitted + np.arange(n)) / self.rate_hz
+        self._emitted = total
+        y = 0.1 + self.plateau * (1 - np.exp(-t / self.tau)) + self._rng.normal(0, self.noise, n)
+        return t, y
+
+
+class Acquisition:
+    """Producer thread that polls a DataSource into a RingBuffer.
+
+    Listeners added with add_listener(fn) get every new chunk as fn(t, y) on
+    the acquisition thread, so online consumers never rescan the buffer.
+    """
+
+    def __init__(self, source, capacity=1_000_000, poll_interval=0.02):
+        self.source = source
+        self.buffer = RingBuffer(capacity)
+        self.poll_interval = poll_interval
+        self.samples_total = 0
+        self._listeners = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="acquisition", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(1.0)
+        self.source.close()
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            t, y = self.source.read()
+            if len(t):
+                self.buffer.extend(t, y)
+                self.samples_total += len(t)
+                for listener in self._listeners:
+                    listener(t, y)
+
+    def add_listener(self, callback):
+        self._listeners = self._listeners + [callback]
+
+    def remove_listener(self, callback):
+        self._listeners = [cb for cb in self._listeners if cb != callback]
+
+    def view(self, max_points=1000):
+        """LTTB-downsampled snapshot for display"""
+        t, y = self.buffer.snapshot()
+        return lttb(t, y, max_points)
@@ -0,0 +1,412 @@
+import hashlib
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import curve_fit
+
+from binding_models import MODELS, aicc
+
+
+def initial_guess(concentrations, affinities):
+    """Data-driven (Kd, Bmax) starting values.
+
+    Uses a Scatchard fit (Y/C = Bmax/Kd - Y/Kd); falls back to the half-maximum
+    concentration when the linearization is unusable (noise, no curvature).
+    """
+    c = np.asarray(concentrations, dtype=np.float64)
+    y = np.asarray(affinities, dtype=np.float64)
+    ok = (c > 0) & np.isfinite(c) & np.isfinite(y)
+    c, y = c[ok], y[ok]
+    if len(c) == 0:
+        return np.array([1.0, 100.0])
+
+    if len(c) >= 2 and np.ptp(y) > 0:
+        slope, intercept = np.polyfit(y, y / c, 1)
+        if slope < 0 and intercept > 0:
+            kd = -1.0 / slope
+            bmax = intercept * kd
+            if np.isfinite(kd) and np.isfinite(bmax) and kd > 0 and bmax > 0:
+                return np.array([kd, bmax])
+
+    bmax = 1.2 * np.max(np.abs(y)) or 1.0
+    kd = c[np.argmin(np.abs(y - bmax / 2))]
+    return np.array([kd, bmax])
+
+
+# Model name that fits every registered model and keeps the lowest AICc
+AUTO_MODEL = "auto"
+
+FIT_COLUMNS = [
+    "protein", "n_points", "model", "kd", "bmax", "kd_se", "bmax_se",
+    "params", "stderr", "aicc", "converged", "message",
+]
+
+MIN_FIT_POINTS = 3
+
+
+def fit_binding_curve(concentrations, affinities, model_name="one_site", p0=None):
+    """Fit one protein's concentration-affinity points. Raises on failure."""
+    if model_name == AUTO_MODEL:
+        return select_binding_model(concentrations, affinities)
+    model = MODELS[model_name]
+    c = np.asarray(concentrations, dtype=np.float64)
+    y = np.asarray(affinities, dtype=np.float64)
+    if p0 is None:
+        kd, bmax = initial_guess(c, y)
+        p0 = model.start(c, y, kd, bmax)
+    params, pcov, info, _, _ = curve_fit(
+        model.func, c, y, p0=p0, jac=model.jacobian, maxfev=10000, full_output=True
+    )
+    with np.errstate(invalid="ignore"):
+        stderr = np.sqrt(np.diag(pcov))
+    sse = float(np.dot(info["fvec"], info["fvec"]))
+    return {
+        "params": params,  # [Kd, Bmax] for one_site; see model.params
+        "stderr": stderr,
+        "nfev": int(info["nfev"]),
+        "sse": sse,
+        "aicc": float(aicc(sse, len(c), len(params))),
+        "model": model,
+        "model_name": model_name,
+    }
+
+
+def select_binding_model(concentrations, affinities, model_names=None):
+    """Fit every registered model (or model_names) and return the fit with the lowest AICc.
+
+    The one-site fit runs first and warm-starts the others. Fits that fail or
+    end outside a model's valid region are dropped; with too few points for
+    any AICc the one-site fit is kept. candidates maps model -> AICc.
+    Raises when the one-site fit fails.
+    """
+    c = np.asarray(concentrations, dtype=np.float64)
+    y = np.asarray(affinities, dtype=np.float64)
+    base = fit_binding_curve(c, y, "one_site")
+    kd, bmax = base["params"]
+    fits = {"one_site": base}
+    for name in model_names or MODELS:
+        model = MODELS[name]
+        if name in fits or len(c) <= len(model.params):
+            continue
+        try:
+            fit = fit_binding_curve(c, y, name, p0=model.start(c, y, kd, bmax))
+        except Exception:
+            continue
+        if np.all(np.isfinite(fit["params"])) and model.valid(fit["params"]):
+            fits[name] = fit
+    names = list(fits)
+    scores = np.array([fits[name]["aicc"] for name in names])
+    best = fits[names[int(np.argmin(scores))]] if np.isfinite(scores).any() else base
+    return dict(best, candidates=dict(zip(names, scores.tolist())))
+
+
+def _fit_task(task):
+    """Process-pool worker: fit one protein and return a plain (picklable) row"""
+    protein, c, y, model_name = task
+    row = {
+        "protein": protein, "n_points": len(c), "model": "",
+        "kd": np.nan, "bmax": np.nan, "kd_se": np.nan, "bmax_se": np.nan,
+        "params": (), "stderr": (), "aicc": np.nan, "converged": False, "message": "",
+    }
+    if len(c) < MIN_FIT_POINTS:
+        row["message"] = f"Fewer than {MIN_FIT_POINTS} points"
+        return row
+    try:
+        fit = fit_binding_curve(c, y, model_name)
+    except Exception as e:
+        row["message"] = str(e)
+        return row
+    model = fit["model"]
+    row["model"] = model.name
+    row["kd"], row["bmax"], row["kd_se"], row["bmax_se"] = (float(v) for v in model.summary(fit["params"], fit["stderr"]))
+    row["params"] = tuple(float(v) for v in fit["params"])
+    row["stderr"] = tuple(float(v) for v in fit["stderr"])
+    row["aicc"] = fit["aicc"]
+    row["converged"] = True
+    row["message"] = f"{model.label}: converged in {fit['nfev']} evaluations"
+    return row
+
+
+def fit_many(groups, model_name="one_site", max_workers=None, parallel_threshold=32):
+    """Fit many proteins at once.
+
+    groups is an iterable of (protein, concentrations, affinities). Batches of
+    at least parallel_threshold proteins are spread over a process pool;
+    smaller ones are fitted in-process since pool start-up would dominate.
+    With model_name AUTO_MODEL each protein is fitted against every
+    registered model and keeps the lowest-AICc fit. Returns a DataFrame with
+    FIT_COLUMNS, one row per protein; kd/bmax are the model's summary values.
+    """
+    tasks = [
+        (protein, np.asarray(c, dtype=np.float64), np.asarray(y, dtype=np.float64), model_name)
+        for protein, c, y in groups
+    ]
+    workers = max_workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) < parallel_threshold:
+        rows = [_fit_task(task) for task in tasks]
+    else:
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(_fit_task, tasks, chunksize=chunksize))
+    return pd.DataFrame(rows, columns=FIT_COLUMNS)
+
+
+def fit_entry_from_row(row, model_name="one_site"):
+    """Convert a fit_many() row into the dict shape returned by fit_binding_curve()"""
+    if not row["converged"]:
+        return {"error": row["message"], "model_name": model_name}
+    return {
+        "params": np.array(row["params"]),
+        "stderr": np.array(row["stderr"]),
+        "aicc": row["aicc"],
+        "model": MODELS[row["model"]],
+        "model_name": row["model"],
+    }
+
+
+BOOTSTRAP_COLUMNS = [
+    "protein", "kd", "bmax", "kd_lo", "kd_hi", "bmax_lo", "bmax_hi", "n_valid", "message",
+]
+
+
+def _bootstrap_block(C, Y, kd0, bmax0, iterations):
+    """Levenberg-Marquardt on many resamples at once.
+
+    C and Y are (resamples, n) matrices; every row is fitted simultaneously
+    with the closed-form 2x2 normal equations, warm-started at (kd0, bmax0).
+    """
+    B = C.shape[0]
+    kd = np.full(B, kd0, dtype=np.float64)
+    bmax = np.full(B, bmax0, dtype=np.float64)
+    lam = np.full(B, 1e-3)
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        denom = kd[:, None] + C
+        r = Y - bmax[:, None] * C / denom
+        sse = np.einsum("ij,ij->i", r, r)
+        stalled = 0
+        for _ in range(iterations):
+            j_kd = -bmax[:, None] * C / denom**2
+            j_bmax = C / denom
+            a = np.einsum("ij,ij->i", j_kd, j_kd)
+            b = np.einsum("ij,ij->i", j_kd, j_bmax)
+            d = np.einsum("ij,ij->i", j_bmax, j_bmax)
+            g_kd = np.einsum("ij,ij->i", j_kd, r)
+            g_bmax = np.einsum("ij,ij->i", j_bmax, r)
+
+            a_damped = a * (1 + lam)
+            d_damped = d * (1 + lam)
+            det = a_damped * d_damped - b * b
+            kd_new = kd + (d_damped * g_kd - b * g_bmax) / det
+            bmax_new = bmax + (a_damped * g_bmax - b * g_kd) / det
+
+            denom_new = kd_new[:, None] + C
+            r_new = Y - bmax_new[:, None] * C / denom_new
+            sse_new = np.einsum("ij,ij->i", r_new, r_new)
+
+            accept = np.isfinite(sse_new) & (sse_new <= sse)
+            # Stop once no resample has improved for a few damping increases
+            stalled = 0 if np.any(accept & (sse - sse_new > 1e-12 * sse)) else stalled + 1
+            if stalled >= 4:
+                break
+            kd = np.where(accept, kd_new, kd)
+            bmax = np.where(accept, bmax_new, bmax)
+            denom = np.where(accept[:, None], denom_new, denom)
+            r = np.where(accept[:, None], r_new, r)
+            sse = np.where(accept, sse_new, sse)
+            lam = np.where(accept, lam * 0.3, lam * 10.0)
+
+    # Resamples that drew a single concentration cannot constrain Kd
+    valid = np.isfinite(kd) & np.isfinite(bmax) & (np.ptp(C, axis=1) > 0)
+    return kd[valid], bmax[valid]
+
+
+def bootstrap_fit(concentrations, affinities, n_resamples=2000, ci=0.95, seed=None,
+                  model_name="one_site", iterations=40, block_elements=2_000_000):
+    """Bootstrap Kd/Bmax confidence intervals for one protein.
+
+    All resample indices are drawn as one (n_resamples, n) matrix and refitted
+    together by _bootstrap_block, in blocks of at most block_elements cells.
+    Raises when the point fit fails.
+    """
+    c = np.asarray(concentrations, dtype=np.float64)
+    y = np.asarray(affinities, dtype=np.float64)
+    kd0, bmax0 = fit_binding_curve(c, y, model_name)["params"]
+
+    rng = np.random.default_rng(seed)
+    index = rng.integers(0, len(c), size=(n_resamples, len(c)))
+    rows_per_block = max(1, block_elements // max(1, len(c)))
+    kds, bmaxs = [], []
+    for start in range(0, n_resamples, rows_per_block):
+        block = index[start:start + rows_per_block]
+        kd, bmax = _bootstrap_block(c[block], y[block], kd0, bmax0, iterations)
+        kds.append(kd)
+        bmaxs.append(bmax)
+    kd_samples = np.concatenate(kds)
+    bmax_samples = np.concatenate(bmaxs)
+
+    tail = 100 * (1 - ci) / 2
+    if len(kd_samples):
+        kd_lo, kd_hi = np.percentile(kd_samples, [tail, 100 - tail])
+        bmax_lo, bmax_hi = np.percentile(bmax_samples, [tail, 100 - tail])
+    else:
+        kd_lo = kd_hi = bmax_lo = bmax_hi = np.nan
+    return {
+        "kd": float(kd0), "bmax": float(bmax0),
+        "kd_lo": float(kd_lo), "kd_hi": float(kd_hi),
+        "bmax_lo": float(bmax_lo), "bmax_hi": float(bmax_hi),
+        "n_valid": int(len(kd_samples)),
+    }
+
+
+def _bootstrap_task(task):
+    """Process-pool worker for bootstrap_many"""
+    protein, c, y, n_resamples, ci, seed, model_name = task
+    row = dict.fromkeys(BOOTSTRAP_COLUMNS, np.nan)
+    row.update(protein=protein, n_valid=0, message="")
+    if len(c) < MIN_FIT_POINTS:
+        row["message"] = f"Fewer than {MIN_FIT_POINTS} points"
+        return row
+    try:
+        row.update(bootstrap_fit(c, y, n_resamples, ci, seed, model_name))
+    except Exception as e:
+        row["message"] = str(e)
+    return row
+
+
+def bootstrap_many(groups, n_resamples=2000, ci=0.95, seed=None, model_name="one_site",
+                   max_workers=None, parallel_threshold=16):
+    """Bootstrap confidence intervals for many proteins; same pooling rules as fit_many()"""
+    groups = list(groups)
+    seeds = np.random.SeedSequence(seed).spawn(len(groups))
+    tasks = [
+        (protein, np.asarray(c, dtype=np.float64), np.asarray(y, dtype=np.float64),
+         n_resamples, ci, child, model_name)
+        for (protein, c, y), child in zip(groups, seeds)
+    ]
+    workers = max_workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) < parallel_threshold:
+        rows = [_bootstrap_task(task) for task in tasks]
+    else:
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(_bootstrap_task, tasks, chunksize=chunksize))
+    return pd.DataFrame(rows, columns=BOOTSTRAP_COLUMNS)
+
+
+def fit_key(concentrations, affinities, model_name="one_site"):
+    """Content hash of a protein's points plus the model name (or another computation tag)"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(model_name.encode())
+    h.update(np.ascontiguousarray(concentrations, dtype=np.float64).tobytes())
+    h.update(b"|")
+    h.update(np.ascontiguousarray(affinities, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+class FitCache:
+    """LRU cache of binding-curve fits keyed by fit_key().
+
+    Failed fits are cached too (as {"error": message}) so a bad dataset is not
+    refitted on every autorefresh. maxsize is a floor: the cache always keeps
+    room for the latest pass of every tag (point fits, each bootstrap
+    setting), so a rerun over many proteins never evicts what the same pass
+    just wrote.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._keys_by_protein = {}
+        self._protein_of = {}
+        self._pass_sizes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_fit(self, protein, concentrations, affinities, model_name="one_site"):
+        return self.get_or_fit_many([(protein, concentrations, affinities)], model_name)[protein]
+
+    def get_or_fit_many(self, groups, model_name="one_site", max_workers=None):
+        """Return {protein: fit} for all groups, batch-fitting only the cache misses"""
+        def compute(pending):
+            table = fit_many(pending, model_name, max_workers)
+            return [fit_entry_from_row(row, model_name) for row in table.to_dict("records")]
+        return self._get_or_compute(groups, model_name, compute)
+
+    def get_or_bootstrap_many(self, groups, n_resamples=2000, ci=0.95, model_name="one_site", max_workers=None):
+        """Return {protein: bootstrap row} for all groups, bootstrapping only the cache misses.
+
+        Failed rows come back as {"error": message}. A fixed seed keeps the
+        intervals stable across reruns for the same data.
+        """
+        def compute(pending):
+            table = bootstrap_many(pending, n_resamples, ci, seed=0, model_name=model_name, max_workers=max_workers)
+            return [
+                row if row["n_valid"] > 0 else {"error": row["message"] or "No valid resamples"}
+                for row in table.to_dict("records")
+            ]
+        return self._get_or_compute(groups, f"{model_name}:bootstrap{n_resamples}:{ci}", compute)
+
+    def _get_or_compute(self, groups, tag, compute):
+        results = {}
+        pending = []
+        for protein, c, y in groups:
+            key = fit_key(c, y, tag)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                results[protein] = entry
+            else:
+                self.misses += 1
+                pending.append((key, protein, c, y))
+
+        if pending:
+            entries = compute([(p, c, y) for _, p, c, y in pending])
+            for (key, protein, _, _), entry in zip(pending, entries):
+                self._entries[key] = entry
+                self._keys_by_protein.setdefault(protein, set()).add(key)
+                self._protein_of[key] = protein
+                results[protein] = entry
+        self._pass_sizes[tag] = len(groups)
+        limit = max(self.maxsize, sum(self._pass_sizes.values()))
+        while len(self._entries) > limit:
+            self._evict(next(iter(self._entries)))
+
+        return results
+
+    def _evict(self, key):
+        del self._entries[key]
+        protein = self._protein_of.pop(key)
+        keys = self._keys_by_protein[protein]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_protein[protein]
+
+    def invalidate(self, proteins):
+        """Drop cached fits for proteins whose data changed"""
+        for protein in proteins:
+            for key in self._keys_by_protein.pop(protein, ()):
+                self._entries.pop(key, None)
+                self._protein_of.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_protein.clear()
+        self._protein_of.clear()
+        self._pass_sizes.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "hit_rate": self.hits / total if total else 0.0,
+        }
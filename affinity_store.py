@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+
+from fcs_ingest import row_hashes
+
+
+class AffinityStore:
+    """Columnar store for protein/concentration/affinity records.
+
+    Every append becomes an immutable block of NumPy columns sorted by protein,
+    so appends never copy earlier data and each protein occupies one contiguous
+    row range per block. The protein -> [(block, start, stop), ...] index lets
+    readers slice a protein's points without scanning other rows.
+
+    Per-protein affinity aggregates (count, Welford mean/M2, min, max) are
+    merged in as each batch arrives, so statistics() never touches raw rows.
+    Each block also keeps the row hashes of its records so imports can skip
+    rows that are already loaded (known_rows()).
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._blocks = []
+        self._categories = []
+        self._code_of = {}
+        self._index = {}
+        self._rows = 0
+        self._frame = None
+        self._sorted_hashes = None
+        self._count = np.zeros(0, dtype=np.int64)
+        self._mean = np.zeros(0, dtype=np.float64)
+        self._m2 = np.zeros(0, dtype=np.float64)
+        self._min = np.zeros(0, dtype=np.float64)
+        self._max = np.zeros(0, dtype=np.float64)
+        self.version = getattr(self, "version", 0) + 1
+
+    def __len__(self):
+        return self._rows
+
+    def __bool__(self):
+        return self._rows > 0
+
+    @property
+    def proteins(self):
+        """Protein names in first-seen order"""
+        return list(self._index)
+
+    def _encode(self, proteins):
+        cat = pd.Categorical(proteins.astype(str))
+        mapping = np.empty(len(cat.categories), dtype=np.int32)
+        for i, name in enumerate(cat.categories):
+            code = self._code_of.get(name)
+            if code is None:
+                code = len(self._categories)
+                self._code_of[name] = code
+                self._categories.append(name)
+                self._index[name] = []
+            mapping[i] = code
+        return mapping[cat.codes]
+
+    def append(self, df, hashes=None):
+        """Append a parsed batch (protein, concentration, affinity[, experiment_id, timestamp]).
+
+        hashes are the batch's row_hashes() when the caller already has them.
+        """
+        n = len(df)
+        if n == 0:
+            return 0
+        if hashes is None:
+            hashes = row_hashes(df)
+
+        codes = self._encode(df["protein"])
+        order = np.argsort(codes, kind="stable")
+        codes = codes[order]
+        block = {
+            "codes": codes,
+            "concentration": df["concentration"].to_numpy(dtype=np.float64)[order],
+            "affinity": df["affinity"].to_numpy(dtype=np.float64)[order],
+            "hashes": np.asarray(hashes, dtype=np.uint64)[order],
+            "experiment_id": str(df["experiment_id"].iloc[0]) if "experiment_id" in df else "",
+            "timestamp": str(df["timestamp"].iloc[0]) if "timestamp" in df else "",
+        }
+        for arr in (block["codes"], block["concentration"], block["affinity"], block["hashes"]):
+            arr.flags.writeable = False
+        self._update_statistics(codes, block["affinity"])
+
+        block_idx = len(self._blocks)
+        self._blocks.append(block)
+
+        present, starts = np.unique(codes, return_index=True)
+        stops = np.append(starts[1:], n)
+        for code, start, stop in zip(present, starts, stops):
+            self._index[self._categories[code]].append((block_idx, int(start), int(stop)))
+
+        self._rows += n
+        self._frame = None
+        self._sorted_hashes = None
+        self.version += 1
+        return n
+
+    def _update_statistics(self, codes, values):
+        """Merge one batch into the running aggregates (Chan et al. parallel Welford)"""
+        k = len(self._categories)
+        grow = k - len(self._count)
+        if grow:
+            self._count = np.concatenate((self._count, np.zeros(grow, dtype=np.int64)))
+            self._mean = np.concatenate((self._mean, np.zeros(grow)))
+            self._m2 = np.concatenate((self._m2, np.zeros(grow)))
+            self._min = np.concatenate((self._min, np.full(grow, np.inf)))
+            self._max = np.concatenate((self._max, np.full(grow, -np.inf)))
+
+        n_b = np.bincount(codes, minlength=k)
+        present = n_b > 0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_b = np.bincount(codes, weights=values, minlength=k) / n_b
+        m2_b = np.bincount(codes, weights=(values - mean_b[codes]) ** 2, minlength=k)
+        np.minimum.at(self._min, codes, values)
+        np.maximum.at(self._max, codes, values)
+
+        n_a = self._count[present]
+        n = n_a + n_b[present]
+        delta = mean_b[present] - self._mean[present]
+        self._mean[present] += delta * n_b[present] / n
+        self._m2[present] += m2_b[present] + delta**2 * n_a * n_b[present] / n
+        self._count[present] = n
+
+    def known_rows(self, hashes):
+        """Boolean mask: which of these row hashes are already in the store"""
+        if not self._blocks:
+            return np.zeros(len(hashes), dtype=bool)
+        if self._sorted_hashes is None:
+            self._sorted_hashes = np.unique(np.concatenate([b["hashes"] for b in self._blocks]))
+        pos = np.searchsorted(self._sorted_hashes, hashes)
+        pos[pos == len(self._sorted_hashes)] = 0
+        return self._sorted_hashes[pos] == hashes
+
+    def statistics(self):
+        """Per-protein affinity aggregates in first-seen order (std is the population std)"""
+        return [
+            {
+                "protein": protein,
+                "count": int(self._count[code]),
+                "mean": float(self._mean[code]),
+                "std": float(np.sqrt(self._m2[code] / self._count[code])),
+                "min": float(self._min[code]),
+                "max": float(self._max[code]),
+            }
+            for code, protein in enumerate(self._categories)
+        ]
+
+    def protein_data(self, protein):
+        """(concentrations, affinities) for one protein.
+
+        Zero-copy read-only views when the protein came from a single upload;
+        otherwise the per-upload slices are concatenated.
+        """
+        ranges = self._index.get(protein, [])
+        if not ranges:
+            empty = np.empty(0, dtype=np.float64)
+            return empty, empty
+        conc = [self._blocks[b]["concentration"][s:e] for b, s, e in ranges]
+        aff = [self._blocks[b]["affinity"][s:e] for b, s, e in ranges]
+        if len(ranges) == 1:
+            return conc[0], aff[0]
+        return np.concatenate(conc), np.concatenate(aff)
+
+    def groups(self):
+        """Iterate (protein, concentrations, affinities) per protein"""
+        for protein in self._index:
+            conc, aff = self.protein_data(protein)
+            yield protein, conc, aff
+
+    def to_frame(self):
+        """Full table as a DataFrame with a categorical protein column.
+
+        Assembled once per data version and reused until the next append/clear.
+        """
+        if self._frame is not None:
+            return self._frame
+
+        if not self._blocks:
+            self._frame = pd.DataFrame(columns=["protein", "concentration", "affinity", "experiment_id", "timestamp"])
+            return self._frame
+
+        lengths = [len(b["codes"]) for b in self._blocks]
+        codes = np.concatenate([b["codes"] for b in self._blocks])
+        block_ids = np.repeat(np.arange(len(self._blocks)), lengths)
+        self._frame = pd.DataFrame({
+            "protein": pd.Categorical.from_codes(codes, categories=self._categories),
+            "concentration": np.concatenate([b["concentration"] for b in self._blocks]),
+            "affinity": np.concatenate([b["affinity"] for b in self._blocks]),
+            "experiment_id": np.array([b["experiment_id"] for b in self._blocks], dtype=object)[block_ids],
+            "timestamp": np.array([b["timestamp"] for b in self._blocks], dtype=object)[block_ids],
+        })
+        return self._frame
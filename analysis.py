@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+from affinity_fit import AUTO_MODEL, MIN_FIT_POINTS, bootstrap_many, fit_many
+from binding_models import MODELS
+
+STATISTIC_COLUMNS = ["protein", "count", "mean", "std", "min", "max"]
+ANALYSIS_COLUMNS = [
+    "protein", "count", "mean", "std", "model", "kd", "bmax", "kd_se", "bmax_se", "params", "aicc",
+    "converged", "message",
+]
+BOOTSTRAP_ANALYSIS_COLUMNS = ["kd_lo", "kd_hi", "bmax_lo", "bmax_hi"]
+
+
+def analyze_store(store, n_resamples=0, max_workers=None, model_name=AUTO_MODEL):
+    """Statistics and binding-curve fits for every protein of an AffinityStore.
+
+    Returns a DataFrame with ANALYSIS_COLUMNS (plus BOOTSTRAP_ANALYSIS_COLUMNS
+    when n_resamples > 0), one row per protein in first-seen order. params
+    describes the selected model's parameters; failed fits keep NaN values and
+    their message. Bootstrap intervals are for the one-site model.
+    """
+    groups = list(store.groups())
+    stats = pd.DataFrame(store.statistics(), columns=STATISTIC_COLUMNS)
+    fits = fit_many(groups, model_name, max_workers=max_workers).drop(columns=["n_points", "stderr"])
+    fits["params"] = [
+        MODELS[model].describe(params) if model else ""
+        for model, params in zip(fits["model"], fits["params"])
+    ]
+    table = stats.merge(fits, on="protein", how="left")
+    columns = list(ANALYSIS_COLUMNS)
+    if n_resamples:
+        fitted = [group for group in groups if len(group[1]) >= MIN_FIT_POINTS]
+        boots = bootstrap_many(fitted, n_resamples, seed=0, max_workers=max_workers)
+        boots = boots[boots["n_valid"] > 0][["protein"] + BOOTSTRAP_ANALYSIS_COLUMNS]
+        table = table.merge(boots, on="protein", how="left")
+        columns += BOOTSTRAP_ANALYSIS_COLUMNS
+    return table[columns]
+
+
+def merge_statistics(totals, statistics):
+    """Fold AffinityStore.statistics()-style rows into totals ({protein: [count, mean, M2, min, max]}).
+
+    Same parallel Welford merge as AffinityStore, for aggregating over batches
+    that were never loaded into one store. Returns totals.
+    """
+    for row in statistics:
+        n_b, mean_b = row["count"], row["mean"]
+        if not n_b:
+            continue
+        m2_b = row["std"] ** 2 * n_b
+        total = totals.get(row["protein"])
+        if total is None:
+            totals[row["protein"]] = [n_b, mean_b, m2_b, row["min"], row["max"]]
+            continue
+        n_a, mean_a, m2_a, lo, hi = total
+        n = n_a + n_b
+        delta = mean_b - mean_a
+        totals[row["protein"]] = [
+            n, mean_a + delta * n_b / n, m2_a + m2_b + delta**2 * n_a * n_b / n,
+            min(lo, row["min"]), max(hi, row["max"]),
+        ]
+    return totals
+
+
+def totals_to_statistics(totals):
+    """Inverse of merge_statistics(): AffinityStore.statistics()-style rows"""
+    return [
+        {"protein": protein, "count": int(n), "mean": float(mean), "std": float(np.sqrt(m2 / n)),
+         "min": float(lo), "max": float(hi)}
+        for protein, (n, mean, m2, lo, hi) in totals.items()
+    ]
+
+
+def rank_proteins(statistics, boots=None, fits=None):
+    """Ranking rows (protein, avg_affinity, std_affinity, count[, kd, kd_lo, kd_hi][, model, model_params]).
+
+    Ordered by mean affinity, highest first. With boots ({protein: bootstrap
+    result}) only proteins with an interval are kept, ordered by the upper
+    95% bound of Kd so a protein only ranks high if it binds tightly across
+    the whole interval. fits ({protein: fit}) adds the selected binding
+    model and its parameters.
+    """
+    protein_stats = [
+        {"protein": stats["protein"], "avg_affinity": stats["mean"],
+         "std_affinity": stats["std"], "count": stats["count"]}
+        for stats in statistics
+    ]
+    for item in protein_stats:
+        fit = (fits or {}).get(item["protein"])
+        if fit and "error" not in fit:
+            item.update(model=fit["model"].label, model_params=fit["model"].describe(fit["params"]))
+    if boots is None:
+        protein_stats.sort(key=lambda x: x["avg_affinity"], reverse=True)
+        return protein_stats
+
+    for item in protein_stats:
+        boot = boots.get(item["protein"])
+        if boot:
+            item.update(kd=boot["kd"], kd_lo=boot["kd_lo"], kd_hi=boot["kd_hi"])
+    protein_stats = [item for item in protein_stats if "kd" in item]
+    protein_stats.sort(key=lambda x: x["kd_hi"])
+    return protein_stats
@@ -0,0 +1,238 @@
+"""Reanalyze a directory of FCS exports without the Streamlit app.
+
+Walks the directory for CSV and binary .fcs exports, parses and fits them in
+a process pool and streams one row per protein to a CSV or Parquet file
+(chosen by the output extension) as files finish. Progress and throughput
+go to stderr:
+
+    python batch_analyze.py archive/2025 --output fits.parquet --ranking ranking.csv
+    python batch_analyze.py archive/2025 --output fits.csv --scope archive --bootstrap 2000
+
+With --scope file (default) every export is fitted on its own, so each file
+must contain a concentration series. With --scope archive the records of all
+files are pooled per protein first, which suits binary FCS files that each
+hold a single concentration.
+"""
+import argparse
+import fnmatch
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from affinity_fit import AUTO_MODEL
+from affinity_store import AffinityStore
+from analysis import analyze_store, merge_statistics, rank_proteins, totals_to_statistics
+from binding_models import MODELS
+from fcs_binary import DEFAULT_REDUCTION
+from fcs_ingest import ingest_file, make_experiment_id, stream_file
+
+DEFAULT_PATTERNS = ["*.csv", "*.fcs"]
+PROGRESS_INTERVAL = 2.0
+# Files submitted per worker ahead of the results being consumed
+QUEUE_DEPTH = 4
+
+
+def find_exports(root, patterns=DEFAULT_PATTERNS):
+    """Paths under root whose file name matches one of the patterns (case-insensitive), sorted"""
+    patterns = [pattern.lower() for pattern in patterns]
+    paths = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if any(fnmatch.fnmatch(name.lower(), pattern) for pattern in patterns):
+                paths.append(os.path.join(directory, name))
+    return sorted(paths)
+
+
+def _analyze_task(task):
+    """Process-pool worker: parse one export and, in file scope, fit it; errors come back in the result"""
+    path, experiment_id, scope, reduction, n_resamples, model_name = task
+    start = time.perf_counter()
+    result = {"path": path, "error": None, "rows": 0, "table": None, "statistics": None, "data": None}
+    try:
+        if scope == "archive":
+            df, stats = ingest_file(path, experiment_id, reduction)
+            result["rows"] = stats["rows"]
+            result["data"] = df
+        else:
+            # Chunks go straight into the store's columns, so the parsed file is never held twice
+            store = AffinityStore()
+            result["rows"] = stream_file(path, experiment_id, store, reduction)["rows"]
+            result["table"] = analyze_store(store, n_resamples, max_workers=1, model_name=model_name)
+            result["statistics"] = store.statistics()
+    except Exception as e:
+        result["error"] = str(e)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def run_pool(tasks, workers):
+    """Yield task results as they complete, keeping at most QUEUE_DEPTH tasks per worker in flight"""
+    if workers <= 1:
+        for task in tasks:
+            yield _analyze_task(task)
+        return
+    tasks = iter(tasks)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        while True:
+            for task in tasks:
+                pending.add(pool.submit(_analyze_task, task))
+                if len(pending) >= workers * QUEUE_DEPTH:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+class TableWriter:
+    """Append DataFrames to one CSV or Parquet file as they arrive.
+
+    Parquet output is written one row group per append with the schema of
+    the first table, so memory stays bounded by the largest single table.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.lower().endswith(".parquet")
+        self.rows = 0
+        self._file = None
+        self._writer = None
+        self._schema = None
+
+    def write(self, df):
+        if df.empty:
+            return
+        if self.parquet:
+            table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            if self._writer is None:
+                self._schema = table.schema
+                self._writer = pq.ParquetWriter(self.path, self._schema)
+            self._writer.write_table(table)
+        else:
+            if self._file is None:
+                self._file = open(self.path, "w", encoding="utf-8", newline="")
+            df.to_csv(self._file, header=self.rows == 0, index=False)
+        self.rows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+
+
+class Progress:
+    """Throttled progress and throughput line on stderr"""
+
+    def __init__(self, total, interval=PROGRESS_INTERVAL, stream=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.start = time.perf_counter()
+        self.files = 0
+        self.rows = 0
+        self.failed = 0
+        self._last = 0.0
+
+    def update(self, rows, failed=False):
+        self.files += 1
+        self.rows += rows
+        self.failed += failed
+        now = time.perf_counter()
+        if now - self._last >= self.interval or self.files == self.total:
+            self._last = now
+            print(self.line(), file=self.stream, flush=True)
+
+    def line(self):
+        seconds = max(time.perf_counter() - self.start, 1e-9)
+        files_per_sec = self.files / seconds
+        eta = (self.total - self.files) / files_per_sec if files_per_sec else 0.0
+        return (f"{self.files:,}/{self.total:,} files ({self.files / max(self.total, 1):.1%}) | "
+                f"{files_per_sec:,.1f} files/s | {self.rows:,} rows ({self.rows / seconds:,.0f} rows/s) | "
+                f"{self.failed:,} failed | {seconds:,.0f}s elapsed, ETA {eta:,.0f}s")
+
+
+def write_ranking(path, statistics, boots=None, fits=None):
+    """Ranking CSV; fits (the archive-scope results table) adds each protein's selected model"""
+    ranking = pd.DataFrame(rank_proteins(statistics, boots))
+    if fits is not None and not ranking.empty:
+        ranking = ranking.merge(fits[["protein", "model", "params"]], on="protein", how="left")
+    ranking.insert(0, "rank", range(1, len(ranking) + 1))
+    ranking.to_csv(path, index=False)
+    return len(ranking)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", help="directory searched recursively for exports")
+    parser.add_argument("--output", required=True, help="per-protein results (.csv or .parquet)")
+    parser.add_argument("--ranking", help="also write the protein ranking over all files to this CSV")
+    parser.add_argument("--scope", choices=("file", "archive"), default="file",
+                        help="fit each file on its own, or pool all records per protein (default file)")
+    parser.add_argument("--pattern", action="append", help=f"file name pattern, repeatable (default {' '.join(DEFAULT_PATTERNS)})")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: all cores)")
+    parser.add_argument("--model", choices=[AUTO_MODEL] + list(MODELS), default=AUTO_MODEL,
+                        help="binding model; auto fits all and keeps the lowest AICc (default)")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="N", help="bootstrap resamples for Kd/Bmax 95%% CIs")
+    parser.add_argument("--channel", help="binary FCS: channel to summarize (default: last channel)")
+    parser.add_argument("--statistic", default=DEFAULT_REDUCTION["statistic"], help="binary FCS: per-file statistic")
+    args = parser.parse_args(argv)
+
+    paths = find_exports(args.directory, args.pattern or DEFAULT_PATTERNS)
+    if not paths:
+        parser.error(f"no exports found under {args.directory}")
+    reduction = {"channel": args.channel, "statistic": args.statistic}
+    tasks = [
+        (path, make_experiment_id(sequence), args.scope, reduction, args.bootstrap, args.model)
+        for sequence, path in enumerate(paths, 1)
+    ]
+    print(f"Analyzing {len(paths):,} file(s) from {args.directory} with {args.workers} worker(s), scope {args.scope}",
+          file=sys.stderr)
+
+    progress = Progress(len(tasks))
+    writer = TableWriter(args.output)
+    store = AffinityStore()
+    totals = {}
+    try:
+        for result in run_pool(tasks, args.workers):
+            progress.update(result["rows"], failed=result["error"] is not None)
+            if result["error"] is not None:
+                print(f"failed: {result['path']}: {result['error']}", file=sys.stderr)
+            elif args.scope == "archive":
+                store.append(result["data"])
+            else:
+                table = result["table"]
+                table.insert(0, "file", os.path.relpath(result["path"], args.directory))
+                writer.write(table)
+                merge_statistics(totals, result["statistics"])
+
+        boots = fits = None
+        if args.scope == "archive":
+            print(f"Fitting {len(store.proteins):,} protein(s) over {len(store):,} records", file=sys.stderr)
+            table = analyze_store(store, args.bootstrap, max_workers=args.workers, model_name=args.model)
+            writer.write(table)
+            statistics = store.statistics()
+            fits = table
+            if args.bootstrap:
+                boots = {row["protein"]: row for row in table.dropna(subset=["kd_lo"]).to_dict("records")}
+        else:
+            statistics = totals_to_statistics(totals)
+    finally:
+        writer.close()
+
+    print(f"Done: {progress.line()}; {writer.rows:,} result rows written to {args.output}", file=sys.stderr)
+    if args.ranking:
+        ranked = write_ranking(args.ranking, statistics, boots, fits)
+        print(f"Ranking of {ranked:,} protein(s) written to {args.ranking}", file=sys.stderr)
+    return 1 if progress.failed == len(tasks) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,313 @@
+"""Headless benchmarks for the analysis path of MicroFluidicsApp.
+
+Generates synthetic FCS-style CSV exports with known Kd/Bmax per protein and
+times parse_fcs_data (parse, deduplicate, archive and load one file),
+fit_affinity_curve, generate_affinity_chart, generate_affinity_ranking and a
+full script run (Streamlit AppTest) at each data size. Reports throughput,
+peak traced memory, fit accuracy and the serialized chart size, and writes
+the results as JSON so runs can be compared between commits:
+
+    python benchmarks/bench_app.py --sizes 1000 10000 100000 1000000
+    python benchmarks/bench_app.py --compare benchmarks/results/<previous>.json
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "MicroFluidicsApp.py")
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_PROTEINS = 20
+CHART_STAGES = ("chart_cold", "chart_rebuild", "chart_cached", "ranking")
+CONCENTRATION_LEVELS = np.geomspace(0.01, 100.0, 12)  # μM
+
+sys.path.insert(0, REPO_ROOT)
+
+
+class UploadedCSV(io.BytesIO):
+    """Stand-in for Streamlit's UploadedFile (a BytesIO with name and size)"""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def make_fcs_csv(n_rows, n_proteins=DEFAULT_PROTEINS, noise=0.05, seed=0):
+    """Synthetic export: one-site binding with known parameters plus multiplicative noise.
+
+    Returns (csv_bytes, truth) where truth maps protein -> {"kd", "bmax"}.
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array([f"Protein{i + 1:03d}" for i in range(n_proteins)])
+    kd = 10 ** rng.uniform(-1, 1, n_proteins)
+    bmax = rng.uniform(2, 10, n_proteins)
+
+    protein = np.arange(n_rows) % n_proteins
+    conc = CONCENTRATION_LEVELS[(np.arange(n_rows) // n_proteins) % len(CONCENTRATION_LEVELS)]
+    affinity = bmax[protein] * conc / (kd[protein] + conc) * (1 + rng.normal(0, noise, n_rows))
+
+    lines = ["protein,concentration,affinity"]
+    lines.extend(f"{p},{c:.6g},{a:.6g}" for p, c, a in zip(names[protein], conc, affinity))
+    truth = {name: {"kd": float(k), "bmax": float(b)} for name, k, b in zip(names, kd, bmax)}
+    return ("\n".join(lines) + "\n").encode(), truth
+
+
+def quiet_streamlit():
+    """Silence bare-mode and deprecation warnings; Streamlit resets the level whenever it loads its config"""
+    import streamlit.logger
+
+    streamlit.logger.set_log_level(logging.ERROR)
+
+
+def load_app(data_dir):
+    """Execute the app script once in Streamlit bare mode and return its namespace"""
+    from streamlit import config
+
+    config.get_config_options()
+    quiet_streamlit()
+    os.environ["EXPERIMENT_DATA_DIR"] = data_dir
+    return runpy.run_path(APP_PATH, run_name="bench_app")
+
+
+def close_session(app_state):
+    """Stop the background threads of the session's platform controller (pump client, scheduler, acquisition)"""
+    app_state["controller"].shutdown()
+
+
+def measure(fn, reset=None, memory=True):
+    """Time fn() once, then re-run it under tracemalloc for the peak allocation.
+
+    reset() restores the preconditions between the two runs; timings never
+    include tracemalloc overhead.
+    """
+    if reset:
+        reset()
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+
+    peak_mb = None
+    if memory:
+        if reset:
+            reset()
+        tracemalloc.start()
+        try:
+            fn()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return result, {"seconds": seconds, "peak_mb": peak_mb}
+
+
+def fit_accuracy(fits, truth):
+    """Relative Kd/Bmax errors of the fits (each selected model's summary values) against the generating parameters"""
+    summaries = {p: fit["model"].summary(fit["params"], fit["stderr"]) for p, fit in fits.items() if fit}
+    kd_err = [abs(kd - truth[p]["kd"]) / truth[p]["kd"] for p, (kd, _, _, _) in summaries.items()]
+    bmax_err = [abs(bmax - truth[p]["bmax"]) / truth[p]["bmax"] for p, (_, bmax, _, _) in summaries.items()]
+    if not kd_err:
+        return {"fitted": 0, "proteins": len(truth)}
+    return {
+        "fitted": len(kd_err),
+        "proteins": len(truth),
+        "kd_rel_err_median": float(np.median(kd_err)),
+        "kd_rel_err_max": float(np.max(kd_err)),
+        "bmax_rel_err_median": float(np.median(bmax_err)),
+        "bmax_rel_err_max": float(np.max(bmax_err)),
+    }
+
+
+def bench_size(app, n_rows, n_proteins, data_dir, memory=True, apptest=True, apptest_timeout=600):
+    import streamlit as st
+    from experiment_store import ExperimentStore
+
+    app_state = st.session_state.app_state
+    csv_bytes, truth = make_fcs_csv(n_rows, n_proteins, seed=n_rows)
+    result = {"rows": n_rows, "proteins": n_proteins, "csv_mb": len(csv_bytes) / 2**20}
+
+    size_dir = os.path.join(data_dir, f"rows-{n_rows}")
+    scratch_dir = os.path.join(data_dir, f"rows-{n_rows}-scratch")
+
+    def reset_parse():
+        # The memory pass archives into a scratch store so the AppTest run
+        # below sees exactly one partition
+        reset_parse.calls += 1
+        app_state["experiment_store"] = ExperimentStore(size_dir if reset_parse.calls == 1 else scratch_dir)
+        app_state["affinity_data"].clear()
+        app_state["uploaded_files"].clear()
+    reset_parse.calls = 0
+
+    def parse():
+        data, message = app["parse_fcs_data"](UploadedCSV(csv_bytes, f"bench_{n_rows}.csv"))
+        if data is None:
+            raise RuntimeError(message)
+        return data
+
+    data, result["parse"] = measure(parse, reset_parse, memory)
+    result["parse"]["rows_per_sec"] = n_rows / result["parse"]["seconds"]
+
+    app_state["affinity_data"].clear()
+    app_state["affinity_data"].append(data)
+    groups = list(app_state["affinity_data"].groups())
+
+    def fit_all():
+        return {protein: app["fit_affinity_curve"](protein, c, a) for protein, c, a in groups}
+
+    fits, result["fit"] = measure(fit_all, app_state["fit_cache"].clear, memory)
+    result["fit"]["fits_per_sec"] = len(groups) / result["fit"]["seconds"]
+    result["fit"]["accuracy"] = fit_accuracy(fits, truth)
+
+    # Charts are timed cold (fits included), rebuilt (fits served from the fit
+    # cache) and cached (figure reused for the unchanged data version)
+    def clear_caches():
+        app_state["fit_cache"].clear()
+        app_state["figure_cache"].clear()
+
+    fig, result["chart_cold"] = measure(app["generate_affinity_chart"], clear_caches, memory)
+    _, result["chart_rebuild"] = measure(app["generate_affinity_chart"], app_state["figure_cache"].clear, memory)
+    _, result["chart_cached"] = measure(app["generate_affinity_chart"], None, False)
+    _, result["ranking"] = measure(app["generate_affinity_ranking"], app_state["figure_cache"].clear, memory)
+    for key in CHART_STAGES:
+        result[key]["rows_per_sec"] = n_rows / result[key]["seconds"]
+    result["chart_json"] = figure_json(fig)
+    result["chart_json_all_points"] = figure_json(app["generate_affinity_chart"](display="all"))
+
+    if apptest:
+        result["apptest"] = bench_apptest(size_dir, apptest_timeout)
+    return result
+
+
+def figure_json(fig):
+    """Serialized size and serialization time of a figure (what st.plotly_chart sends to the browser)"""
+    start = time.perf_counter()
+    text = fig.to_json()
+    return {
+        "seconds": time.perf_counter() - start,
+        "mb": len(text) / 2**20,
+        "traces": len(fig.data),
+        "webgl": any(trace.type == "scattergl" for trace in fig.data),
+    }
+
+
+def bench_apptest(data_dir, timeout):
+    """Full script run in a fresh session that loads the archived rows from data_dir"""
+    from streamlit.testing.v1 import AppTest
+
+    os.environ["EXPERIMENT_DATA_DIR"] = data_dir
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    quiet_streamlit()
+    start = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    at.run()
+    rerun = time.perf_counter() - start
+    quiet_streamlit()
+    if "app_state" in at.session_state:
+        close_session(at.session_state["app_state"])
+    return {
+        "first_run_seconds": first,
+        "rerun_seconds": rerun,
+        "exceptions": [str(e.value) for e in at.exception],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, previous_path):
+    """Print per-stage time ratios against an earlier results file"""
+    with open(previous_path, encoding="utf-8") as f:
+        previous = {r["rows"]: r for r in json.load(f)["results"]}
+    print(f"\nComparison with {previous_path} (current / previous time):")
+    for result in current["results"]:
+        before = previous.get(result["rows"])
+        if before is None:
+            continue
+        ratios = []
+        for stage in ("parse", "fit") + CHART_STAGES:
+            if stage in before and stage in result:
+                ratios.append(f"{stage} {result[stage]['seconds'] / before[stage]['seconds']:.2f}x")
+        print(f"  {result['rows']:>9,} rows: " + ", ".join(ratios))
+
+
+def print_result(result):
+    print(f"{result['rows']:>9,} rows / {result['proteins']} proteins ({result['csv_mb']:.1f} MB CSV)")
+    for stage in ("parse", "fit") + CHART_STAGES:
+        r = result[stage]
+        memory = f", peak {r['peak_mb']:.1f} MB" if r["peak_mb"] is not None else ""
+        print(f"  {stage:<13} {r['seconds'] * 1000:10.1f} ms{memory}")
+    for key, label in (("chart_json", "chart json"), ("chart_json_all_points", "  all points")):
+        r = result[key]
+        print(f"  {label:<13} {r['seconds'] * 1000:10.1f} ms, {r['mb']:.2f} MB, {r['traces']} traces"
+              + (" (WebGL)" if r["webgl"] else ""))
+    acc = result["fit"]["accuracy"]
+    if acc["fitted"]:
+        print(f"  fit accuracy: {acc['fitted']}/{acc['proteins']} fitted, "
+              f"median |ΔKd|/Kd {acc['kd_rel_err_median']:.3%}, median |ΔBmax|/Bmax {acc['bmax_rel_err_median']:.3%}")
+    if "apptest" in result:
+        r = result["apptest"]
+        print(f"  apptest       {r['first_run_seconds'] * 1000:10.1f} ms first run, {r['rerun_seconds'] * 1000:.1f} ms rerun"
+              + (f", {len(r['exceptions'])} exception(s)" if r["exceptions"] else ""))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="rows per synthetic file")
+    parser.add_argument("--proteins", type=int, default=DEFAULT_PROTEINS, help="proteins per file")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc passes")
+    parser.add_argument("--no-apptest", action="store_true", help="skip the full-script AppTest runs")
+    parser.add_argument("--apptest-timeout", type=float, default=600, help="seconds per AppTest run")
+    parser.add_argument("--output", help="results file (default benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as data_dir:
+        app = load_app(os.path.join(data_dir, "session"))
+        results = []
+        for n_rows in args.sizes:
+            result = bench_size(app, n_rows, args.proteins, data_dir, memory=not args.no_memory,
+                                apptest=not args.no_apptest, apptest_timeout=args.apptest_timeout)
+            print_result(result)
+            results.append(result)
+        close_session(app["st"].session_state.app_state)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
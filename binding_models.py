@@ -0,0 +1,165 @@
+import numpy as np
+
+
+class BindingModel:
+    """One binding model: Y = func(C, *params) with its analytic Jacobian.
+
+    func and jacobian broadcast over C and the parameters, so one call can
+    evaluate a whole curve or many parameter sets at once. start(c, y, kd,
+    bmax) gives starting values from the one-site fit, and summary(params,
+    stderr) reduces the fit to (Kd, Bmax, Kd SE, Bmax SE) for ranking.
+    """
+
+    def __init__(self, name, label, params, func, jacobian, start, summary=None, valid=None):
+        self.name = name
+        self.label = label
+        self.params = params
+        self.func = func
+        self.jacobian = jacobian
+        self.start = start
+        self.summary = summary or (lambda p, se: (p[0], p[1], se[0], se[1]))
+        self.valid = valid or (lambda p: p[0] > 0)
+
+    def __call__(self, c, *params):
+        return self.func(c, *params)
+
+    def __repr__(self):
+        return f"BindingModel({self.name!r})"
+
+    def describe(self, params):
+        """'Kd=0.52, Bmax=3.1' style parameter summary"""
+        return ", ".join(f"{name}={value:.3g}" for name, value in zip(self.params, params))
+
+
+def one_site(c, kd, bmax):
+    """Typical binding model: Y = (Bmax * C) / (Kd + C)"""
+    return (bmax * c) / (kd + c)
+
+
+def one_site_jacobian(c, kd, bmax):
+    c = np.asarray(c, dtype=np.float64)
+    denom = kd + c
+    return np.column_stack((-bmax * c / denom**2, c / denom))
+
+
+def one_site_nonspecific(c, kd, bmax, ns):
+    """One-site binding plus a linear nonspecific term: Y = Bmax*C/(Kd + C) + NS*C"""
+    return (bmax * c) / (kd + c) + ns * c
+
+
+def one_site_nonspecific_jacobian(c, kd, bmax, ns):
+    c = np.asarray(c, dtype=np.float64)
+    denom = kd + c
+    return np.column_stack((-bmax * c / denom**2, c / denom, c))
+
+
+def _hill_ratio(c, kd, n):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(c > 0, (np.maximum(c, 0) / kd) ** n, 0.0)
+
+
+def hill(c, kd, bmax, n):
+    """Cooperative binding: Y = Bmax*C^n/(Kd^n + C^n); Kd is the half-saturating concentration"""
+    r = _hill_ratio(np.asarray(c, dtype=np.float64), kd, n)
+    return bmax * r / (1 + r)
+
+
+def hill_jacobian(c, kd, bmax, n):
+    c = np.asarray(c, dtype=np.float64)
+    r = _hill_ratio(c, kd, n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_ratio = np.where(c > 0, np.log(np.where(c > 0, c, 1.0) / kd), 0.0)
+    scale = bmax / (1 + r) ** 2
+    return np.column_stack((-scale * n * r / kd, r / (1 + r), scale * r * log_ratio))
+
+
+def two_site(c, kd1, bmax1, kd2, bmax2):
+    """Two independent site classes: Y = Bmax1*C/(Kd1 + C) + Bmax2*C/(Kd2 + C)"""
+    return (bmax1 * c) / (kd1 + c) + (bmax2 * c) / (kd2 + c)
+
+
+def two_site_jacobian(c, kd1, bmax1, kd2, bmax2):
+    c = np.asarray(c, dtype=np.float64)
+    d1, d2 = kd1 + c, kd2 + c
+    return np.column_stack((-bmax1 * c / d1**2, c / d1, -bmax2 * c / d2**2, c / d2))
+
+
+def _two_site_summary(params, stderr):
+    """High-affinity site's Kd, total Bmax"""
+    tight = 0 if params[0] <= params[2] else 2
+    return (params[tight], params[1] + params[3], stderr[tight], float(np.hypot(stderr[1], stderr[3])))
+
+
+def quadratic(c, kd, bmax, p):
+    """Ligand depletion (Morrison): Y = Bmax*((P + C + Kd) - sqrt((P + C + Kd)^2 - 4*P*C)) / (2*P)
+
+    P is the total receptor concentration, so bound ligand is not
+    negligible against C.
+    """
+    s = p + c + kd
+    return bmax * (s - np.sqrt(np.maximum(s * s - 4 * p * c, 0.0))) / (2 * p)
+
+
+def quadratic_jacobian(c, kd, bmax, p):
+    c = np.asarray(c, dtype=np.float64)
+    s = p + c + kd
+    d = np.sqrt(np.maximum(s * s - 4 * p * c, 1e-300))
+    fraction = (s - d) / (2 * p)
+    return np.column_stack((
+        bmax * (1 - s / d) / (2 * p),
+        fraction,
+        bmax * ((1 - (s - 2 * c) / d) / (2 * p) - fraction / p),
+    ))
+
+
+def _positive_c(c):
+    c = c[c > 0]
+    return c if len(c) else np.array([1.0])
+
+
+MODELS = {}
+
+
+def register_model(model):
+    """Add a model to the registry used by model selection"""
+    MODELS[model.name] = model
+    return model
+
+
+register_model(BindingModel(
+    "one_site", "One site", ("Kd", "Bmax"), one_site, one_site_jacobian,
+    start=lambda c, y, kd, bmax: np.array([kd, bmax]),
+))
+register_model(BindingModel(
+    "one_site_ns", "One site + nonspecific", ("Kd", "Bmax", "NS"), one_site_nonspecific, one_site_nonspecific_jacobian,
+    start=lambda c, y, kd, bmax: np.array([kd, bmax, 0.0]),
+))
+register_model(BindingModel(
+    "hill", "Hill", ("Kd", "Bmax", "n"), hill, hill_jacobian,
+    start=lambda c, y, kd, bmax: np.array([kd, bmax, 1.0]),
+    valid=lambda p: p[0] > 0 and 0 < p[2] < 20,
+))
+register_model(BindingModel(
+    "two_site", "Two sites", ("Kd1", "Bmax1", "Kd2", "Bmax2"), two_site, two_site_jacobian,
+    start=lambda c, y, kd, bmax: np.array([kd / 10, bmax / 2, kd * 10, bmax / 2]),
+    summary=_two_site_summary,
+    valid=lambda p: p[0] > 0 and p[2] > 0,
+))
+register_model(BindingModel(
+    "quadratic", "Ligand depletion", ("Kd", "Bmax", "P"), quadratic, quadratic_jacobian,
+    start=lambda c, y, kd, bmax: np.array([kd, bmax, np.min(_positive_c(c))]),
+    valid=lambda p: p[0] > 0 and p[2] > 0,
+))
+
+
+def aicc(sse, n, k):
+    """Corrected Akaike information criterion for least-squares fits with k parameters.
+
+    Vectorized over sse/n/k; the residual variance counts as one more
+    parameter. Infinite when n is too small for the correction term.
+    """
+    sse, n, k = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (sse, n, k)))
+    k = k + 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        value = n * np.log(np.maximum(sse, np.finfo(float).tiny) / n) + 2 * k + 2 * k * (k + 1) / (n - k - 1)
+    return np.where(n - k - 1 > 0, value, np.inf)
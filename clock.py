@@ -0,0 +1,50 @@
+import time
+from datetime import datetime
+
+
+class Clock:
+    """Time source for the control loop.
+
+    The pump scheduler, procedure engine, orchestrator timers and the
+    synthetic detector take their time from a Clock instead of the time
+    module, so the same code runs in real time or accelerated (ScaledClock).
+    to_real() converts an interval on this clock into the real seconds to
+    wait for it.
+    """
+
+    speed = 1.0
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def time(self):
+        return time.time()
+
+    def now(self):
+        return datetime.fromtimestamp(self.time())
+
+    def to_real(self, seconds):
+        return seconds / self.speed
+
+
+class ScaledClock(Clock):
+    """Clock running speed times faster than real time from the moment it is created"""
+
+    def __init__(self, speed, start_time=None):
+        if speed <= 0:
+            raise ValueError("Clock speed must be positive")
+        self.speed = float(speed)
+        self._real_start = time.monotonic()
+        self._wall_start = time.time() if start_time is None else start_time
+
+    def elapsed(self):
+        return (time.monotonic() - self._real_start) * self.speed
+
+    def monotonic(self):
+        return self._real_start + self.elapsed()
+
+    def time(self):
+        return self._wall_start + self.elapsed()
+
+
+SYSTEM_CLOCK = Clock()
@@ -0,0 +1,533 @@
+import copy
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from types import MappingProxyType
+
+import metrics
+from acquisition import Acquisition, SyntheticAbsorbanceSource
+from clock import SYSTEM_CLOCK
+from kinetics import KineticEstimator, kinetic_phase
+from orchestrator import Orchestrator
+from procedure import STEP_TYPES, ProcedureError, ProcedureRun, validate_procedure
+from pump_scheduler import PumpScheduler, SchedulerHalted
+from system_log import SystemLog
+from topology import bind_procedure, pump_table
+
+# While a procedure runs, progress and remaining time are republished this often
+PROGRESS_INTERVAL = 1.0
+MAX_NOTICES = 20
+COMMANDS = (
+    "set_pump", "start_pump", "stop_pump", "run_procedure", "load_procedure",
+    "add_step", "reset_emergency", "touch",
+)
+
+
+class ControllerError(Exception):
+    """A command the controller refused; the message is meant for the operator"""
+
+
+def new_experiment_state(procedure):
+    return {
+        "current_step": 0,
+        "total_steps": len(procedure["steps"]),
+        "progress": 0,
+        "remaining_time": "--minutes",
+        "steps_completed": {step["id"]: False for step in procedure["steps"]},
+        "running_steps": [],
+        "step_states": {},
+        "running": False
+    }
+
+
+def freeze(value):
+    """Read-only view of nested dicts/lists (mapping proxies and tuples)"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class Chip:
+    """One chip's runtime: its procedure run and its detector signal with the online kinetic fit"""
+
+    def __init__(self, spec, source):
+        self.id = spec["id"]
+        self.name = spec["name"]
+        self.pumps = [pump["address"] for pump in spec["pumps"]]
+        self.kinetics = KineticEstimator()
+        self.acquisition = Acquisition(source)
+        self.acquisition.add_listener(self.kinetics.update)
+        self.run = None
+        self.kinetic_step = None
+
+    def check_procedure(self, procedure):
+        """Validated copy of a procedure whose pump numbers all exist on this chip. Raises ProcedureError."""
+        procedure = validate_procedure(copy.deepcopy(procedure))
+        bind_procedure(procedure, self.pumps)
+        return procedure
+
+
+class PlatformController:
+    """Process-wide owner of the pump and experiment state.
+
+    One instance is shared by every browser session. Sessions never mutate
+    the state: they read snapshot(), a frozen view rebuilt only when the
+    version changes, and send commands with submit()/execute(). Commands, pump
+    scheduler events and procedure engine events are all applied in order by
+    a single worker thread, so two operators can never interleave half-applied
+    changes.
+
+    The hardware comes from a device topology (see topology.py): pumps are
+    keyed by bus address, and each chip has its own procedure, experiment
+    progress and kinetic fit under state["chips"]. Procedures on different
+    chips run concurrently through the Orchestrator, which holds a per-chip
+    lock for the length of a run; a chip's pumps cannot be started by hand
+    while it is held.
+
+    All timing comes from clock (a ScaledClock runs the platform faster than
+    real time) and each chip's detector from source_factory(chip_id). A
+    recorder (TraceRecorder) captures every command, pump and procedure event
+    and detector sample for replay.py.
+    """
+
+    def __init__(self, topology, procedure, pump_client=None, system_log=None, procedures=None,
+                 clock=SYSTEM_CLOCK, recorder=None, source_factory=None):
+        procedures = procedures or {}
+        source_factory = source_factory or (lambda chip_id: SyntheticAbsorbanceSource(clock=clock))
+        self.topology = topology
+        self.pump_client = pump_client
+        self.system_log = system_log or SystemLog(clock=clock)
+        self.clock = clock
+        self.recorder = recorder
+        self.scheduler = PumpScheduler(
+            on_start=pump_client.start if pump_client else None,
+            on_stop=pump_client.stop if pump_client else None,
+            clock=clock
+        )
+        self.scheduler.add_listener(self._wake)
+        self.chips = {spec["id"]: Chip(spec, source_factory(spec["id"])) for spec in topology["chips"]}
+        self.orchestrator = Orchestrator(list(self.chips), clock)
+        self.version = 0
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._commands = queue.SimpleQueue()
+        self._notices = deque(maxlen=MAX_NOTICES)
+        self._notice_seq = 0
+        self._snapshot = None
+        # Pumps whose manual start is waiting on the device with the lock released
+        self._starting = set()
+        chips = {}
+        for chip in self.chips.values():
+            chip_procedure = chip.check_procedure(procedures.get(chip.id, procedure))
+            chips[chip.id] = {
+                "name": chip.name,
+                "pumps": list(chip.pumps),
+                "procedure": chip_procedure,
+                "experiment": new_experiment_state(chip_procedure),
+                "kinetics": chip.kinetics.snapshot(),
+            }
+        if recorder is not None:
+            recorder.header({
+                "chips": list(self.chips), "topology": topology, "speed": clock.speed, "start_time": clock.time(),
+                "procedures": [[chip_id, chip["procedure"]] for chip_id, chip in chips.items()],
+            })
+            self.scheduler.add_listener(lambda event: recorder.event("pump", event))
+            for chip in self.chips.values():
+                chip.acquisition.add_listener(lambda t, y, chip_id=chip.id: recorder.samples(chip_id, t, y))
+        for chip in self.chips.values():
+            chip.acquisition.start()
+        self._state = {
+            "pumps": pump_table(topology),
+            "chips": chips,
+            "emergency_status": False,
+            "last_update": clock.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        self._thread = threading.Thread(target=self._loop, name="platform-controller", daemon=True)
+        self._thread.start()
+
+    # Session-facing API
+
+    def snapshot(self):
+        """Frozen view of the current state; the same object until the next change"""
+        with self._lock:
+            if self._snapshot is None or self._snapshot["version"] != self.version:
+                self._snapshot = freeze(dict(self._state, version=self.version, notices=list(self._notices)))
+            return self._snapshot
+
+    def wait_for_change(self, version, timeout=None):
+        """Block until the state is newer than version (or timeout) and return the snapshot"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version > version, timeout)
+        return self.snapshot()
+
+    def submit(self, command, *args):
+        """Queue a command for the worker thread; returns a Future with its result"""
+        if command not in COMMANDS:
+            raise ValueError(f"Unknown controller command {command!r}")
+        future = Future()
+        self._commands.put((command, args, future))
+        return future
+
+    def execute(self, command, *args, timeout=10.0):
+        """submit() and wait; raises ControllerError when the command is refused"""
+        return self.submit(command, *args).result(timeout)
+
+    def emergency_stop(self):
+        """Stop the pumps on every chip from the calling thread, without queueing behind other commands.
+
+        The scheduler latches the stop, so pump runs are refused from this
+        point on, including a start already past its checks on the worker
+        thread; the state update itself goes through the queue like any
+        other command.
+        """
+        if self.recorder is not None:
+            self.recorder.command("emergency_stop", ())
+        self.scheduler.halt(stop_device=False)
+        for chip in self.chips.values():
+            if chip.run is not None:
+                chip.run.cancel("emergency stop")
+        error = None
+        if self.pump_client:
+            try:
+                self.pump_client.stop_all(list(self._state["pumps"]))
+            except Exception as e:
+                error = e
+        future = Future()
+        self._commands.put(("emergency_stop", (error,), future))
+        return future
+
+    def log(self, message, level="INFO", subsystem="system", pump_id=None, step_id=None):
+        self.system_log.log(message, level, subsystem, pump_id, step_id)
+
+    def shutdown(self):
+        self._commands.put(None)
+        for chip in self.chips.values():
+            if chip.run is not None:
+                chip.run.cancel("shutdown")
+            chip.acquisition.stop()
+        self.orchestrator.shutdown()
+        self.scheduler.shutdown()
+        if self.pump_client:
+            self.pump_client.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    # Worker thread
+
+    def _wake(self, event=None):
+        self._commands.put(("_drain_events", (), None))
+
+    def _loop(self):
+        while True:
+            running = any(chip["experiment"]["running"] for chip in self._state["chips"].values())
+            try:
+                item = self._commands.get(timeout=PROGRESS_INTERVAL if running else None)
+            except queue.Empty:
+                with self._lock:
+                    self._refresh_chips()
+                    self._publish()
+                continue
+            if item is None:
+                return
+            command, args, future = item
+            if future is not None and not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with metrics.span(f"controller_{command.lstrip('_')}"), self._lock:
+                    result = getattr(self, f"_{command.lstrip('_')}")(*args)
+                    self._publish()
+                if self.recorder is not None and command in COMMANDS:
+                    self.recorder.command(command, args)
+            except Exception as e:
+                if self.recorder is not None and command in COMMANDS:
+                    self.recorder.command(command, args, str(e))
+                if future is None:
+                    self.log(f"Controller error in {command}: {e}", "ERROR")
+                else:
+                    future.set_exception(e)
+            else:
+                if future is not None:
+                    future.set_result(result)
+
+    def _publish(self):
+        self.version += 1
+        self._changed.notify_all()
+
+    def _touch(self):
+        self._state["last_update"] = self.clock.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def _notify(self, kind, message):
+        """Operator notice shown by every session (kind: success, warning or error)"""
+        self._notice_seq += 1
+        self._notices.append({"seq": self._notice_seq, "kind": kind, "message": message, "time": self.clock.time()})
+
+    def _prefix(self, chip):
+        """Chip name prefix for operator messages; empty on a single-chip platform"""
+        return f"{chip.name}: " if len(self.chips) > 1 else ""
+
+    def _pump_label(self, pump_id):
+        """'Pump 2', or 'Chip 3 pump 2' on a multi-chip platform"""
+        pump = self._state["pumps"][pump_id]
+        if len(self.chips) > 1:
+            return f"{self.chips[pump['chip']].name} pump {pump['number']}"
+        return f"Pump {pump['number']}"
+
+    def _drain_events(self):
+        """Apply pump stops the scheduler has executed and the procedure engines' events"""
+        pumps = self._state["pumps"]
+        for event in self.scheduler.drain_events():
+            pump_id = event["pump_id"]
+            label = self._pump_label(pump_id)
+            if event["error"]:
+                self.log(f"{label} {event['kind']} with device error: {event['error']}", "ERROR", "pump", pump_id)
+            if event["kind"] == "started":
+                # Pumps started by the procedure engine rather than the Start button; not if the device refused
+                pumps[pump_id]["running"] = not event["error"]
+                continue
+            if event["reason"] != "scheduled":
+                continue
+            pumps[pump_id]["running"] = False
+            metrics.observe("pump_stop_lateness_seconds", event["jitter_ms"] / 1000.0, pump=pump_id)
+            self.log(f"{label} stopped (timing jitter {event['jitter_ms']:.1f} ms)", subsystem="pump", pump_id=pump_id)
+            pumps[pump_id]["completed"] = True
+            self._touch()
+
+        for chip in self.chips.values():
+            if chip.run is not None:
+                self._drain_run_events(chip)
+        self._refresh_chips()
+
+    def _drain_run_events(self, chip):
+        prefix = self._prefix(chip)
+        for event in chip.run.drain_events():
+            self.log(prefix + event["message"], "ERROR" if event["kind"] == "failed" else "INFO", "procedure",
+                     step_id=event["step_id"])
+            self._touch()
+            if event["kind"] == "step_started":
+                self._start_kinetics(chip, event["step_id"])
+            elif event["step_id"] is not None and event["step_id"] == chip.kinetic_step and event["kind"] in ("step_done", "failed"):
+                chip.kinetic_step = None
+                chip.kinetics.end_phase()
+            if event["kind"] == "step_done":
+                metrics.observe("step_lateness_seconds", max(0.0, event["lateness"]), chip=chip.id, step=event["step_id"])
+            elif event["kind"] == "completed":
+                self._notify("success", f"{prefix}Experiment procedure completed")
+            elif event["kind"] == "failed":
+                self._notify("error", prefix + event["message"])
+
+    def _start_kinetics(self, chip, step_id):
+        """Fit the chip's absorbance signal while a step with a kinetic phase runs"""
+        step = chip.run.step(step_id)
+        phase = kinetic_phase(step)
+        if phase is None:
+            return
+        chip.kinetic_step = step_id
+        chip.kinetics.start_phase(phase, step.get("concentration"))
+
+    def _refresh_chips(self):
+        for chip in self.chips.values():
+            self._refresh_experiment(chip)
+
+    def _refresh_experiment(self, chip):
+        """Mirror a chip's procedure engine state into its experiment summary; end plateaued steps early"""
+        chip_state = self._state["chips"][chip.id]
+        chip_state["kinetics"] = chip.kinetics.snapshot()
+        run = chip.run
+        if run is None:
+            return
+        step_id = chip.kinetic_step
+        if step_id is not None and run.status != "running":
+            chip.kinetic_step = None
+            chip.kinetics.end_phase()
+        elif step_id is not None and chip_state["kinetics"]["plateau"] and run.step(step_id).get("end_on_plateau"):
+            run.finish_step(step_id, "signal reached a plateau")
+        snapshot = run.snapshot()
+        experiment = chip_state["experiment"]
+        experiment["running"] = snapshot["status"] in ("idle", "running")
+        experiment["current_step"] = snapshot["done"]
+        experiment["total_steps"] = snapshot["total"]
+        experiment["progress"] = snapshot["progress"]
+        experiment["steps_completed"] = {step_id: state == "done" for step_id, state in snapshot["state"].items()}
+        experiment["step_states"] = snapshot["state"]
+        experiment["running_steps"] = snapshot["running_steps"]
+        remaining = int(round(snapshot["remaining"]))
+        experiment["remaining_time"] = f"{remaining//60}min{remaining%60}s" if remaining else "0 minutes"
+
+    def _run_finished(self, chip, future):
+        # Orchestrator callback (loop thread): surface errors, then let the worker pick up the final state
+        if not future.cancelled() and future.exception() is not None:
+            self.log(f"{self._prefix(chip)}Procedure orchestration error: {future.exception()}", "ERROR", "procedure")
+        self._wake()
+
+    # Commands (worker thread only, with the lock held)
+
+    def _set_pump(self, pump_id, flow=None, time_s=None):
+        pump = self._pumps(pump_id)
+        if flow is not None:
+            pump["flow"] = flow
+        if time_s is not None:
+            pump["time"] = time_s
+
+    def _start_pump(self, pump_id):
+        pump = self._pumps(pump_id)
+        label = self._pump_label(pump_id)
+        chip = self.chips[pump["chip"]]
+        if self._state["emergency_status"] or self.scheduler.halted:
+            raise ControllerError("Emergency stop is active")
+        if pump["running"] or pump_id in self._starting:
+            raise ControllerError(f"{label} is already running")
+        if self._state["chips"][chip.id]["experiment"]["running"] or self.orchestrator.busy(chip.id):
+            raise ControllerError(f"{label} not started: {chip.name} is running a procedure")
+        if self.pump_client:
+            # set_flow can take seconds: sessions keep reading snapshots meanwhile
+            flow = pump["flow"]
+            self._starting.add(pump_id)
+            try:
+                with self._unlocked():
+                    self.pump_client.set_flow(pump_id, flow)
+            except Exception as e:
+                self.log(f"{label} did not accept flow setting: {e}", "ERROR", "pump", pump_id)
+                raise ControllerError(f"{label} not started: {e}") from e
+            finally:
+                self._starting.discard(pump_id)
+        # An emergency stop during set_flow has latched the scheduler
+        try:
+            self.scheduler.schedule_run(pump_id, pump["time"]/5)
+        except SchedulerHalted as e:
+            raise ControllerError("Emergency stop is active") from e
+        pump["running"] = True
+        self.log(f"{label} started: {pump['flow']}μL/min, {pump['time']} seconds", subsystem="pump", pump_id=pump_id)
+        self._touch()
+
+    @contextmanager
+    def _unlocked(self):
+        """Release the lock the worker holds around a command, for blocking device I/O"""
+        self._lock.release()
+        try:
+            yield
+        finally:
+            self._lock.acquire()
+
+    def _stop_pump(self, pump_id):
+        self._pumps(pump_id)
+        self.scheduler.cancel(pump_id)
+        self._state["pumps"][pump_id]["running"] = False
+        self.log(f"{self._pump_label(pump_id)} manually stopped", "WARNING", "pump", pump_id)
+        self._touch()
+
+    def _run_procedure(self, chip_id):
+        chip = self._chip(chip_id)
+        chip_state = self._state["chips"][chip_id]
+        if self._state["emergency_status"] or self.scheduler.halted:
+            raise ControllerError("Emergency stop is active")
+        if chip_state["experiment"]["running"] or self.orchestrator.busy(chip_id):
+            raise ControllerError(f"A procedure is already running on {chip.name}")
+        pump_settings = {
+            pump_id: {"flow": pump["flow"], "duration": pump["time"]/5}
+            for pump_id, pump in self._state["pumps"].items() if pump["chip"] == chip_id
+        }
+        try:
+            procedure = bind_procedure(chip_state["procedure"], chip.pumps)
+            run = ProcedureRun(procedure, self.scheduler, self._run_pump, pump_settings, clock=self.clock.monotonic,
+                               listener=self._wake, timer=self.orchestrator.timer)
+        except (ProcedureError, KeyError) as e:
+            self.log(f"{self._prefix(chip)}Procedure could not start: {e}", "ERROR", "procedure")
+            raise ControllerError(f"Procedure could not start: {e}") from e
+        chip_state["experiment"] = new_experiment_state(chip_state["procedure"])
+        chip_state["experiment"]["running"] = True
+        if self.recorder is not None:
+            run.add_listener(lambda event: self.recorder.event("procedure", event, chip=chip_id))
+        chip.run = run
+        chip.kinetic_step = None
+        chip.kinetics.reset()
+        self.orchestrator.run(chip_id, run).add_done_callback(lambda future: self._run_finished(chip, future))
+        self._touch()
+
+    def _run_pump(self, pump_id, flow, duration):
+        # Called on procedure engine threads, so it only touches the device and the scheduler
+        if self.pump_client:
+            self.pump_client.set_flow(pump_id, flow)
+        self.scheduler.schedule_run(pump_id, duration)
+
+    def _load_procedure(self, chip_id, procedure, log_message=None):
+        chip = self._chip(chip_id)
+        chip_state = self._state["chips"][chip_id]
+        if chip_state["experiment"]["running"]:
+            raise ControllerError(f"A procedure is running on {chip.name}")
+        try:
+            procedure = chip.check_procedure(procedure)
+        except (ValueError, KeyError, TypeError) as e:
+            raise ControllerError(f"Procedure not loaded: {e}") from e
+        chip_state["procedure"] = procedure
+        chip_state["experiment"] = new_experiment_state(procedure)
+        chip.run = None
+        message = log_message or f"Loaded experiment procedure: {procedure.get('name', 'procedure')}"
+        self.log(self._prefix(chip) + message, subsystem="procedure")
+        self._touch()
+
+    def _add_step(self, chip_id, name, step_type, pump_number, duration, after):
+        chip = self._chip(chip_id)
+        chip_state = self._state["chips"][chip_id]
+        procedure = chip_state["procedure"]
+        existing = {step["id"] for step in procedure["steps"]}
+        step_id = next(f"step_{n}" for n in range(len(existing) + 1, 2 * len(existing) + 2) if f"step_{n}" not in existing)
+        step = {"id": step_id, "name": name or STEP_TYPES[step_type], "type": step_type, "after": list(after)}
+        if step_type == "pump_injection":
+            step["pump"] = pump_number
+        if duration:
+            step["duration"] = duration
+        if chip_state["experiment"]["running"]:
+            raise ControllerError(f"A procedure is running on {chip.name}")
+        candidate = dict(procedure, steps=procedure["steps"] + [step])
+        try:
+            candidate = chip.check_procedure(candidate)
+        except ProcedureError as e:
+            raise ControllerError(f"Step not added: {e}") from e
+        chip_state["procedure"] = candidate
+        chip_state["experiment"] = new_experiment_state(candidate)
+        self.log(f"{self._prefix(chip)}Procedure step added: {step['name']}", subsystem="procedure", step_id=step_id)
+        self._touch()
+        return step_id
+
+    def _emergency_stop(self, device_error=None):
+        if device_error is not None:
+            self.log(f"Emergency stop device error: {device_error}", "ERROR", "emergency")
+        for pump in self._state["pumps"].values():
+            pump["running"] = False
+        for chip in self.chips.values():
+            chip.kinetic_step = None
+            chip.kinetics.end_phase()
+        self._refresh_chips()
+        self._state["emergency_status"] = True
+        self.log("System emergency stop executed", "WARNING", "emergency")
+        self._notify("warning", "Emergency stop executed, all devices stopped")
+        self._touch()
+
+    def _reset_emergency(self):
+        self.scheduler.resume()
+        self._state["emergency_status"] = False
+        for chip in self.chips.values():
+            chip_state = self._state["chips"][chip.id]
+            chip_state["experiment"] = new_experiment_state(chip_state["procedure"])
+            chip.run = None
+        for pump in self._state["pumps"].values():
+            pump["completed"] = False
+        self.log("Emergency situation resolved, system returned to normal state", subsystem="emergency")
+        self._notify("success", "System returned to normal, experiment can be restarted")
+        self._touch()
+
+    def _chip(self, chip_id):
+        try:
+            return self.chips[chip_id]
+        except KeyError:
+            raise ControllerError(f"Unknown chip {chip_id}") from None
+
+    def _pumps(self, pump_id):
+        try:
+            return self._state["pumps"][pump_id]
+        except KeyError:
+            raise ControllerError(f"Unknown pump {pump_id}") from None
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from fcs_ingest import make_experiment_id
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS partitions (
+    path TEXT PRIMARY KEY,
+    experiment_id TEXT NOT NULL,
+    file_name TEXT,
+    file_hash TEXT,
+    run_date TEXT NOT NULL,
+    imported_at TEXT NOT NULL,
+    rows INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_partitions_run_date ON partitions(run_date);
+CREATE INDEX IF NOT EXISTS idx_partitions_file_hash ON partitions(file_hash);
+CREATE INDEX IF NOT EXISTS idx_partitions_experiment ON partitions(experiment_id);
+CREATE TABLE IF NOT EXISTS partition_proteins (
+    protein TEXT NOT NULL,
+    path TEXT NOT NULL REFERENCES partitions(path),
+    rows INTEGER NOT NULL,
+    PRIMARY KEY (protein, path)
+);
+CREATE TABLE IF NOT EXISTS experiment_sequences (
+    day TEXT PRIMARY KEY,
+    last INTEGER NOT NULL
+);
+"""
+
+
+def file_hash(data):
+    """Content hash of an uploaded file's bytes"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ExperimentStore:
+    """Append-only on-disk experiment store.
+
+    Each import is written once as a Parquet file under
+    <root>/experiments/<experiment_id>/ and registered in a SQLite catalog
+    indexed by protein, run date and file hash. Partitions are never
+    rewritten; reads open only the partitions the catalog selects.
+    A new SQLite connection is opened per call so the store can be shared
+    between Streamlit sessions and threads.
+    """
+
+    def __init__(self, root="data"):
+        self.root = root
+        os.makedirs(os.path.join(root, "experiments"), exist_ok=True)
+        self._catalog_path = os.path.join(root, "catalog.sqlite")
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self._catalog_path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def reserve_experiment_ids(self, count, when=None):
+        """count new experiment IDs for the day of when (default today), unique across sessions and restarts.
+
+        The day's sequence is kept in the catalog and advanced in one
+        write transaction; it starts after the highest ID of the day already
+        archived. IDs of imports that fail are not reused.
+        """
+        when = when or datetime.now()
+        prefix = make_experiment_id("", when)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT last FROM experiment_sequences WHERE day = ?", (prefix,)).fetchone()
+            archived = conn.execute("SELECT DISTINCT experiment_id FROM partitions WHERE experiment_id LIKE ?",
+                                    (prefix + "%",)).fetchall()
+            suffixes = [int(experiment_id[len(prefix):]) for experiment_id, in archived if experiment_id[len(prefix):].isdigit()]
+            last = max([row[0] if row else 0] + suffixes)
+            conn.execute("INSERT OR REPLACE INTO experiment_sequences VALUES (?, ?)", (prefix, last + count))
+        return [make_experiment_id(last + n, when) for n in range(1, count + 1)]
+
+    def append(self, df, file_name=None, content_hash=None):
+        """Write a parsed batch as a new partition and register it. Returns its path."""
+        return self.append_many([(df, file_name, content_hash)])[0]
+
+    def append_many(self, batches):
+        """Write several parsed batches and register them in one catalog transaction.
+
+        batches is a list of (df, file_name, content_hash). Either every
+        partition is registered or none is: if the catalog insert fails, the
+        Parquet files already written are removed again. Returns the paths.
+        """
+        imported_at = datetime.now()
+        written = []
+        try:
+            for i, (df, file_name, content_hash) in enumerate(batches):
+                experiment_id = str(df["experiment_id"].iloc[0])
+                run_date = str(df["timestamp"].iloc[0])[:10] if "timestamp" in df else imported_at.strftime("%Y-%m-%d")
+
+                directory = os.path.join(self.root, "experiments", experiment_id)
+                os.makedirs(directory, exist_ok=True)
+                name = f"part-{imported_at.strftime('%Y%m%d%H%M%S%f')}-{i:03d}-{(content_hash or '')[:8]}.parquet"
+                path = os.path.join(directory, name)
+
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                pq.write_table(table, path + ".tmp")
+                os.replace(path + ".tmp", path)
+                written.append((path, df, file_name, content_hash, experiment_id, run_date))
+
+            with closing(self._connect()) as conn, conn:
+                for path, df, file_name, content_hash, experiment_id, run_date in written:
+                    relpath = os.path.relpath(path, self.root)
+                    counts = df["protein"].astype(str).value_counts()
+                    conn.execute(
+                        "INSERT INTO partitions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (relpath, experiment_id, file_name, content_hash, run_date,
+                         imported_at.strftime("%Y-%m-%d %H:%M:%S"), len(df)),
+                    )
+                    conn.executemany(
+                        "INSERT INTO partition_proteins VALUES (?, ?, ?)",
+                        [(protein, relpath, int(n)) for protein, n in counts.items()],
+                    )
+        except Exception:
+            for path, *_ in written:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        return [path for path, *_ in written]
+
+    def has_file(self, content_hash):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT 1 FROM partitions WHERE file_hash = ? LIMIT 1", (content_hash,)).fetchone()
+        return row is not None
+
+    def known_files(self, content_hashes):
+        """The subset of content_hashes already registered in the catalog"""
+        content_hashes = list(content_hashes)
+        if not content_hashes:
+            return set()
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT DISTINCT file_hash FROM partitions WHERE file_hash IN ({','.join('?' * len(content_hashes))})",
+                content_hashes,
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def partitions(self, proteins=None, since=None, until=None):
+        """Catalog rows (DataFrame) for partitions matching the filters, oldest first.
+
+        since/until are inclusive run dates ("YYYY-MM-DD").
+        """
+        sql = "SELECT * FROM partitions WHERE 1=1"
+        params = []
+        if since:
+            sql += " AND run_date >= ?"
+            params.append(since)
+        if until:
+            sql += " AND run_date <= ?"
+            params.append(until)
+        if proteins:
+            proteins = list(proteins)
+            sql += f" AND path IN (SELECT path FROM partition_proteins WHERE protein IN ({','.join('?' * len(proteins))}))"
+            params.extend(proteins)
+        sql += " ORDER BY imported_at, path"
+        with closing(self._connect()) as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def protein_rows(self, since=None, until=None):
+        """{protein: archived rows} for the run date range, from the catalog alone"""
+        sql = ("SELECT pp.protein, SUM(pp.rows) FROM partition_proteins pp JOIN partitions p ON p.path = pp.path "
+               "WHERE 1=1")
+        params = []
+        if since:
+            sql += " AND p.run_date >= ?"
+            params.append(since)
+        if until:
+            sql += " AND p.run_date <= ?"
+            params.append(until)
+        sql += " GROUP BY pp.protein ORDER BY pp.protein"
+        with closing(self._connect()) as conn:
+            return {protein: int(rows) for protein, rows in conn.execute(sql, params)}
+
+    def iter_partitions(self, proteins=None, since=None, until=None):
+        """Yield one DataFrame per matching partition.
+
+        The Parquet file is read through a memory map, but decoding it into
+        Arrow and then pandas allocates new memory; the Arrow table is freed
+        column by column during the conversion, so a partition is held
+        about once rather than twice.
+        """
+        filters = [("protein", "in", list(proteins))] if proteins else None
+        for relpath in self.partitions(proteins, since, until)["path"]:
+            table = pq.read_table(os.path.join(self.root, relpath), memory_map=True, filters=filters)
+            if table.num_rows:
+                yield table.to_pandas(split_blocks=True, self_destruct=True)
+
+    def query(self, proteins=None, since=None, until=None):
+        """All matching rows as one DataFrame"""
+        frames = list(self.iter_partitions(proteins, since, until))
+        if not frames:
+            return pd.DataFrame(columns=["protein", "concentration", "affinity", "experiment_id", "timestamp"])
+        return pd.concat(frames, ignore_index=True)
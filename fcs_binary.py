@@ -0,0 +1,392 @@
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+HEADER_BYTES = 58
+BYTE_ORDERS = {"1,2,3,4": "<", "1,2": "<", "4,3,2,1": ">", "2,1": ">",
+               "1,2,3,4,5,6,7,8": "<", "8,7,6,5,4,3,2,1": ">"}
+CHUNK_EVENTS = 1_000_000
+# Up to this many gated events the median comes from one in-memory sort; above it
+# from histogram passes that narrow down the median bin (one chunk's worth at most)
+EXACT_MEDIAN_EVENTS = CHUNK_EVENTS
+MEDIAN_BINS = 4096
+MAX_GROUPS = 1000
+
+DEFAULT_REDUCTION = {
+    "channel": None,                 # channel whose per-event values become "affinity" (default: last channel)
+    "statistic": "median",           # "median" or "mean" over the gated events
+    "protein_keyword": "PROTEIN",    # TEXT keyword holding the protein name ($SMNO and the file name are fallbacks)
+    "concentration_keyword": "CONCENTRATION",
+    "group_channel": None,           # optional per-event concentration channel: one record per distinct value
+    "gate": {},                      # {channel: (low, high)} event filter, inclusive
+}
+
+
+class FCSError(ValueError):
+    pass
+
+
+def _parse_text(raw):
+    """Keyword/value pairs of a TEXT segment; a doubled delimiter is a literal delimiter"""
+    if not raw:
+        raise FCSError("Empty TEXT segment")
+    text = raw.decode("utf-8", errors="replace")
+    delim = text[0]
+    body = text[1:]
+    if body.endswith(delim):
+        body = body[:-1]
+    placeholder = "\x00"
+    parts = body.replace(delim * 2, placeholder).split(delim)
+    parts = [part.replace(placeholder, delim) for part in parts]
+    if len(parts) % 2:
+        raise FCSError("TEXT segment has an odd number of fields")
+    return {parts[i].strip().upper(): parts[i + 1].strip() for i in range(0, len(parts), 2)}
+
+
+class FCSFile:
+    """Binary FCS 3.0/3.1 list-mode file.
+
+    Parses the HEADER and TEXT segments and exposes the DATA segment as a
+    structured NumPy array (one field per channel) that views the file
+    without copying: a read-only np.memmap for paths, np.frombuffer for
+    in-memory bytes. Reading a column or computing a statistic only pages
+    in the parts of the file it touches.
+    """
+
+    def __init__(self, source):
+        if isinstance(source, (str, os.PathLike)):
+            self.name = os.path.basename(source)
+            self._buffer = np.memmap(source, dtype=np.uint8, mode="r")
+        else:
+            self.name = getattr(source, "name", "")
+            data = source.getvalue() if hasattr(source, "getvalue") else source
+            self._buffer = np.frombuffer(data, dtype=np.uint8)
+
+        header = bytes(self._buffer[:HEADER_BYTES])
+        self.version = header[:6].decode("ascii", errors="replace")
+        if self.version not in ("FCS3.0", "FCS3.1"):
+            raise FCSError(f"Unsupported file version {self.version!r} (FCS3.0/3.1 only)")
+        offsets = [header[10 + 8 * i:18 + 8 * i].strip() for i in range(6)]
+        offsets = [int(value) if value else 0 for value in offsets]
+        text_start, text_end, data_start, data_end = offsets[:4]
+
+        self.text = _parse_text(bytes(self._buffer[text_start:text_end + 1]))
+        if not data_start and not data_end:
+            # Offsets beyond 99,999,999 bytes are only given in TEXT
+            data_start = int(self.text.get("$BEGINDATA", 0))
+            data_end = int(self.text.get("$ENDDATA", 0))
+
+        mode = self.text.get("$MODE", "L").upper()
+        if mode != "L":
+            raise FCSError(f"Only list-mode data is supported ($MODE={mode})")
+        datatype = self.text.get("$DATATYPE", "").upper()
+        if datatype not in ("I", "F", "D"):
+            raise FCSError(f"Unsupported $DATATYPE {datatype!r} (I, F or D only)")
+        byteord = self.text.get("$BYTEORD", "").replace(" ", "")
+        if byteord not in BYTE_ORDERS:
+            raise FCSError(f"Unsupported $BYTEORD {byteord!r}")
+        endian = BYTE_ORDERS[byteord]
+
+        n_params = int(self.text["$PAR"])
+        self.channels = []
+        fields = []
+        for i in range(1, n_params + 1):
+            bits = self.text.get(f"$P{i}B", "*")
+            if datatype == "I":
+                if not bits.isdigit() or int(bits) not in (8, 16, 32, 64):
+                    raise FCSError(f"Parameter {i}: unsupported integer width $P{i}B={bits!r}")
+                dtype = np.dtype(f"{endian}u{int(bits) // 8}")
+            else:
+                dtype = np.dtype(f"{endian}f{4 if datatype == 'F' else 8}")
+            name = self.text.get(f"$P{i}N", f"P{i}")
+            try:
+                value_range = float(self.text.get(f"$P{i}R", 0))
+            except ValueError:
+                value_range = 0.0
+            self.channels.append({
+                "name": name,
+                "label": self.text.get(f"$P{i}S", ""),
+                "bits": dtype.itemsize * 8,
+                "range": value_range,
+                "dtype": dtype,
+            })
+            fields.append((name, dtype))
+        names = [channel["name"] for channel in self.channels]
+        if len(set(names)) != len(names):
+            raise FCSError("Duplicate channel names ($PnN)")
+
+        record = np.dtype(fields)
+        total = int(self.text.get("$TOT", 0))
+        available = (data_end - data_start + 1) // record.itemsize if data_end > data_start else 0
+        if total == 0 or total > available:
+            total = available
+        if data_start + total * record.itemsize > len(self._buffer):
+            raise FCSError("DATA segment extends past the end of the file")
+        self.datatype = datatype
+        self.events = self._buffer[data_start:data_start + total * record.itemsize].view(record)
+
+    def __len__(self):
+        return len(self.events)
+
+    @property
+    def channel_names(self):
+        return [channel["name"] for channel in self.channels]
+
+    def channel(self, name):
+        for channel in self.channels:
+            if channel["name"] == name:
+                return channel
+        raise KeyError(f"No channel named {name!r} (available: {', '.join(self.channel_names)})")
+
+    def column(self, name, start=0, stop=None):
+        """Events start:stop of one channel as float64.
+
+        Integer channels are masked to their $PnR range as the standard
+        requires; only the requested slice is read from disk.
+        """
+        channel = self.channel(name)
+        values = self.events[name][start:stop]
+        if self.datatype == "I" and channel["range"] > 0:
+            bits = int(np.ceil(np.log2(channel["range"])))
+            if bits < channel["bits"]:
+                values = values & np.asarray((1 << bits) - 1, dtype=values.dtype)
+        return values.astype(np.float64)
+
+    def keyword(self, name, default=None):
+        return self.text.get(name.upper(), default)
+
+
+def _gate_mask(fcs, gate, start, stop):
+    mask = np.ones(stop - start, dtype=bool)
+    for name, (low, high) in gate.items():
+        values = fcs.column(name, start, stop)
+        mask &= (values >= low) & (values <= high)
+    return mask
+
+
+def _chunks(n, size=CHUNK_EVENTS):
+    for start in range(0, n, size):
+        yield start, min(start + size, n)
+
+
+def _gated_chunks(fcs, channel, gate, groups):
+    """Yield (group keys, values) of the gated events, CHUNK_EVENTS at a time"""
+    for start, stop in _chunks(len(fcs)):
+        mask = _gate_mask(fcs, gate, start, stop)
+        values = fcs.column(channel, start, stop)[mask]
+        keys = fcs.column(groups, start, stop)[mask] if groups else np.zeros(len(values))
+        yield keys, values
+
+
+def channel_statistic(fcs, channel, statistic="median", gate=None, groups=None):
+    """Statistic of a channel over the gated events, streamed in chunks.
+
+    With groups (a channel name) returns {group value: (statistic, n events)};
+    otherwise (statistic, n events). Medians are exact; above
+    EXACT_MEDIAN_EVENTS gated events they are found by re-reading the file
+    (see _histogram_medians) instead of holding the gated column, so memory
+    stays bounded for multi-GB files.
+    """
+    if statistic not in ("median", "mean"):
+        raise ValueError(f"Unknown statistic {statistic!r}")
+    gate = gate or {}
+
+    sums, counts, lows, highs = {}, {}, {}, {}
+    for keys, values in _gated_chunks(fcs, channel, gate, groups):
+        if not len(values):
+            continue
+        unique, inverse = np.unique(keys, return_inverse=True)
+        chunk_sums = np.bincount(inverse, weights=values)
+        chunk_counts = np.bincount(inverse)
+        chunk_lows = np.full(len(unique), np.inf)
+        chunk_highs = np.full(len(unique), -np.inf)
+        np.minimum.at(chunk_lows, inverse, values)
+        np.maximum.at(chunk_highs, inverse, values)
+        for i, key in enumerate(unique.tolist()):
+            sums[key] = sums.get(key, 0.0) + chunk_sums[i]
+            counts[key] = counts.get(key, 0) + int(chunk_counts[i])
+            lows[key] = min(lows.get(key, np.inf), chunk_lows[i])
+            highs[key] = max(highs.get(key, -np.inf), chunk_highs[i])
+        if len(counts) > MAX_GROUPS:
+            raise FCSError(f"Group channel {groups!r} has more than {MAX_GROUPS} distinct values")
+
+    if statistic == "mean":
+        results = {key: float(sums[key] / counts[key]) for key in counts}
+    elif sum(counts.values()) <= EXACT_MEDIAN_EVENTS:
+        chunks = list(_gated_chunks(fcs, channel, gate, groups))
+        keys = np.concatenate([k for k, _ in chunks])
+        values = np.concatenate([v for _, v in chunks])
+        order = np.argsort(keys, kind="stable")
+        keys, values = keys[order], values[order]
+        bounds = np.searchsorted(keys, sorted(counts), side="left").tolist() + [len(keys)]
+        results = {key: float(np.median(values[bounds[i]:bounds[i + 1]])) for i, key in enumerate(sorted(counts))}
+    else:
+        results = _histogram_medians(fcs, channel, gate, groups, counts, lows, highs)
+
+    results = {key: (results[key], counts[key]) for key in sorted(counts)}
+    if groups:
+        return results
+    return results.get(0.0, (np.nan, 0))
+
+
+def _histogram_medians(fcs, channel, gate, groups, counts, lows, highs):
+    """Exact medians of large groups without holding their events.
+
+    Each median rank (two for an even count) starts on the group's
+    [low, high] range. A pass histograms the events inside each range and
+    narrows it to the bin holding the rank, until that bin holds few enough
+    events to collect; np.partition then picks the rank. A range whose
+    events are all equal answers directly. Ranges are half-open like
+    np.histogram's bins, the last one closed.
+    """
+    # (key, rank) -> [low, high, high closed, rank within the range]
+    ranges = {}
+    for key, count in counts.items():
+        for rank in sorted({(count - 1) // 2, count // 2}):
+            ranges[(key, rank)] = [lows[key], highs[key], True, rank]
+    limit = max(EXACT_MEDIAN_EVENTS // max(len(ranges), 1), MEDIAN_BINS)
+    picked = {}
+
+    def in_range(values, low, high, closed):
+        return (values >= low) & ((values <= high) if closed else (values < high))
+
+    while ranges:
+        ready = {target for target, (low, high, _, _) in ranges.items() if low == high}
+        for target in ready:
+            picked[target] = ranges.pop(target)[0]
+        edges = {target: np.linspace(low, high, MEDIAN_BINS + 1) for target, (low, high, _, _) in ranges.items()}
+        histograms = {target: np.zeros(MEDIAN_BINS, dtype=np.int64) for target in ranges}
+        extremes = {target: [np.inf, -np.inf] for target in ranges}
+        for keys, values in _gated_chunks(fcs, channel, gate, groups):
+            for target, (low, high, closed, _) in ranges.items():
+                selected = values[keys == target[0]] if groups else values
+                selected = selected[in_range(selected, low, high, closed)]
+                if len(selected):
+                    histograms[target] += np.histogram(selected, bins=edges[target])[0]
+                    extremes[target] = [min(extremes[target][0], selected.min()), max(extremes[target][1], selected.max())]
+
+        collect = {}
+        for target, bounds in list(ranges.items()):
+            if extremes[target][0] == extremes[target][1]:
+                picked[target] = float(extremes[target][0])
+                del ranges[target]
+                continue
+            cumulative = np.cumsum(histograms[target])
+            i = int(np.searchsorted(cumulative, bounds[3], side="right"))
+            below = int(cumulative[i - 1]) if i else 0
+            bounds[:] = [edges[target][i], edges[target][i + 1], bounds[2] and i == MEDIAN_BINS - 1, bounds[3] - below]
+            if histograms[target][i] <= limit:
+                collect[target] = []
+        if collect:
+            for keys, values in _gated_chunks(fcs, channel, gate, groups):
+                for target in collect:
+                    low, high, closed, _ = ranges[target]
+                    selected = values[keys == target[0]] if groups else values
+                    collect[target].append(selected[in_range(selected, low, high, closed)])
+            for target, parts in collect.items():
+                rank = ranges.pop(target)[3]
+                picked[target] = float(np.partition(np.concatenate(parts), rank)[rank])
+
+    medians = {}
+    for key, count in counts.items():
+        medians[key] = float((picked[(key, (count - 1) // 2)] + picked[(key, count // 2)]) / 2)
+    return medians
+
+
+def reduce_events(fcs, reduction=None):
+    """Reduce per-event data to protein/concentration/affinity records.
+
+    By default one record per file: the protein and concentration come from
+    TEXT keywords and the affinity is the statistic of the chosen channel.
+    With a group_channel, one record per distinct value of that channel,
+    which is used as the concentration.
+    """
+    config = dict(DEFAULT_REDUCTION, **(reduction or {}))
+    channel = config["channel"] or fcs.channel_names[-1]
+    fcs.channel(channel)
+    for name in config["gate"]:
+        fcs.channel(name)
+
+    protein = (fcs.keyword(config["protein_keyword"]) or fcs.keyword("$SMNO")
+               or os.path.splitext(fcs.name)[0] or "unknown")
+    if config["group_channel"]:
+        per_group = channel_statistic(fcs, channel, config["statistic"], config["gate"], config["group_channel"])
+        rows = [(protein, key, value, events) for key, (value, events) in per_group.items()]
+    else:
+        concentration = fcs.keyword(config["concentration_keyword"])
+        if concentration is None:
+            raise FCSError(f"Keyword {config['concentration_keyword']!r} not found; set a concentration "
+                           f"keyword or a group channel for this file")
+        value, events = channel_statistic(fcs, channel, config["statistic"], config["gate"])
+        rows = [(protein, float(concentration), value, events)]
+
+    df = pd.DataFrame(rows, columns=["protein", "concentration", "affinity", "events"])
+    df = df[df["events"] > 0].drop(columns="events").reset_index(drop=True)
+    df["concentration"] = df["concentration"].astype(np.float64)
+    df["affinity"] = df["affinity"].astype(np.float64)
+    return df
+
+
+def ingest_fcs_binary(source, experiment_id, reduction=None, timestamp=None):
+    """Binary counterpart of fcs_ingest.ingest_fcs_csv: (df, stats) for one .fcs file"""
+    start = time.perf_counter()
+    fcs = FCSFile(source)
+    df = reduce_events(fcs, reduction)
+    df["experiment_id"] = experiment_id
+    df["timestamp"] = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    seconds = time.perf_counter() - start
+    stats = {
+        "rows": len(df),
+        "events": len(fcs),
+        "seconds": seconds,
+        "rows_per_sec": len(df) / seconds if seconds > 0 else float("inf"),
+        "events_per_sec": len(fcs) / seconds if seconds > 0 else float("inf"),
+    }
+    return df, stats
+
+
+def write_fcs(path, events, keywords=None, byteorder="<"):
+    """Write a float32 FCS 3.1 list-mode file from a {channel: values} mapping.
+
+    For simulated instruments and benchmarks; real files come from the cytometer.
+    """
+    names = list(events)
+    data = np.empty(len(events[names[0]]), dtype=[(name, f"{byteorder}f4") for name in names])
+    for name in names:
+        data[name] = events[name]
+    raw = data.tobytes()
+
+    text = {
+        "$BYTEORD": "1,2,3,4" if byteorder == "<" else "4,3,2,1",
+        "$DATATYPE": "F", "$MODE": "L", "$NEXTDATA": "0",
+        "$PAR": str(len(names)), "$TOT": str(len(data)),
+    }
+    for i, name in enumerate(names, 1):
+        text.update({f"$P{i}N": name, f"$P{i}B": "32", f"$P{i}E": "0,0",
+                     f"$P{i}R": str(int(np.nanmax(events[name])) + 1 if len(data) else 1)})
+    text.update(keywords or {})
+
+    def encode(begin, end):
+        body = "".join(f"/{key.replace('/', '//')}/{str(value).replace('/', '//')}"
+                       for key, value in dict(text, **{"$BEGINDATA": begin, "$ENDDATA": end}).items())
+        return (body + "/").encode("utf-8")
+
+    # The data offsets are part of TEXT, so size TEXT with wide placeholders first
+    text_start = HEADER_BYTES
+    width = len(str(text_start + len(encode(0, 0)) + 64 + len(raw)))
+    data_start = text_start + len(encode("0" * width, "0" * width))
+    data_end = data_start + len(raw) - 1
+    text_bytes = encode(str(data_start).zfill(width), str(data_end).zfill(width))
+    text_end = text_start + len(text_bytes) - 1
+
+    def offset(value):
+        return f"{value if value <= 99_999_999 else 0:>8}"
+
+    header = f"FCS3.1    {offset(text_start)}{offset(text_end)}{offset(data_start)}{offset(data_end)}{0:>8}{0:>8}"
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii"))
+        f.write(text_bytes)
+        f.write(raw)
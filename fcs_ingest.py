@@ -0,0 +1,174 @@
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from fcs_binary import ingest_fcs_binary
+
+REQUIRED_COLUMNS = ['protein', 'concentration', 'affinity']
+NUMERIC_COLUMNS = ['concentration', 'affinity']
+DEFAULT_CHUNK_ROWS = 100_000
+PARALLEL_THRESHOLD_BYTES = 8 * 2**20
+
+
+def make_experiment_id(sequence, when=None):
+    """Experiment ID in the EXPyymmddN format used across the app"""
+    when = when or datetime.now()
+    return f"EXP{when.strftime('%y%m%d')}{sequence}"
+
+
+def _rewind(source):
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+
+def check_columns(source):
+    """Read only the header row and return the list of missing required columns"""
+    header = pd.read_csv(source, nrows=0)
+    _rewind(source)
+    return [col for col in REQUIRED_COLUMNS if col not in header.columns]
+
+
+def validate_chunk(chunk, first_row=0):
+    """Type and validate whole columns at once.
+
+    Returns (typed_chunk, error). Empty cells are accepted as NaN like the old
+    row-by-row float() conversion; non-numeric text is rejected.
+    """
+    typed = pd.DataFrame({"protein": chunk["protein"].astype(str)})
+    for col in NUMERIC_COLUMNS:
+        values = pd.to_numeric(chunk[col], errors='coerce')
+        bad = values.isna().to_numpy() & chunk[col].notna().to_numpy()
+        if bad.any():
+            # +2: header line plus 1-based line numbers
+            line = first_row + int(np.argmax(bad)) + 2
+            return None, f"Column '{col}' has {int(bad.sum())} non-numeric value(s), first at line {line}"
+        typed[col] = values.astype(np.float64)
+    return typed, None
+
+
+def iter_fcs_chunks(source, chunksize=DEFAULT_CHUNK_ROWS):
+    """Stream validated chunks from a CSV export without loading the whole file.
+
+    Raises ValueError on missing columns or invalid values.
+    """
+    missing = check_columns(source)
+    if missing:
+        raise ValueError(f"CSV file missing necessary columns. Must include: {', '.join(REQUIRED_COLUMNS)}")
+
+    first_row = 0
+    reader = pd.read_csv(source, usecols=REQUIRED_COLUMNS, dtype={"protein": str}, chunksize=chunksize)
+    with reader:
+        for chunk in reader:
+            typed, error = validate_chunk(chunk, first_row)
+            if error:
+                raise ValueError(error)
+            first_row += len(chunk)
+            yield typed
+
+
+def stream_fcs_csv(source, experiment_id, sink, chunksize=DEFAULT_CHUNK_ROWS, timestamp=None):
+    """Parse an FCS CSV export chunk by chunk into sink, for files larger than memory.
+
+    Each validated chunk gets the file's experiment ID and timestamp and is
+    handed to sink.append(chunk) (an AffinityStore, or a list) before the
+    next one is read, so only one chunk of the file is held here. Returns
+    stats with rows, chunks, seconds and rows_per_sec. Chunks appended
+    before an invalid value stay in sink.
+    """
+    start = time.perf_counter()
+    timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = chunks = 0
+    for chunk in iter_fcs_chunks(source, chunksize):
+        chunk["experiment_id"] = experiment_id
+        chunk["timestamp"] = timestamp
+        sink.append(chunk)
+        rows += len(chunk)
+        chunks += 1
+    seconds = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "chunks": chunks,
+        "seconds": seconds,
+        "rows_per_sec": rows / seconds if seconds > 0 else float("inf"),
+    }
+
+
+def ingest_fcs_csv(source, experiment_id, chunksize=DEFAULT_CHUNK_ROWS, timestamp=None):
+    """Parse an FCS CSV export into a typed DataFrame.
+
+    Experiment ID and timestamp are assigned once for the whole file. The
+    result holds the whole file in memory; use stream_fcs_csv() to feed a
+    store chunk by chunk instead. Returns (df, stats) where stats holds
+    rows, chunks, seconds and rows_per_sec.
+    """
+    chunks = []
+    stats = stream_fcs_csv(source, experiment_id, chunks, chunksize, timestamp)
+    if chunks:
+        df = pd.concat(chunks, ignore_index=True)
+    else:
+        df = pd.DataFrame({
+            "protein": pd.Series(dtype=str),
+            "concentration": pd.Series(dtype=np.float64),
+            "affinity": pd.Series(dtype=np.float64),
+        })
+        df["experiment_id"] = experiment_id
+        df["timestamp"] = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return df, stats
+
+
+def row_hashes(df):
+    """64-bit hash of each (protein, concentration, affinity) row, for row-level deduplication"""
+    return pd.util.hash_pandas_object(df[REQUIRED_COLUMNS], index=False).to_numpy()
+
+
+def ingest_file(path, experiment_id, reduction=None, timestamp=None):
+    """Parse an export from disk: .fcs files as binary FCS (memory-mapped), anything else as CSV"""
+    if path.lower().endswith(".fcs"):
+        return ingest_fcs_binary(path, experiment_id, reduction, timestamp)
+    return ingest_fcs_csv(path, experiment_id, timestamp=timestamp)
+
+
+def stream_file(path, experiment_id, sink, reduction=None, timestamp=None):
+    """ingest_file() into sink.append(): CSV exports chunk by chunk, binary FCS as its reduced records. Returns stats."""
+    if path.lower().endswith(".fcs"):
+        df, stats = ingest_fcs_binary(path, experiment_id, reduction, timestamp)
+        sink.append(df)
+        return stats
+    return stream_fcs_csv(path, experiment_id, sink, timestamp=timestamp)
+
+
+def _ingest_task(task):
+    """Process-pool worker: parse one file's bytes; errors come back in the result"""
+    name, data, experiment_id, timestamp, reduction = task
+    try:
+        if name.lower().endswith(".fcs"):
+            df, stats = ingest_fcs_binary(data, experiment_id, reduction, timestamp)
+        else:
+            df, stats = ingest_fcs_csv(io.BytesIO(data), experiment_id, timestamp=timestamp)
+    except Exception as e:
+        return {"name": name, "data": None, "error": str(e), "rows": 0, "seconds": 0.0}
+    return {"name": name, "data": df, "error": None, "rows": stats["rows"], "seconds": stats["seconds"]}
+
+
+def ingest_many(files, timestamp=None, reduction=None, max_workers=None, parallel_threshold=PARALLEL_THRESHOLD_BYTES):
+    """Parse several exports at once.
+
+    files is a list of (name, bytes, experiment_id); .fcs files are read as
+    binary FCS and reduced with fcs_binary.reduce_events(reduction), anything
+    else as CSV. Batches of at least
+    parallel_threshold bytes are spread over a process pool; smaller ones are
+    parsed in-process since pool start-up would dominate. Returns one result
+    dict (name, data, error, rows, seconds) per file, in input order.
+    """
+    timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    tasks = [(name, data, experiment_id, timestamp, reduction) for name, data, experiment_id in files]
+    workers = min(max_workers or os.cpu_count() or 1, len(tasks))
+    if workers <= 1 or sum(len(data) for _, data, _ in files) < parallel_threshold:
+        return [_ingest_task(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_ingest_task, tasks))
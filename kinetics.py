@@ -0,0 +1,246 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+import metrics
+
+# Step type -> kinetic phase when a step does not set "kinetics" itself
+PHASE_OF_STEP_TYPE = {"incubation": "association", "acquisition": "dissociation"}
+PHASES = ("association", "dissociation")
+
+
+def kinetic_phase(step):
+    """Kinetic phase a procedure step records, from its "kinetics" field or its type; None for none"""
+    phase = step.get("kinetics", PHASE_OF_STEP_TYPE.get(step["type"]))
+    return phase if phase in PHASES else None
+
+
+def fit_exponential(t, y, params=None, iterations=8):
+    """Levenberg-Marquardt fit of y = c + a * exp(-k * t).
+
+    Association (rise to a plateau) has a < 0, dissociation a > 0; k is kobs
+    or koff. params=(c, a, k) warm-starts the fit; without it k starts at
+    3/span and c, a come from the linear least-squares solution at that k.
+    Every iteration is a closed-form 3x3 solve over the points, so the cost
+    is O(len(t)). Returns (c, a, k, k_se, rmse) or None when the points
+    cannot constrain an exponential.
+    """
+    t = np.asarray(t, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(t)
+    span = t[-1] - t[0] if n else 0.0
+    if n < 5 or span <= 0:
+        return None
+
+    def linear(k):
+        e = np.exp(-k * t)
+        basis = np.column_stack((np.ones(n), e))
+        (c, a), *_ = np.linalg.lstsq(basis, y, rcond=None)
+        return c, a
+
+    if params is None or not np.all(np.isfinite(params)) or params[2] <= 0:
+        k = 3.0 / span
+        c, a = linear(k)
+    else:
+        c, a, k = params
+    lam = 1e-3
+    with np.errstate(over="ignore", invalid="ignore"):
+        e = np.exp(-k * t)
+        r = y - c - a * e
+        sse = r @ r
+        for _ in range(iterations):
+            J = np.column_stack((np.ones(n), e, -a * t * e))
+            JtJ = J.T @ J
+            step = np.linalg.solve(JtJ + lam * np.diag(np.diag(JtJ) + 1e-12), J.T @ r) if np.all(np.isfinite(JtJ)) else None
+            if step is None:
+                break
+            c_new, a_new, k_new = c + step[0], a + step[1], k + step[2]
+            if k_new <= 0:
+                lam *= 10
+                continue
+            e_new = np.exp(-k_new * t)
+            r_new = y - c_new - a_new * e_new
+            sse_new = r_new @ r_new
+            if np.isfinite(sse_new) and sse_new <= sse:
+                converged = sse - sse_new <= 1e-12 * max(sse, 1e-300)
+                c, a, k, e, r, sse = c_new, a_new, k_new, e_new, r_new, sse_new
+                lam *= 0.3
+                if converged:
+                    break
+            else:
+                lam *= 10
+
+        J = np.column_stack((np.ones(n), e, -a * t * e))
+        dof = max(n - 3, 1)
+        try:
+            cov = np.linalg.inv(J.T @ J) * (sse / dof)
+            k_se = float(np.sqrt(cov[2, 2])) if cov[2, 2] >= 0 else np.inf
+        except np.linalg.LinAlgError:
+            k_se = np.inf
+    if not (np.isfinite(c) and np.isfinite(a) and np.isfinite(k)):
+        return None
+    return float(c), float(a), float(k), k_se, float(np.sqrt(sse / n))
+
+
+class KineticEstimator:
+    """Online association/dissociation fits on a streaming detector signal.
+
+    update(t, y) takes each chunk from the acquisition thread and averages it
+    into bin_seconds bins. During a phase (start_phase()/end_phase()) the last
+    window_bins bins are refitted with fit_exponential every refit_seconds of
+    signal, warm-started from the previous fit, so an update costs O(window)
+    however long the run is. An exponential looks the same on any stretch of
+    its curve, so a sliding window recovers the rate constant without the
+    start of the phase.
+
+    kobs comes from the association phase and koff from the dissociation
+    phase; with the analyte concentration C (μM), kon = (kobs - koff) / C and
+    KD = koff / kon. A phase counts as at plateau once the fit says it is
+    plateau_fraction complete and the rate constant's relative standard
+    error is below max_rel_se.
+    """
+
+    def __init__(self, bin_seconds=0.1, window_bins=600, refit_seconds=0.5,
+                 plateau_fraction=0.95, max_rel_se=0.1, min_bins=20):
+        self.bin_seconds = bin_seconds
+        self.refit_seconds = refit_seconds
+        self.plateau_fraction = plateau_fraction
+        self.max_rel_se = max_rel_se
+        self.min_bins = min_bins
+        self._bins = deque(maxlen=window_bins)
+        self._lock = threading.Lock()
+        self._phase = None
+        self._concentration = None
+        self._origin = None
+        self._bin_index = 0
+        self._bin_sum = 0.0
+        self._bin_count = 0
+        self._last_t = None
+        self._last_fit_t = None
+        self._fit = None
+        self._phase_start = None
+        self.estimates = {"kobs": None, "kobs_se": None, "koff": None, "koff_se": None}
+        self.fits = 0
+
+    def start_phase(self, phase, concentration=None):
+        """Begin fitting an association or dissociation phase from the next sample on"""
+        if phase not in PHASES:
+            raise ValueError(f"Unknown kinetic phase {phase!r}")
+        with self._lock:
+            self._phase = phase
+            if phase == "association":
+                self._concentration = concentration
+            self._phase_start = self._last_t
+            self._bins.clear()
+            self._origin = None
+            self._bin_sum, self._bin_count = 0.0, 0
+            self._fit = None
+            self._last_fit_t = None
+
+    def end_phase(self):
+        with self._lock:
+            self._phase = None
+
+    def reset(self):
+        """Forget all estimates, e.g. when a new run starts"""
+        with self._lock:
+            self._phase = None
+            self._concentration = None
+            self._fit = None
+            self.estimates = {"kobs": None, "kobs_se": None, "koff": None, "koff_se": None}
+
+    def update(self, t, y):
+        """Add samples (any chunk size); refits when refit_seconds of signal have accumulated"""
+        if len(t) == 0:
+            return
+        with self._lock:
+            self._last_t = float(t[-1])
+            if self._phase is None:
+                return
+            if self._phase_start is None:
+                self._phase_start = float(t[0])
+            if self._origin is None:
+                self._origin = float(t[0])
+                self._bin_index = 0
+            # One group per bin the chunk touches; the open bin is closed when a later one starts
+            index = np.floor((np.asarray(t, dtype=np.float64) - self._origin) / self.bin_seconds).astype(np.int64)
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(index)) + 1))
+            sums = np.add.reduceat(np.asarray(y, dtype=np.float64), starts)
+            counts = np.diff(np.append(starts, len(index)))
+            for bin_index, total, count in zip(index[starts], sums, counts):
+                if bin_index != self._bin_index:
+                    self._close_bin()
+                    self._bin_index = int(bin_index)
+                self._bin_sum += total
+                self._bin_count += count
+            if self._last_fit_t is None or self._last_t - self._last_fit_t >= self.refit_seconds:
+                self._refit()
+
+    def _close_bin(self):
+        if self._bin_count:
+            self._bins.append((self._origin + (self._bin_index + 0.5) * self.bin_seconds, self._bin_sum / self._bin_count))
+        self._bin_sum, self._bin_count = 0.0, 0
+
+    def _refit(self):
+        self._last_fit_t = self._last_t
+        if len(self._bins) < self.min_bins:
+            return
+        with metrics.span("kinetic_fit"):
+            bins = np.array(self._bins)
+            t0 = bins[0, 0]
+            previous = self._fit
+            warm = None
+            if previous is not None:
+                # Re-reference the amplitude to the new window start
+                c, a, k = previous["c"], previous["a"], previous["k"]
+                warm = (c, a * np.exp(-k * (t0 - previous["t0"])), k)
+            result = fit_exponential(bins[:, 0] - t0, bins[:, 1], warm)
+        self.fits += 1
+        if result is None:
+            return
+        c, a, k, k_se, rmse = result
+        self._fit = {"c": c, "a": a, "k": k, "k_se": k_se, "rmse": rmse, "t0": float(t0), "t_end": float(bins[-1, 0])}
+        key = "kobs" if self._phase == "association" else "koff"
+        self.estimates[key] = k
+        self.estimates[f"{key}_se"] = k_se
+
+    def plateau(self):
+        """True once the current phase's fit is plateau_fraction complete and well determined"""
+        with self._lock:
+            return self._plateau()
+
+    def _plateau(self):
+        fit = self._fit
+        if self._phase is None or fit is None or self._phase_start is None:
+            return False
+        elapsed = self._last_t - self._phase_start
+        complete = 1 - np.exp(-fit["k"] * elapsed)
+        return bool(complete >= self.plateau_fraction and fit["k_se"] < self.max_rel_se * fit["k"])
+
+    def snapshot(self):
+        """Current estimates as plain values (None where not yet known)"""
+        with self._lock:
+            kobs, koff = self.estimates["kobs"], self.estimates["koff"]
+            kon = kd = None
+            if kobs is not None and self._concentration:
+                kon = (kobs - (koff or 0.0)) / self._concentration
+                if koff is not None and kon > 0:
+                    kd = koff / kon
+            fit = self._fit
+            return {
+                "phase": self._phase,
+                "kobs": kobs, "kobs_se": self.estimates["kobs_se"],
+                "koff": koff, "koff_se": self.estimates["koff_se"],
+                "kon": kon, "kd": kd,
+                "concentration": self._concentration,
+                "plateau": self._plateau(),
+                "fit": None if fit is None else dict(fit),
+                "fits": self.fits,
+            }
+
+
+def fit_curve(fit, n=100):
+    """(t, y) of a snapshot's fitted exponential over its window, for plotting"""
+    t = np.linspace(fit["t0"], fit["t_end"], n)
+    return t, fit["c"] + fit["a"] * np.exp(-fit["k"] * (t - fit["t0"]))
@@ -0,0 +1,250 @@
+import bisect
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# Instrumentation is off unless APP_METRICS is set; when off, timed() returns
+# the function unchanged and span() a shared no-op context manager.
+ENABLED = os.environ.get("APP_METRICS", "").lower() not in ("", "0", "false", "no")
+PREFIX = "microfluidics"
+
+# Histogram bucket upper bounds in seconds (Prometheus "le" labels)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RECENT_SAMPLES = 1000
+EXPORT_INTERVAL = 5.0
+
+_NULL_SPAN = nullcontext()
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram plus the most recent samples for percentiles"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        self.recent.append(value)
+
+
+class MetricsRegistry:
+    """Process-wide counters and timing histograms.
+
+    Keys are (name, labels) with labels a tuple of (key, value) pairs, so the
+    same metric can be split by span, panel, etc. Shared by every Streamlit
+    session and safe to update from scheduler/engine threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def incr(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def summary(self):
+        """Per-histogram count/mean/p50/p95/max in milliseconds, for the UI"""
+        with self._lock:
+            items = [(key, h.count, h.sum, h.max, np.fromiter(h.recent, dtype=np.float64))
+                     for key, h in self._histograms.items()]
+        rows = []
+        for (name, labels), count, total, peak, recent in sorted(items):
+            rows.append({
+                "metric": name,
+                "labels": ", ".join(f"{k}={v}" for k, v in labels),
+                "count": count,
+                "mean_ms": 1000 * total / count,
+                "p50_ms": 1000 * float(np.percentile(recent, 50)),
+                "p95_ms": 1000 * float(np.percentile(recent, 95)),
+                "max_ms": 1000 * peak,
+            })
+        return rows
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, list(h.counts), h.count, h.sum) for key, h in self._histograms.items()
+            )
+
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {PREFIX}_{name} {self._help[name]}")
+                lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{PREFIX}_{name}{_labels(labels)} {value}")
+        for (name, labels), counts, count, total in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(BUCKETS, counts):
+                cumulative += n
+                lines.append(f"{PREFIX}_{name}_bucket{_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{PREFIX}_{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{PREFIX}_{name}_sum{_labels(labels)} {total!r}")
+            lines.append(f"{PREFIX}_{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Atomically write the exposition text (node_exporter textfile collector style)"""
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(path + ".tmp", path)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+REGISTRY = MetricsRegistry()
+REGISTRY.describe("span_seconds", "Wall time of instrumented app functions")
+REGISTRY.describe("pump_stop_lateness_seconds", "Delay between a pump's scheduled and actual stop")
+REGISTRY.describe("step_lateness_seconds", "Delay between a procedure step's due time and its completion")
+
+
+def span(name):
+    """Context manager timing a block into span_seconds{span=name}"""
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        REGISTRY.observe("span_seconds", time.perf_counter() - self.start, span=self.name)
+        return False
+
+
+def timed(name=None):
+    """Decorator timing every call of a function; returns it unchanged when metrics are disabled"""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                REGISTRY.observe("span_seconds", time.perf_counter() - start, span=span_name)
+        return wrapper
+    return decorate
+
+
+def incr(name, amount=1, **labels):
+    if ENABLED:
+        REGISTRY.incr(name, amount, **labels)
+
+
+def observe(name, value, **labels):
+    if ENABLED:
+        REGISTRY.observe(name, value, **labels)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters(port=None, path=None, interval=EXPORT_INTERVAL, host="127.0.0.1"):
+    """Serve /metrics on host:port and/or rewrite path every interval seconds.
+
+    Idempotent, so it can be called on every Streamlit rerun. Returns the
+    HTTP server (or None).
+    """
+    global _exporters_started
+    if not ENABLED:
+        return None
+    with _exporters_lock:
+        if _exporters_started:
+            return None
+        _exporters_started = True
+
+    server = None
+    if port:
+        server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    if path:
+        def write_loop():
+            while True:
+                try:
+                    REGISTRY.write_prometheus(path)
+                except OSError:
+                    pass
+                time.sleep(interval)
+        threading.Thread(target=write_loop, name="metrics-file", daemon=True).start()
+    return server
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+
+from clock import SYSTEM_CLOCK
+
+# ProcedureRun events after which a run holds no more resources
+FINAL_EVENTS = ("completed", "failed", "cancelled")
+
+
+class LoopTimer:
+    """One-shot callback on an asyncio loop with threading.Timer's cancel(); safe to use from any thread.
+
+    The callback runs in the loop's default executor, so a step completion
+    that talks to the pumps never stalls the other chips' timers.
+    """
+
+    def __init__(self, loop, delay, callback, args=()):
+        self._loop = loop
+        self._callback = callback
+        self._args = args
+        self._handle = None
+        self._cancelled = False
+        loop.call_soon_threadsafe(self._arm, delay)
+
+    def _arm(self, delay):
+        if not self._cancelled:
+            self._handle = self._loop.call_later(delay, self._fire)
+
+    def _fire(self):
+        if not self._cancelled:
+            self._loop.run_in_executor(None, self._callback, *self._args)
+
+    def cancel(self):
+        self._cancelled = True
+        handle = self._handle
+        if handle is not None:
+            self._loop.call_soon_threadsafe(handle.cancel)
+
+
+class Orchestrator:
+    """Runs procedures on several chips concurrently from one asyncio event loop.
+
+    Each chip has an asyncio.Lock held for the whole of a run, so a chip runs
+    one procedure at a time (a second run() for it waits its turn) while
+    different chips proceed independently. Timed steps are loop timers
+    (timer()) instead of a thread each, so eight chips with parallel
+    branches still cost one loop thread plus a small executor pool. Timer
+    delays are on clock, so an accelerated clock shortens them too.
+    """
+
+    def __init__(self, chip_ids, clock=SYSTEM_CLOCK):
+        self.clock = clock
+        self.loop = asyncio.new_event_loop()
+        self._locks = {chip_id: asyncio.Lock() for chip_id in chip_ids}
+        self._thread = threading.Thread(target=self.loop.run_forever, name="chip-orchestrator", daemon=True)
+        self._thread.start()
+
+    def timer(self, delay, callback, args=()):
+        """ProcedureRun timer factory running on the orchestrator loop"""
+        return LoopTimer(self.loop, self.clock.to_real(delay), callback, args)
+
+    def busy(self, chip_id):
+        """True while a procedure holds the chip"""
+        return self._locks[chip_id].locked()
+
+    def run(self, chip_id, run):
+        """Start a ProcedureRun on chip_id once the chip is free; returns a Future with its final status"""
+        if chip_id not in self._locks:
+            raise KeyError(f"Unknown chip {chip_id!r}")
+        return asyncio.run_coroutine_threadsafe(self._run(chip_id, run), self.loop)
+
+    async def _run(self, chip_id, run):
+        async with self._locks[chip_id]:
+            finished = asyncio.Event()
+
+            def on_event(event):
+                if event["kind"] in FINAL_EVENTS:
+                    self.loop.call_soon_threadsafe(finished.set)
+
+            run.add_listener(on_event)
+            await self.loop.run_in_executor(None, run.start)
+            if run.status == "running":
+                await finished.wait()
+            run.remove_listener(on_event)
+            return run.status
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(1.0)
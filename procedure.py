@@ -0,0 +1,309 @@
+import json
+import queue
+import threading
+import time
+
+STEP_TYPES = {
+    "pump_injection": "Pump injection",
+    "incubation": "Incubation",
+    "acquisition": "Data acquisition",
+    "analysis": "Analysis",
+}
+
+
+class ProcedureError(ValueError):
+    pass
+
+
+def load_procedure(path):
+    with open(path, encoding="utf-8") as f:
+        return validate_procedure(json.load(f))
+
+
+def topological_order(steps):
+    """Step IDs ordered so every step comes after its dependencies. Raises on cycles."""
+    after = {step["id"]: list(step.get("after", [])) for step in steps}
+    order, state = [], {}
+
+    def visit(step_id, path):
+        if state.get(step_id) == "done":
+            return
+        if state.get(step_id) == "visiting":
+            raise ProcedureError(f"Dependency cycle: {' -> '.join(path + [step_id])}")
+        state[step_id] = "visiting"
+        for dep in after[step_id]:
+            visit(dep, path + [step_id])
+        state[step_id] = "done"
+        order.append(step_id)
+
+    for step in steps:
+        visit(step["id"], [])
+    return order
+
+
+def validate_procedure(procedure):
+    """Check a procedure definition and return it. Raises ProcedureError."""
+    steps = procedure.get("steps")
+    if not steps:
+        raise ProcedureError("Procedure has no steps")
+
+    ids = [step.get("id") for step in steps]
+    if None in ids or len(set(ids)) != len(ids):
+        raise ProcedureError("Every step needs a unique id")
+    for step in steps:
+        if step.get("type") not in STEP_TYPES:
+            raise ProcedureError(f"Step {step['id']}: unknown type {step.get('type')!r}")
+        if step["type"] == "pump_injection" and "pump" not in step:
+            raise ProcedureError(f"Step {step['id']}: pump_injection needs a pump")
+        if step["type"] != "pump_injection" and not step.get("duration", 0) > 0:
+            raise ProcedureError(f"Step {step['id']}: duration must be positive")
+        if step.get("kinetics") not in (None, False, "association", "dissociation"):
+            raise ProcedureError(f"Step {step['id']}: kinetics must be association or dissociation")
+        if step.get("end_on_plateau") and step["type"] == "pump_injection":
+            raise ProcedureError(f"Step {step['id']}: pump injections cannot end on a plateau")
+        if "concentration" in step and not (isinstance(step["concentration"], (int, float)) and step["concentration"] > 0):
+            raise ProcedureError(f"Step {step['id']}: concentration must be a positive number (μM)")
+        for dep in step.get("after", []):
+            if dep not in ids:
+                raise ProcedureError(f"Step {step['id']}: unknown dependency {dep!r}")
+
+    topological_order(steps)
+
+    # Steps that share a pump must not be able to run at the same time
+    ancestors = _ancestors(steps)
+    pump_steps = [step for step in steps if step["type"] == "pump_injection"]
+    for i, a in enumerate(pump_steps):
+        for b in pump_steps[i + 1:]:
+            if a["pump"] == b["pump"] and a["id"] not in ancestors[b["id"]] and b["id"] not in ancestors[a["id"]]:
+                raise ProcedureError(f"Steps {a['id']} and {b['id']} use pump {a['pump']} in parallel")
+    return procedure
+
+
+def _ancestors(steps):
+    by_id = {step["id"]: step for step in steps}
+    result = {}
+    for step_id in topological_order(steps):
+        deps = by_id[step_id].get("after", [])
+        result[step_id] = set(deps).union(*(result[dep] for dep in deps)) if deps else set()
+    return result
+
+
+def critical_path(steps, durations):
+    """Longest (duration-weighted) dependency chain: (total_seconds, [step ids])"""
+    by_id = {step["id"]: step for step in steps}
+    finish, via = {}, {}
+    for step_id in topological_order(steps):
+        deps = by_id[step_id].get("after", [])
+        start = max((finish[dep] for dep in deps), default=0.0)
+        via[step_id] = max(deps, key=finish.get) if deps else None
+        finish[step_id] = start + durations[step_id]
+    end = max(finish, key=finish.get)
+    path = []
+    while end is not None:
+        path.append(end)
+        end = via[end]
+    return max(finish.values()), path[::-1]
+
+
+def thread_timer(delay, callback, args=()):
+    """Default ProcedureRun timer: a daemon threading.Timer, started"""
+    timer = threading.Timer(delay, callback, args=args)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class ProcedureRun:
+    """Event-driven execution of one procedure definition.
+
+    Steps start as soon as all their dependencies are done, so independent
+    branches (e.g. two pump injections) run concurrently. Pump steps are
+    started through run_pump(pump_id, flow, duration) and completed by the
+    PumpScheduler's stop events; other steps complete on a timer made by
+    timer(delay, callback, args) (threading.Timer unless an orchestrator
+    supplies loop timers). Nothing here polls: state only changes on events,
+    and the UI reads snapshot() and drain_events(); listeners (listener, or
+    add_listener()) are called as each event is queued so an owner can
+    drain without polling.
+    """
+
+    def __init__(self, procedure, scheduler, run_pump, pump_settings, clock=time.monotonic, listener=None,
+                 timer=thread_timer):
+        self.procedure = validate_procedure(procedure)
+        self.steps = procedure["steps"]
+        self._by_id = {step["id"]: step for step in self.steps}
+        self._order = topological_order(self.steps)
+        self._scheduler = scheduler
+        self._run_pump = run_pump
+        self._clock = clock
+        self._timer = timer
+        self._listeners = [listener] if listener is not None else []
+        self.durations = {
+            step["id"]: float(step.get("duration") or pump_settings[step["pump"]]["duration"])
+            for step in self.steps
+        }
+        self._flows = {
+            step["id"]: float(step.get("flow") or pump_settings[step["pump"]]["flow"])
+            for step in self.steps if step["type"] == "pump_injection"
+        }
+        self.state = {step_id: "pending" for step_id in self._order}
+        self.started_at = {}
+        self.finished_at = {}
+        self.status = "idle"
+        self._timers = {}
+        self._lock = threading.RLock()
+        self._events = queue.SimpleQueue()
+        scheduler.add_listener(self._on_pump_event)
+
+    def add_listener(self, callback):
+        self._listeners = self._listeners + [callback]
+
+    def remove_listener(self, callback):
+        self._listeners = [cb for cb in self._listeners if cb != callback]
+
+    def start(self):
+        with self._lock:
+            if self.status != "idle":
+                return
+            self.status = "running"
+            self._emit("info", f"Starting experiment procedure: {self.procedure.get('name', 'procedure')}")
+            self._start_ready()
+
+    def cancel(self, reason="cancelled"):
+        with self._lock:
+            if self.status == "idle":
+                # Cancelled before it started (e.g. still waiting for its chip)
+                self.status = reason
+                self._scheduler.remove_listener(self._on_pump_event)
+                self._emit("cancelled", f"Procedure stopped before starting: {reason}")
+                return
+            if self.status != "running":
+                return
+            self.status = reason
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+            running = [step_id for step_id, state in self.state.items() if state == "running"]
+            for step_id in running:
+                self.state[step_id] = "cancelled"
+        self._scheduler.remove_listener(self._on_pump_event)
+        for step_id in running:
+            step = self._by_id[step_id]
+            if step["type"] == "pump_injection":
+                self._scheduler.cancel(step["pump"], reason)
+        if reason != "failed":
+            self._emit("cancelled", f"Procedure stopped: {reason}")
+
+    def _start_ready(self):
+        for step_id in self._order:
+            if self.status != "running":
+                return
+            if self.state[step_id] != "pending":
+                continue
+            if all(self.state[dep] == "done" for dep in self._by_id[step_id].get("after", [])):
+                self._start_step(step_id)
+
+    def _start_step(self, step_id):
+        step = self._by_id[step_id]
+        self.state[step_id] = "running"
+        self.started_at[step_id] = self._clock()
+        self._emit("step_started", f"{step.get('name', step_id)} started", step_id)
+        if step["type"] == "pump_injection":
+            try:
+                self._run_pump(step["pump"], self._flows[step_id], self.durations[step_id])
+            except Exception as e:
+                self._fail(step_id, f"pump {step['pump']} did not start: {e}")
+        else:
+            self._timers[step_id] = self._timer(self.durations[step_id], self._complete, (step_id,))
+
+    def step(self, step_id):
+        return self._by_id[step_id]
+
+    def finish_step(self, step_id, reason):
+        """End a running timed step before its duration, e.g. once the signal has plateaued"""
+        with self._lock:
+            if self.status != "running" or self.state.get(step_id) != "running" or step_id not in self._timers:
+                return False
+            self._timers[step_id].cancel()
+            self._emit("info", f"{self._by_id[step_id].get('name', step_id)} ending early: {reason}", step_id)
+            self._complete(step_id)
+            return True
+
+    def _on_pump_event(self, event):
+        if event["kind"] != "stopped":
+            return
+        with self._lock:
+            for step_id, state in self.state.items():
+                step = self._by_id[step_id]
+                if state == "running" and step["type"] == "pump_injection" and step["pump"] == event["pump_id"]:
+                    if event["reason"] == "scheduled" and not event["error"]:
+                        self._complete(step_id)
+                    else:
+                        self._fail(step_id, event["error"] or f"pump {step['pump']} stopped ({event['reason']})")
+                    return
+
+    def _complete(self, step_id):
+        with self._lock:
+            if self.status != "running" or self.state[step_id] != "running":
+                return
+            self._timers.pop(step_id, None)
+            self.state[step_id] = "done"
+            self.finished_at[step_id] = self._clock()
+            lateness = self.finished_at[step_id] - self.started_at[step_id] - self.durations[step_id]
+            self._emit("step_done", f"{self._by_id[step_id].get('name', step_id)} completed", step_id, lateness=lateness)
+            if all(state == "done" for state in self.state.values()):
+                self.status = "completed"
+                self._scheduler.remove_listener(self._on_pump_event)
+                self._emit("completed", "Experiment procedure completed")
+            else:
+                self._start_ready()
+
+    def _fail(self, step_id, message):
+        self.state[step_id] = "failed"
+        self._emit("failed", f"{self._by_id[step_id].get('name', step_id)} failed: {message}", step_id)
+        self.cancel("failed")
+
+    def _emit(self, kind, message, step_id=None, **fields):
+        event = {"kind": kind, "message": message, "step_id": step_id, **fields}
+        self._events.put(event)
+        for listener in self._listeners:
+            listener(event)
+
+    def drain_events(self):
+        events = []
+        while True:
+            try:
+                events.append(self._events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def remaining_seconds(self):
+        """Critical-path estimate of the time left, given steps done and in progress"""
+        now = self._clock()
+        with self._lock:
+            remaining = {}
+            for step_id, state in self.state.items():
+                if state == "done":
+                    remaining[step_id] = 0.0
+                elif state == "running":
+                    remaining[step_id] = max(0.0, self.durations[step_id] - (now - self.started_at[step_id]))
+                else:
+                    remaining[step_id] = self.durations[step_id]
+        return critical_path(self.steps, remaining)[0]
+
+    def snapshot(self):
+        with self._lock:
+            state = dict(self.state)
+            status = self.status
+        total, path = critical_path(self.steps, self.durations)
+        remaining = self.remaining_seconds() if status == "running" else (0.0 if status == "completed" else total)
+        return {
+            "status": status,
+            "state": state,
+            "running_steps": [step_id for step_id in self._order if state[step_id] == "running"],
+            "done": sum(1 for s in state.values() if s == "done"),
+            "total": len(state),
+            "remaining": remaining,
+            "critical_path": path,
+            "progress": int(round(100 * (1 - remaining / total))) if total else 100,
+        }
@@ -0,0 +1,309 @@
+"""Pump device drivers.
+
+Wire protocol (ASCII, one command per line):
+
+    request:  "<seq> <addr> <CMD> [arg]\\n"   CMD is RUN, STP, FLO <uL/min> or STA
+    response: "<seq> OK [payload]\\n" or "<seq> ERR <message>\\n"
+
+The sequence number lets the driver pipeline many commands on one line and
+match replies without waiting for each round trip.
+"""
+import asyncio
+import itertools
+import os
+import select
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+try:
+    import termios
+    import tty
+except ImportError:  # Windows: no POSIX ttys, use pyserial-asyncio
+    termios = tty = None
+
+try:
+    import serial_asyncio
+except ImportError:  # optional: pyserial-asyncio, needed on Windows
+    serial_asyncio = None
+
+
+class PumpDriverError(Exception):
+    pass
+
+
+class PumpDriver:
+    """Interface implemented by every pump driver (all methods are coroutines)"""
+
+    async def start(self, pump_id):
+        raise NotImplementedError
+
+    async def stop(self, pump_id):
+        raise NotImplementedError
+
+    async def set_flow(self, pump_id, flow):
+        raise NotImplementedError
+
+    async def query_status(self, pump_id):
+        """Return {"running": bool, "flow": float}"""
+        raise NotImplementedError
+
+    async def stop_all(self, pump_ids):
+        """Stop several pumps; drivers should do this in a single I/O round"""
+        await asyncio.gather(*(self.stop(pump_id) for pump_id in pump_ids))
+
+    async def close(self):
+        pass
+
+
+async def open_serial(port, baudrate=9600):
+    """Open a serial port as asyncio (reader, writer) streams.
+
+    Uses pyserial-asyncio when installed, otherwise a raw POSIX tty.
+    """
+    if serial_asyncio is not None:
+        return await serial_asyncio.open_serial_connection(url=port, baudrate=baudrate)
+    if tty is None:
+        raise PumpDriverError("Serial ports need pyserial-asyncio on this platform")
+
+    fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    tty.setraw(fd)
+    attrs = termios.tcgetattr(fd)
+    speed = getattr(termios, f"B{baudrate}", termios.B9600)
+    attrs[4] = attrs[5] = speed
+    termios.tcsetattr(fd, termios.TCSANOW, attrs)
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb", buffering=0))
+    transport, protocol = await loop.connect_write_pipe(
+        lambda: asyncio.StreamReaderProtocol(asyncio.StreamReader()), os.fdopen(os.dup(fd), "wb", buffering=0)
+    )
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    return reader, writer
+
+
+class SerialPumpDriver(PumpDriver):
+    """Pipelined driver for pumps sharing one serial line.
+
+    Commands issued in the same event-loop tick are coalesced into a single
+    write. Each command waits up to timeout seconds for its reply and is resent
+    up to retries times; round-trip latencies are kept for latency_stats().
+    """
+
+    def __init__(self, reader, writer, timeout=0.5, retries=2):
+        self._reader = reader
+        self._writer = writer
+        self.timeout = timeout
+        self.retries = retries
+        self._seq = itertools.count(1)
+        self._pending = {}
+        self._outbox = []
+        self._flush_scheduled = False
+        self._latency_ms = deque(maxlen=1000)
+        self.timeouts = 0
+        self._read_task = asyncio.get_running_loop().create_task(self._read_loop())
+
+    @classmethod
+    async def open(cls, port, baudrate=9600, **kwargs):
+        reader, writer = await open_serial(port, baudrate)
+        return cls(reader, writer, **kwargs)
+
+    async def start(self, pump_id):
+        await self._command(pump_id, "RUN")
+
+    async def stop(self, pump_id):
+        await self._command(pump_id, "STP")
+
+    async def set_flow(self, pump_id, flow):
+        await self._command(pump_id, "FLO", f"{float(flow):.3f}")
+
+    async def query_status(self, pump_id):
+        state, flow = (await self._command(pump_id, "STA")).split()
+        return {"running": state == "RUN", "flow": float(flow)}
+
+    async def stop_all(self, pump_ids):
+        # All STP commands are queued in this tick and go out in one write
+        await asyncio.gather(*(self._command(pump_id, "STP") for pump_id in pump_ids))
+
+    async def close(self):
+        self._read_task.cancel()
+        self._writer.close()
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(PumpDriverError("Driver closed"))
+        self._pending.clear()
+
+    def latency_stats(self):
+        """Command round-trip latency in milliseconds (last 1000 replies)"""
+        if not self._latency_ms:
+            return {"count": 0, "mean_ms": 0.0, "p99_ms": 0.0, "timeouts": self.timeouts}
+        values = np.fromiter(self._latency_ms, dtype=np.float64)
+        return {
+            "count": len(values),
+            "mean_ms": float(values.mean()),
+            "p99_ms": float(np.percentile(values, 99)),
+            "timeouts": self.timeouts,
+        }
+
+    async def _command(self, pump_id, cmd, arg=None):
+        for attempt in range(self.retries + 1):
+            seq = next(self._seq)
+            future = asyncio.get_running_loop().create_future()
+            self._pending[seq] = future
+            line = f"{seq} {pump_id} {cmd}" + (f" {arg}" if arg is not None else "")
+            sent_at = time.perf_counter()
+            self._queue(line)
+            try:
+                ok, payload = await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                self._pending.pop(seq, None)
+                self.timeouts += 1
+                continue
+            self._latency_ms.append((time.perf_counter() - sent_at) * 1000.0)
+            if not ok:
+                raise PumpDriverError(f"Pump {pump_id} {cmd} rejected: {payload}")
+            return payload
+        raise PumpDriverError(f"Pump {pump_id} {cmd} timed out after {self.retries + 1} attempts")
+
+    def _queue(self, line):
+        self._outbox.append(line)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        if self._outbox:
+            self._writer.write(("\n".join(self._outbox) + "\n").encode())
+            self._outbox.clear()
+
+    async def _read_loop(self):
+        while True:
+            raw = await self._reader.readline()
+            if not raw:
+                return
+            parts = raw.decode(errors="replace").strip().split(" ", 2)
+            if len(parts) < 2 or not parts[0].isdigit():
+                continue
+            future = self._pending.pop(int(parts[0]), None)
+            if future is not None and not future.done():
+                future.set_result((parts[1] == "OK", parts[2] if len(parts) > 2 else ""))
+
+
+class SimulatedPumpServer:
+    """Simulated pump bank served on a local pseudo-terminal (POSIX only).
+
+    Connect a SerialPumpDriver to .port to exercise the real serial code path
+    without hardware. latency adds a delay per received batch of commands.
+    """
+
+    def __init__(self, pump_ids, latency=0.0):
+        self.latency = latency
+        self.state = {pump_id: {"running": False, "flow": 0.0} for pump_id in pump_ids}
+        self._master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self._slave = slave
+        self._stopping = False
+        self._thread = threading.Thread(target=self._serve, name="simulated-pumps", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stopping = True
+        self._thread.join(1.0)
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _serve(self):
+        buffer = b""
+        while not self._stopping:
+            ready, _, _ = select.select([self._master], [], [], 0.1)
+            if not ready:
+                continue
+            buffer += os.read(self._master, 4096)
+            *lines, buffer = buffer.split(b"\n")
+            if self.latency:
+                time.sleep(self.latency)
+            replies = [self._handle(line.decode(errors="replace").strip()) for line in lines if line.strip()]
+            if replies:
+                os.write(self._master, ("\n".join(replies) + "\n").encode())
+
+    def _handle(self, line):
+        parts = line.split()
+        if len(parts) < 3:
+            return f"{parts[0] if parts else 0} ERR malformed"
+        seq, addr, cmd = parts[0], parts[1], parts[2]
+        pump = self.state.get(int(addr)) if addr.isdigit() else None
+        if pump is None:
+            return f"{seq} ERR unknown pump {addr}"
+        if cmd == "RUN":
+            pump["running"] = True
+        elif cmd == "STP":
+            pump["running"] = False
+        elif cmd == "FLO" and len(parts) > 3:
+            pump["flow"] = float(parts[3])
+        elif cmd == "STA":
+            return f"{seq} OK {'RUN' if pump['running'] else 'STP'} {pump['flow']}"
+        else:
+            return f"{seq} ERR unknown command {cmd}"
+        return f"{seq} OK"
+
+
+class BlockingPumpClient:
+    """Synchronous facade running a PumpDriver on its own event-loop thread.
+
+    Used by the controller, the procedure engines and the pump scheduler's
+    device thread, which are not asyncio code. driver_factory is a coroutine
+    function returning the driver.
+    """
+
+    def __init__(self, driver_factory, timeout=2.0):
+        self.timeout = timeout
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="pump-driver", daemon=True)
+        self._thread.start()
+        self.driver = self._call(driver_factory())
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(self.timeout)
+
+    def start(self, pump_id):
+        return self._call(self.driver.start(pump_id))
+
+    def stop(self, pump_id):
+        return self._call(self.driver.stop(pump_id))
+
+    def set_flow(self, pump_id, flow):
+        return self._call(self.driver.set_flow(pump_id, flow))
+
+    def query_status(self, pump_id):
+        return self._call(self.driver.query_status(pump_id))
+
+    def stop_all(self, pump_ids):
+        return self._call(self.driver.stop_all(list(pump_ids)))
+
+    def latency_stats(self):
+        stats = getattr(self.driver, "latency_stats", None)
+        return stats() if stats else {}
+
+    def close(self):
+        self._call(self.driver.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(1.0)
+
+
+def connect_pump_driver(pump_ids, port=None):
+    """Blocking client for the pumps on port (default $PUMP_SERIAL_PORT).
+
+    Without a port, a SimulatedPumpServer is started and used instead; on
+    platforms without ptys this returns None and pumps run without device I/O.
+    """
+    port = port or os.environ.get("PUMP_SERIAL_PORT")
+    if not port:
+        if tty is None:
+            return None
+        port = SimulatedPumpServer(pump_ids).port
+    return BlockingPumpClient(lambda: SerialPumpDriver.open(port))
@@ -0,0 +1,242 @@
+import heapq
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from clock import SYSTEM_CLOCK
+
+
+class SchedulerHalted(RuntimeError):
+    """schedule_run() after halt(): an emergency stop is latched"""
+
+
+class PumpScheduler:
+    """Background thread that starts and stops pumps at their deadlines.
+
+    Deadlines live in a heap ordered by clock.monotonic(). The thread sleeps on a
+    condition variable until just before the next deadline and busy-waits the
+    last SPIN_MARGIN real seconds, so pumps switch within about a millisecond of
+    schedule whether or not any browser is connected. The deadline thread only
+    pops the heap and timestamps what fired: device I/O (the on_start/on_stop
+    callbacks) runs in order on a pump-device thread, and listeners on a
+    pump-events thread, so neither a slow serial round-trip nor a procedure
+    starting its next step delays other pumps' deadlines. The UI only reads
+    the events drained by drain_events().
+    """
+
+    SPIN_MARGIN = 0.002
+
+    def __init__(self, on_start=None, on_stop=None, clock=SYSTEM_CLOCK):
+        self._on_start = on_start
+        self._on_stop = on_stop
+        self.clock = clock
+        self._clock = clock.monotonic
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._tokens = {}
+        self._running = set()
+        self._events = queue.SimpleQueue()
+        self._jitter_ms = deque(maxlen=1000)
+        self._listeners = []
+        self._thread = None
+        self._stopping = False
+        self._halted = False
+        # One thread each, so a pump's start and stop reach the device, and events the listeners, in order
+        self._device = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pump-device")
+        self._dispatch = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pump-events")
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="pump-scheduler", daemon=True)
+            self._thread.start()
+
+    def shutdown(self, timeout=1.0):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        # Let queued device stops reach the pumps; undelivered events are dropped
+        self._device.shutdown(wait=True)
+        self._dispatch.shutdown(wait=False, cancel_futures=True)
+
+    def schedule_run(self, pump_id, duration, delay=0.0):
+        """Start pump_id after delay seconds and stop it duration seconds later.
+
+        Replaces any run already scheduled for the same pump. Raises
+        SchedulerHalted while an emergency stop is latched (see halt()).
+        """
+        token = next(self._seq)
+        start_at = self._clock() + delay
+        with self._cond:
+            if self._halted:
+                raise SchedulerHalted(f"Emergency stop is active: pump {pump_id} not scheduled")
+            self._tokens[pump_id] = token
+            heapq.heappush(self._heap, (start_at, next(self._seq), "start", pump_id, token))
+            heapq.heappush(self._heap, (start_at + duration, next(self._seq), "stop", pump_id, token))
+            self._cond.notify()
+        self.start()
+        return token
+
+    def cancel(self, pump_id, reason="manual", stop_device=True):
+        """Stop a pump now and drop its pending deadlines.
+
+        The device stop is queued behind the pump-device calls already issued,
+        so it never overtakes the pump's own start. stop_device=False only
+        drops the deadlines, for callers that have already stopped the
+        hardware themselves.
+        """
+        with self._cond:
+            scheduled = self._tokens.pop(pump_id, None) is not None
+            running = pump_id in self._running
+            self._running.discard(pump_id)
+        if scheduled or running:
+            self._fire("stop", pump_id, reason, None, stop_device)
+
+    def cancel_all(self, reason="emergency", stop_device=True):
+        with self._cond:
+            pump_ids = set(self._tokens) | self._running
+        for pump_id in pump_ids:
+            self.cancel(pump_id, reason, stop_device)
+
+    def halt(self, reason="emergency", stop_device=True):
+        """Latch an emergency stop: cancel every run and refuse new ones until resume().
+
+        The latch is set under the same lock schedule_run() takes, so a start
+        that was already on its way either lands before the halt (and is
+        cancelled here) or is refused.
+        """
+        with self._cond:
+            self._halted = True
+            pump_ids = set(self._tokens) | self._running
+        for pump_id in pump_ids:
+            self.cancel(pump_id, reason, stop_device)
+
+    def resume(self):
+        with self._cond:
+            self._halted = False
+
+    @property
+    def halted(self):
+        with self._cond:
+            return self._halted
+
+    def add_listener(self, callback):
+        """Call callback(event) from the pump-events thread for every event.
+
+        For engines that react to pump completion (e.g. ProcedureRun); the UI
+        should use drain_events() instead.
+        """
+        self._listeners = self._listeners + [callback]
+
+    def remove_listener(self, callback):
+        self._listeners = [cb for cb in self._listeners if cb != callback]
+
+    def is_running(self, pump_id):
+        with self._cond:
+            return pump_id in self._running
+
+    def is_scheduled(self, pump_id):
+        with self._cond:
+            return pump_id in self._tokens
+
+    def drain_events(self):
+        """Return and clear all events emitted since the last call"""
+        events = []
+        while True:
+            try:
+                events.append(self._events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def jitter_stats(self):
+        """Lateness of fired deadlines in milliseconds (last 1000)"""
+        if not self._jitter_ms:
+            return {"count": 0, "mean_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        values = np.fromiter(self._jitter_ms, dtype=np.float64)
+        return {
+            "count": len(values),
+            "mean_ms": float(values.mean()),
+            "p99_ms": float(np.percentile(values, 99)),
+            "max_ms": float(values.max()),
+        }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    remaining = self.clock.to_real(self._heap[0][0] - self._clock())
+                    if remaining <= self.SPIN_MARGIN:
+                        break
+                    self._cond.wait(remaining - self.SPIN_MARGIN)
+                if self._stopping:
+                    return
+                deadline = self._heap[0][0]
+
+            while self._clock() < deadline:
+                time.sleep(0)
+
+            due = []
+            with self._cond:
+                now = self._clock()
+                while self._heap and self._heap[0][0] <= now:
+                    when, _, action, pump_id, token = heapq.heappop(self._heap)
+                    if self._tokens.get(pump_id) != token:
+                        continue
+                    if action == "start":
+                        self._running.add(pump_id)
+                    else:
+                        self._running.discard(pump_id)
+                        del self._tokens[pump_id]
+                    due.append((when, action, pump_id))
+
+            for when, action, pump_id in due:
+                if action == "start" and self.halted:
+                    continue
+                self._fire(action, pump_id, "scheduled", when)
+
+    def _fire(self, action, pump_id, reason, scheduled_at, call_device=True):
+        jitter_ms = None
+        if scheduled_at is not None:
+            jitter_ms = (self._clock() - scheduled_at) * 1000.0
+            self._jitter_ms.append(jitter_ms)
+        self._device.submit(self._apply, action, pump_id, reason, jitter_ms, self.clock.now(), call_device)
+
+    def _apply(self, action, pump_id, reason, jitter_ms, when, call_device):
+        # pump-device thread
+        callback = self._on_start if action == "start" else self._on_stop
+        error = None
+        if callback is not None and call_device:
+            try:
+                callback(pump_id)
+            except Exception as e:
+                error = str(e)
+
+        event = {
+            "kind": "started" if action == "start" else "stopped",
+            "pump_id": pump_id,
+            "reason": reason,
+            "jitter_ms": jitter_ms,
+            "error": error,
+            "time": when,
+        }
+        self._events.put(event)
+        if self._listeners:
+            self._dispatch.submit(self._notify, event)
+
+    def _notify(self, event):
+        # pump-events thread
+        for listener in self._listeners:
+            listener(event)
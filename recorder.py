@@ -0,0 +1,123 @@
+import json
+import queue
+import struct
+import threading
+
+import numpy as np
+
+from clock import SYSTEM_CLOCK
+
+MAGIC = b"MFTRACE1"
+HEADER, COMMAND, EVENT, SAMPLES = range(4)
+RECORD_KINDS = {HEADER: "header", COMMAND: "command", EVENT: "event", SAMPLES: "samples"}
+# kind, clock.monotonic() when recorded, payload length
+RECORD = struct.Struct("<BdI")
+# chip index, time of the first sample, sample count; then float32 offsets and float32 values
+SAMPLES_HEAD = struct.Struct("<HdI")
+
+
+def _json_bytes(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class TraceRecorder:
+    """Background thread appending control-loop records to a compact binary trace.
+
+    A trace is MAGIC followed by records: a RECORD header (kind, clock time,
+    payload length) and the payload. The header record and commands and
+    events are small JSON objects; detector samples are packed as float32
+    time offsets and values (8 bytes a sample). Callers on any thread only
+    encode and queue; the file is written in batches by the recorder thread.
+    """
+
+    def __init__(self, path, clock=SYSTEM_CLOCK):
+        self.path = path
+        self.clock = clock
+        self.records = 0
+        self.bytes = len(MAGIC)
+        self._chips = {}
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-recorder", daemon=True)
+        self._thread.start()
+
+    def header(self, meta):
+        """Topology, procedures and clock of the recorded controller; must come first"""
+        self._chips = {chip_id: index for index, chip_id in enumerate(meta["chips"])}
+        self._put(HEADER, _json_bytes(meta))
+
+    def command(self, command, args, error=None):
+        self._put(COMMAND, _json_bytes({"command": command, "args": list(args), "error": error}))
+
+    def event(self, source, event, **fields):
+        """A state change: source is "pump" (scheduler events) or "procedure" (engine events)"""
+        self._put(EVENT, _json_bytes({"source": source, **event, **fields}))
+
+    def samples(self, chip_id, t, y):
+        t = np.asarray(t, dtype=np.float64)
+        head = SAMPLES_HEAD.pack(self._chips[chip_id], t[0], len(t))
+        self._put(SAMPLES, head + (t - t[0]).astype(np.float32).tobytes() + np.asarray(y, dtype=np.float32).tobytes())
+
+    def _put(self, kind, payload):
+        self._queue.put(RECORD.pack(kind, self.clock.monotonic(), len(payload)) + payload)
+
+    def flush(self, timeout=5.0):
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(5.0)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            chunks = [item for item in batch if isinstance(item, bytes)]
+            if chunks:
+                self._file.write(b"".join(chunks))
+                self.records += len(chunks)
+                self.bytes += sum(map(len, chunks))
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    self._file.flush()
+                    item.set()
+            if any(item is None for item in batch):
+                self._file.close()
+                return
+
+
+def read_trace(path):
+    """Yield (kind, time, payload) for every record of a trace.
+
+    kind is "header", "command", "event" or "samples"; samples payloads are
+    (chip_id, t, y) arrays, the others the recorded dicts. A record cut off
+    at the end of the file (recorder killed mid-write) ends the trace.
+    """
+    chips = []
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            kind, when, size = RECORD.unpack(head)
+            payload = f.read(size)
+            if len(payload) < size:
+                return
+            if kind == SAMPLES:
+                chip, t0, n = SAMPLES_HEAD.unpack_from(payload)
+                values = np.frombuffer(payload, dtype=np.float32, offset=SAMPLES_HEAD.size)
+                yield "samples", when, (chips[chip], t0 + values[:n].astype(np.float64), values[n:].astype(np.float64))
+                continue
+            record = json.loads(payload)
+            if kind == HEADER:
+                chips = record["chips"]
+            yield RECORD_KINDS[kind], when, record
@@ -0,0 +1,233 @@
+"""Re-drive the platform controller from a recorded trace, faster than real time.
+
+Record a trace by starting the app with PLATFORM_TRACE set to a file path
+(add PLATFORM_CLOCK_SPEED=100 to run the whole session accelerated), then:
+
+    python replay.py data/traces/run.mftrace --speed 200
+    python replay.py run.mftrace --speed 500 --record replayed.mftrace
+
+The controller is rebuilt from the topology and procedures in the trace on a
+ScaledClock, each chip's detector replays its recorded samples and the
+recorded commands are resubmitted at their recorded times. The procedure
+events of the replay are matched against the recording and the step timing
+differences and control-path throughput are reported. Exits with 1 when the
+replay produced different procedure events.
+"""
+import argparse
+import sys
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+from acquisition import DataSource
+from clock import ScaledClock
+from controller import PlatformController
+from recorder import TraceRecorder, read_trace
+from system_log import SystemLog
+
+DEFAULT_SPEED = 100.0
+# Recorded seconds to keep waiting past the end of the trace for running procedures to finish
+DEFAULT_GRACE = 60.0
+
+
+def load_trace(path):
+    """(header, commands, events, samples) of a trace, with times in seconds from the header record.
+
+    commands and events are [(offset, record)] lists; samples is
+    {chip_id: [(offset, t, y)]}.
+    """
+    header, start = None, 0.0
+    commands, events, samples = [], [], defaultdict(list)
+    for kind, when, payload in read_trace(path):
+        if kind == "header":
+            header, start = payload, when
+            continue
+        if header is None:
+            raise ValueError(f"{path}: trace does not start with a header record")
+        if kind == "command":
+            commands.append((when - start, payload))
+        elif kind == "event":
+            events.append((when - start, payload))
+        else:
+            chip_id, t, y = payload
+            samples[chip_id].append((when - start, t, y))
+    if header is None:
+        raise ValueError(f"{path}: empty trace")
+    return header, commands, events, samples
+
+
+class TraceSource(DataSource):
+    """One chip's recorded sample chunks, released as the replay clock reaches their recorded time"""
+
+    def __init__(self, chunks, clock, start):
+        self._chunks = chunks
+        self._clock = clock
+        self._start = start
+        self._next = 0
+
+    def read(self):
+        now = self._clock.monotonic() - self._start
+        first = self._next
+        while self._next < len(self._chunks) and self._chunks[self._next][0] <= now:
+            self._next += 1
+        if first == self._next:
+            return np.empty(0), np.empty(0)
+        chunks = self._chunks[first:self._next]
+        return np.concatenate([chunk[1] for chunk in chunks]), np.concatenate([chunk[2] for chunk in chunks])
+
+
+class EventCollector:
+    """Recorder stand-in that keeps the replay's events in memory and forwards everything to an optional TraceRecorder"""
+
+    def __init__(self, clock, forward=None):
+        self.clock = clock
+        self.forward = forward
+        self.events = []
+        self.commands = 0
+        self.samples_total = 0
+        self._start = clock.monotonic()
+
+    def header(self, meta):
+        self._start = self.clock.monotonic()
+        if self.forward:
+            self.forward.header(meta)
+
+    def command(self, command, args, error=None):
+        self.commands += 1
+        if self.forward:
+            self.forward.command(command, args, error)
+
+    def event(self, source, event, **fields):
+        self.events.append((self.clock.monotonic() - self._start, {"source": source, **event, **fields}))
+        if self.forward:
+            self.forward.event(source, event, **fields)
+
+    def samples(self, chip_id, t, y):
+        self.samples_total += len(t)
+        if self.forward:
+            self.forward.samples(chip_id, t, y)
+
+    def close(self):
+        if self.forward:
+            self.forward.close()
+
+
+def compare_events(recorded, replayed):
+    """Match procedure events by (chip, kind, step id) in order of occurrence.
+
+    Returns (matched, missing, extra): matched is [(key, recorded offset,
+    replayed offset)], missing the recorded keys the replay never produced,
+    extra the replayed keys the recording does not have.
+    """
+    def procedure_events(events):
+        return [(offset, (event.get("chip"), event["kind"], event.get("step_id")))
+                for offset, event in events if event["source"] == "procedure"]
+
+    pending = defaultdict(deque)
+    for offset, key in procedure_events(replayed):
+        pending[key].append(offset)
+    matched, missing = [], []
+    for offset, key in procedure_events(recorded):
+        if pending[key]:
+            matched.append((key, offset, pending[key].popleft()))
+        else:
+            missing.append(key)
+    extra = [key for key, offsets in pending.items() for _ in offsets]
+    return matched, missing, extra
+
+
+def replay(path, speed=DEFAULT_SPEED, record_path=None, grace=DEFAULT_GRACE):
+    """Replay a trace; returns a summary dict (see main() for the fields printed)"""
+    header, commands, events, samples = load_trace(path)
+    clock = ScaledClock(speed)
+    collector = EventCollector(clock, TraceRecorder(record_path, clock) if record_path else None)
+    start = clock.monotonic()
+    controller = PlatformController(
+        header["topology"], None, system_log=SystemLog(clock=clock), procedures=dict(header["procedures"]),
+        clock=clock, recorder=collector,
+        source_factory=lambda chip_id: TraceSource(samples.get(chip_id, []), clock, start)
+    )
+    end = max([offset for offset, _ in commands + events] +
+              [chunks[-1][0] for chunks in samples.values() if chunks] + [0.0])
+    wall_start = time.perf_counter()
+    refused = {"recorded": 0, "replayed": 0}
+    futures = []
+    try:
+        for offset, record in commands:
+            wait = clock.to_real(offset - (clock.monotonic() - start))
+            if wait > 0:
+                time.sleep(wait)
+            refused["recorded"] += record.get("error") is not None
+            if record["command"] == "emergency_stop":
+                controller.emergency_stop()
+            else:
+                futures.append(controller.submit(record["command"], *record["args"]))
+        for future in futures:
+            try:
+                future.result(10.0)
+            except Exception:
+                refused["replayed"] += 1
+
+        wait = clock.to_real(end - (clock.monotonic() - start))
+        if wait > 0:
+            time.sleep(wait)
+        while clock.monotonic() - start < end + grace:
+            state = controller.wait_for_change(controller.version, clock.to_real(1.0))
+            if not any(chip["experiment"]["running"] for chip in state["chips"].values()):
+                break
+        wall = time.perf_counter() - wall_start
+        jitter = controller.scheduler.jitter_stats()
+    finally:
+        controller.shutdown()
+
+    matched, missing, extra = compare_events(events, collector.events)
+    timing = np.array([abs(replayed - recorded) for key, recorded, replayed in matched if key[1] == "step_done"])
+    return {
+        "recorded_seconds": end,
+        "wall_seconds": wall,
+        "speed": speed,
+        "commands": len(commands),
+        "refused": refused,
+        "matched": len(matched),
+        "missing": missing,
+        "extra": extra,
+        "step_timing_median": float(np.median(timing)) if len(timing) else 0.0,
+        "step_timing_max": float(timing.max()) if len(timing) else 0.0,
+        "pump_events": (sum(e["source"] == "pump" for _, e in events), sum(e["source"] == "pump" for _, e in collector.events)),
+        "samples": collector.samples_total,
+        "jitter": jitter,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace", help="trace file recorded with PLATFORM_TRACE")
+    parser.add_argument("--speed", type=float, default=DEFAULT_SPEED, help=f"clock speed-up (default {DEFAULT_SPEED:g}x)")
+    parser.add_argument("--record", metavar="PATH", help="also record the replay as a trace, e.g. to diff two replays")
+    parser.add_argument("--grace", type=float, default=DEFAULT_GRACE,
+                        help=f"recorded seconds to wait past the end of the trace for running procedures (default {DEFAULT_GRACE:g})")
+    args = parser.parse_args(argv)
+
+    summary = replay(args.trace, args.speed, args.record, args.grace)
+    wall = max(summary["wall_seconds"], 1e-9)
+    jitter = summary["jitter"]
+    print(f"Replayed {args.trace}: {summary['recorded_seconds']:,.1f} s of recorded time in {wall:,.2f} s "
+          f"({summary['recorded_seconds'] / wall:,.0f}x, clock speed {summary['speed']:g}x)")
+    print(f"  commands: {summary['commands']} replayed, {summary['refused']['replayed']} refused "
+          f"({summary['refused']['recorded']} in the recording)")
+    print(f"  procedure events: {summary['matched']} matched, {len(summary['missing'])} missing, "
+          f"{len(summary['extra'])} extra; step completion differs by median {summary['step_timing_median']:.2f} s, "
+          f"max {summary['step_timing_max']:.2f} s")
+    print(f"  pump events: {summary['pump_events'][0]} recorded, {summary['pump_events'][1]} replayed; "
+          f"scheduler jitter p99 {jitter['p99_ms']:.1f} ms, max {jitter['max_ms']:.1f} ms (recorded time)")
+    print(f"  detector: {summary['samples']:,} samples ({summary['samples'] / wall:,.0f} samples/s)")
+    for key in summary["missing"]:
+        print(f"  missing: {key}", file=sys.stderr)
+    for key in summary["extra"]:
+        print(f"  extra: {key}", file=sys.stderr)
+    return 1 if summary["missing"] or summary["extra"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import itertools
+import json
+import os
+import queue
+import threading
+from collections import deque
+
+from clock import SYSTEM_CLOCK
+
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+SUBSYSTEMS = ("system", "pump", "procedure", "data", "emergency")
+DEFAULT_CAPACITY = 10_000
+DEFAULT_MAX_BYTES = 5 * 2**20
+DEFAULT_BACKUPS = 5
+
+
+class JsonlWriter:
+    """Background thread appending records to a size-rotated JSONL file.
+
+    One writer per path is shared by every SystemLog in the process, so
+    sessions logging to the same file never interleave partial lines.
+    Records are queued by the caller and written in batches; the caller
+    never waits on disk I/O.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_path(cls, path, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS):
+        path = os.path.abspath(path)
+        with cls._instances_lock:
+            writer = cls._instances.get(path)
+            if writer is None:
+                writer = cls._instances[path] = cls(path, max_bytes, backups)
+            return writer
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.errors = 0
+        self._queue = queue.SimpleQueue()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="system-log-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, record):
+        self._queue.put(record)
+
+    def flush(self, timeout=5.0):
+        """Block until everything queued so far is on disk"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [item for item in batch if isinstance(item, dict)]
+            if records:
+                try:
+                    self._write([(json.dumps(_serialize(r), ensure_ascii=False) + "\n").encode("utf-8") for r in records])
+                except OSError:
+                    self.errors += 1
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _write(self, lines):
+        """Append encoded lines, rotating whenever the file would exceed max_bytes"""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        chunk = []
+        for line in lines:
+            if size and size + len(line) > self.max_bytes:
+                self._append(chunk)
+                self._rotate()
+                chunk, size = [], 0
+            chunk.append(line)
+            size += len(line)
+        self._append(chunk)
+
+    def _append(self, chunk):
+        if chunk:
+            with open(self.path, "ab") as f:
+                f.write(b"".join(chunk))
+
+    def _rotate(self):
+        """system_log.jsonl -> .1 -> .2 ...; the oldest backup is dropped"""
+        for n in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{n}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{n + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+def _serialize(record):
+    return dict(record, time=record["time"].isoformat(timespec="milliseconds"))
+
+
+class SystemLog:
+    """Bounded in-memory log of structured records, optionally persisted as JSONL.
+
+    Records are dicts with seq, time, level, subsystem, pump_id, step_id and
+    message. The newest `capacity` records stay in memory for the UI; with a
+    path, every record is also handed to a shared JsonlWriter so overnight
+    runs keep their full history on disk. Record times come from clock, so
+    an accelerated or replayed session logs on the same timeline as its
+    pump and procedure events.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, path=None, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS,
+                 clock=SYSTEM_CLOCK):
+        self.clock = clock
+        self._records = deque(maxlen=capacity)
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+        self.path = path
+        self._writer = JsonlWriter.for_path(path, max_bytes, backups) if path else None
+        self.version = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def log(self, message, level="INFO", subsystem="system", pump_id=None, step_id=None):
+        if level not in LEVELS:
+            raise ValueError(f"Unknown log level {level!r}")
+        record = {
+            "seq": next(self._seq),
+            "time": self.clock.now(),
+            "level": level,
+            "subsystem": subsystem,
+            "pump_id": pump_id,
+            "step_id": step_id,
+            "message": message,
+        }
+        with self._lock:
+            self._records.append(record)
+            self.version += 1
+        if self._writer is not None:
+            self._writer.put(record)
+        return record
+
+    def records(self):
+        """Snapshot of the in-memory records, oldest first"""
+        with self._lock:
+            return list(self._records)
+
+    def query(self, levels=None, subsystems=None, text=None, pump_id=None, step_id=None):
+        """Matching records, newest first. text is a case-insensitive substring match."""
+        text = text.lower() if text else None
+        return [
+            record for record in reversed(self.records())
+            if (not levels or record["level"] in levels)
+            and (not subsystems or record["subsystem"] in subsystems)
+            and (pump_id is None or record["pump_id"] == pump_id)
+            and (step_id is None or record["step_id"] == step_id)
+            and (text is None or text in record["message"].lower())
+        ]
+
+    def flush(self, timeout=5.0):
+        return self._writer.flush(timeout) if self._writer is not None else True
+
+
+def paginate(records, page, per_page=50):
+    """(records on the 1-based page, number of pages)"""
+    pages = max(1, -(-len(records) // per_page))
+    page = min(max(1, page), pages)
+    return records[(page - 1) * per_page:page * per_page], pages
+
@@ -0,0 +1,415 @@
+"""Plan a titration screen as pump injections and procedures for the platform's chips.
+
+Takes a screen definition (target concentrations, stock concentration and
+volume per protein, chamber, dead and wash volumes, incubation and
+acquisition times) and a device topology, and writes one procedure per chip:
+
+    python titration.py screens/example_96.json --topology devices/eight_chips.json --output plans/
+
+Point a chip's "procedure" in the topology at its file, or load the files
+in the app (the Titration Planner panel does both steps at once).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from procedure import validate_procedure
+from topology import load_topology
+
+SPEC_DEFAULTS = {
+    "chamber_volume": 20.0,   # μL filled per condition
+    "dead_volume": 5.0,       # μL to prime a pump line before its first injection
+    "wash_volume": 40.0,      # μL of buffer flushed through the chamber between proteins
+    "incubation": 60.0,       # s
+    "acquisition": 30.0,      # s
+    "buffer_volume": None,    # μL in each chip's buffer reservoir (None = not checked)
+    "end_on_plateau": False,
+}
+# Local-search passes over the chip assignment after the greedy start
+MAX_IMPROVEMENTS = 200
+
+
+class TitrationError(ValueError):
+    pass
+
+
+def validate_spec(spec):
+    """Check a screen definition and fill in defaults. Raises TitrationError."""
+    spec = dict(SPEC_DEFAULTS, **spec)
+    proteins = spec.get("proteins")
+    if not proteins:
+        raise TitrationError("Screen has no proteins")
+    names = [protein.get("name") for protein in proteins]
+    if None in names or len(set(names)) != len(names):
+        raise TitrationError("Every protein needs a unique name")
+    for key in ("chamber_volume", "incubation", "acquisition"):
+        if not spec[key] > 0:
+            raise TitrationError(f"{key} must be positive")
+    for protein in proteins:
+        concentrations = protein.get("concentrations")
+        if not concentrations or min(concentrations) < 0:
+            raise TitrationError(f"{protein['name']}: needs a list of non-negative concentrations (μM)")
+        if not protein.get("stock", 0) > 0:
+            raise TitrationError(f"{protein['name']}: stock concentration (μM) must be positive")
+        if max(concentrations) > protein["stock"]:
+            raise TitrationError(f"{protein['name']}: {max(concentrations):g} μM is above the {protein['stock']:g} μM stock")
+    return spec
+
+
+def chip_lines(chip):
+    """(protein lines, buffer line) of a topology chip as (pump number, min_flow, max_flow).
+
+    The buffer pump is the chip's "buffer_pump", else its first pump named
+    Buffer, else its last pump; every other pump can carry a protein.
+    """
+    lines = [(number, pump["min_flow"], pump["max_flow"]) for number, pump in enumerate(chip["pumps"], 1)]
+    buffer = chip.get("buffer_pump") or next(
+        (number for number, pump in enumerate(chip["pumps"], 1) if pump["name"].lower() == "buffer"), len(lines))
+    return [line for line in lines if line[0] != buffer], lines[buffer - 1]
+
+
+def injections(concentrations, stock, chamber_volume, protein_line, buffer_line):
+    """Volumes (μL), flows (μL/min) and durations (s) that fill the chamber to each concentration.
+
+    Protein and buffer are injected at the same time. The pump with the
+    longer run goes at its max_flow and the other is slowed to finish with
+    it (never below its min_flow), so the chamber fills as fast as the pumps
+    allow at the gentlest flow. Arrays are over the concentrations.
+    """
+    c = np.asarray(concentrations, dtype=np.float64)
+    protein_volume = c * chamber_volume / stock
+    buffer_volume = chamber_volume - protein_volume
+    minutes = np.maximum(protein_volume / protein_line[2], buffer_volume / buffer_line[2])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        protein_flow = np.clip(protein_volume / minutes, protein_line[1], protein_line[2])
+        buffer_flow = np.clip(buffer_volume / minutes, buffer_line[1], buffer_line[2])
+        protein_seconds = np.where(protein_volume > 0, 60 * protein_volume / protein_flow, 0.0)
+        buffer_seconds = np.where(buffer_volume > 0, 60 * buffer_volume / buffer_flow, 0.0)
+    return {
+        "protein_volume": protein_volume, "protein_flow": protein_flow, "protein_seconds": protein_seconds,
+        "buffer_volume": buffer_volume, "buffer_flow": buffer_flow, "buffer_seconds": buffer_seconds,
+    }
+
+
+class _Planner:
+    """Chip assignment search; a block is one protein's contiguous run of ascending concentrations"""
+
+    def __init__(self, spec, chips):
+        self.spec = spec
+        self.chips = chips
+        self.series = {protein["name"]: np.sort(np.asarray(protein["concentrations"], dtype=np.float64))
+                       for protein in spec["proteins"]}
+        self.stock = {protein["name"]: float(protein["stock"]) for protein in spec["proteins"]}
+        self._block_seconds = {}
+
+    def blocks(self, counts):
+        """(protein, start, stop) slices splitting each protein's series into counts[protein] blocks"""
+        result = []
+        for protein, series in self.series.items():
+            bounds = np.linspace(0, len(series), counts[protein] + 1).round().astype(int)
+            result += [(protein, int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        return result
+
+    def block_seconds(self, block, line, buffer):
+        key = (block, line, buffer)
+        seconds = self._block_seconds.get(key)
+        if seconds is None:
+            protein, start, stop = block
+            plan = injections(self.series[protein][start:stop], self.stock[protein], self.spec["chamber_volume"], line, buffer)
+            per_condition = self.spec["incubation"] + self.spec["acquisition"]
+            seconds = float(np.maximum(plan["protein_seconds"], plan["buffer_seconds"]).sum() + (stop - start) * per_condition)
+            self._block_seconds[key] = seconds
+        return seconds
+
+    def chip_load(self, chip, blocks):
+        """(seconds, [(block, line)]) for a chip's blocks: the longest blocks get the fastest lines"""
+        if not blocks:
+            return 0.0, []
+        lines, buffer = chip["lines"], chip["buffer"]
+        reference = max(lines, key=lambda line: line[2])
+        ordered = sorted(blocks, key=lambda block: -self.block_seconds(block, reference, buffer))
+        by_speed = sorted(lines, key=lambda line: -line[2])
+        pairs = list(zip(ordered, by_speed))
+        dead = self.spec["dead_volume"]
+        prime = max(60 * dead / line[2] for line in [buffer] + [line for _, line in pairs]) if dead else 0.0
+        wash = 60 * self.spec["wash_volume"] / buffer[2] * (len(pairs) - 1)
+        return prime + wash + sum(self.block_seconds(block, line, buffer) for block, line in pairs), pairs
+
+    def assign(self, blocks):
+        """Greedy longest-block-first assignment, then moves and swaps off the busiest chip"""
+        chips = self.chips
+        assignment = {chip["id"]: [] for chip in chips}
+        loads = {chip["id"]: 0.0 for chip in chips}
+        by_id = {chip["id"]: chip for chip in chips}
+        reference = {chip["id"]: max(chip["lines"], key=lambda line: line[2]) for chip in chips}
+
+        def fits(chip_id, block, blocks_on_chip):
+            return (len(blocks_on_chip) < len(by_id[chip_id]["lines"])
+                    and all(other[0] != block[0] for other in blocks_on_chip))
+
+        for block in sorted(blocks, key=lambda b: -self.block_seconds(b, reference[chips[0]["id"]], chips[0]["buffer"])):
+            best = None
+            for chip_id, blocks_on_chip in assignment.items():
+                if fits(chip_id, block, blocks_on_chip):
+                    load = self.chip_load(by_id[chip_id], blocks_on_chip + [block])[0]
+                    if best is None or load < best[0]:
+                        best = (load, chip_id)
+            if best is None:
+                raise TitrationError(f"Not enough free pump lines for {block[0]}: each protein needs its own line on a chip")
+            loads[best[1]] = best[0]
+            assignment[best[1]].append(block)
+
+        for _ in range(MAX_IMPROVEMENTS):
+            busiest = max(loads, key=loads.get)
+            best = None
+            for block in assignment[busiest]:
+                remaining = [b for b in assignment[busiest] if b != block]
+                for chip_id, blocks_on_chip in assignment.items():
+                    if chip_id == busiest:
+                        continue
+                    candidates = [(None, blocks_on_chip + [block])] if fits(chip_id, block, blocks_on_chip) else []
+                    # Swap with a block of another protein that fits on the busiest chip
+                    candidates += [
+                        (other, [b for b in blocks_on_chip if b != other] + [block])
+                        for other in blocks_on_chip
+                        if other[0] != block[0] and all(b[0] != other[0] for b in remaining)
+                        and all(b[0] != block[0] for b in blocks_on_chip if b != other)
+                    ]
+                    for other, moved in candidates:
+                        kept = remaining + ([other] if other else [])
+                        load_a = self.chip_load(by_id[busiest], kept)[0]
+                        load_b = self.chip_load(by_id[chip_id], moved)[0]
+                        if max(load_a, load_b) < loads[busiest] - 1e-9 and (best is None or max(load_a, load_b) < best[0]):
+                            best = (max(load_a, load_b), chip_id, kept, moved, load_a, load_b)
+            if best is None:
+                break
+            _, chip_id, kept, moved, load_a, load_b = best
+            assignment[busiest], assignment[chip_id] = kept, moved
+            loads[busiest], loads[chip_id] = load_a, load_b
+        return max(loads.values()), assignment, loads
+
+    def solve(self):
+        """Choose how many blocks each protein's series is split into, and assign them.
+
+        Starts from splits proportional to each protein's share of the total
+        time, splits further while that shortens the screen, then merges
+        blocks back wherever that costs no time (each block costs a primed
+        line and a wash).
+        """
+        slots = sum(len(chip["lines"]) for chip in self.chips)
+        if len(self.series) > slots:
+            raise TitrationError(f"{len(self.series)} proteins need a pump line each; the chips have {slots} "
+                                 "(use more chips or split the screen)")
+        chip = self.chips[0]
+        reference = max(chip["lines"], key=lambda line: line[2])
+        seconds = {protein: self.block_seconds((protein, 0, len(series)), reference, chip["buffer"])
+                   for protein, series in self.series.items()}
+        limit = {protein: min(len(series), len(self.chips)) for protein, series in self.series.items()}
+        target = sum(seconds.values()) / len(self.chips)
+        counts = {protein: int(min(limit[protein], max(1, np.ceil(seconds[protein] / target - 1e-9)))) for protein in seconds}
+        if sum(counts.values()) > slots:
+            counts = {protein: 1 for protein in seconds}
+        best = self._try(counts)
+        if best is None:
+            counts = {protein: 1 for protein in seconds}
+            best = self.assign(self.blocks(counts))
+
+        improved = True
+        while improved and sum(counts.values()) < slots:
+            improved = False
+            busiest = max(best[2], key=best[2].get)
+            on_busiest = {block[0] for block in best[1][busiest]}
+            for protein in sorted(on_busiest, key=lambda p: -seconds[p] / counts[p]):
+                if counts[protein] >= limit[protein]:
+                    continue
+                trial_counts = dict(counts, **{protein: counts[protein] + 1})
+                trial = self._try(trial_counts)
+                if trial is not None and trial[0] < best[0] - 1e-9:
+                    counts, best, improved = trial_counts, trial, True
+                    break
+
+        for protein in sorted(seconds, key=lambda p: seconds[p] / counts[p]):
+            while counts[protein] > 1:
+                trial_counts = dict(counts, **{protein: counts[protein] - 1})
+                trial = self._try(trial_counts)
+                if trial is None or trial[0] > best[0] + 1e-9:
+                    break
+                counts, best = trial_counts, trial
+        return best
+
+    def _try(self, counts):
+        try:
+            return self.assign(self.blocks(counts))
+        except TitrationError:
+            return None
+
+
+def plan_titration(spec, topology, chip_ids=None):
+    """Plan a screen on the topology's chips (or the chip_ids subset). Raises TitrationError.
+
+    Each protein runs on dedicated pump lines in ascending concentration, so
+    the chamber only needs a wash between proteins, and every line is primed
+    once, all lines of a chip at the same time. Protein series are split over
+    chips while that shortens the screen; chips run in parallel, so the
+    screen takes as long as the busiest chip. Returns a plan dict for
+    plan_procedures() with per-chip blocks, timing and reagent use.
+    """
+    spec = validate_spec(spec)
+    chips = []
+    for chip in topology["chips"]:
+        if chip_ids is not None and chip["id"] not in chip_ids:
+            continue
+        lines, buffer = chip_lines(chip)
+        if lines:
+            chips.append({"id": chip["id"], "name": chip["name"], "lines": lines, "buffer": buffer})
+    if not chips:
+        raise TitrationError("No chip with a free protein pump line selected")
+
+    planner = _Planner(spec, chips)
+    makespan, assignment, loads = planner.solve()
+
+    plan = {
+        "name": spec.get("name", "Titration screen"),
+        "incubation": spec["incubation"], "acquisition": spec["acquisition"], "end_on_plateau": spec["end_on_plateau"],
+        "makespan": makespan, "chips": {}, "reagents": {protein: 0.0 for protein in planner.series},
+        "conditions": sum(len(series) for series in planner.series.values()),
+    }
+    dead, wash_volume = spec["dead_volume"], spec["wash_volume"]
+    buffer_total = 0.0
+    for chip in chips:
+        if not assignment[chip["id"]]:
+            continue
+        seconds, pairs = planner.chip_load(chip, assignment[chip["id"]])
+        buffer = chip["buffer"]
+        blocks = []
+        buffer_used = dead + wash_volume * (len(pairs) - 1)
+        for (protein, start, stop), line in sorted(pairs, key=lambda pair: (pair[0][0], pair[0][1])):
+            concentrations = planner.series[protein][start:stop]
+            inj = injections(concentrations, planner.stock[protein], spec["chamber_volume"], line, buffer)
+            conditions = [
+                {"protein": protein, "concentration": float(c), **{key: float(values[i]) for key, values in inj.items()}}
+                for i, c in enumerate(concentrations)
+            ]
+            blocks.append({"protein": protein, "pump": line[0], "conditions": conditions})
+            plan["reagents"][protein] += dead + float(inj["protein_volume"].sum())
+            buffer_used += float(inj["buffer_volume"].sum())
+        if spec["buffer_volume"] is not None and buffer_used > spec["buffer_volume"]:
+            raise TitrationError(f"{chip['name']} needs {buffer_used:,.0f} μL of buffer, the reservoir holds {spec['buffer_volume']:,.0f} μL")
+        buffer_total += buffer_used
+        plan["chips"][chip["id"]] = {
+            "name": chip["name"], "seconds": seconds, "buffer_pump": buffer[0], "buffer_volume": buffer_used,
+            "prime": [{"pump": number, "flow": max_flow, "seconds": 60 * dead / max_flow}
+                      for number, _, max_flow in [buffer] + [line for _, line in pairs]] if dead else [],
+            "wash": {"pump": buffer[0], "flow": buffer[2], "seconds": 60 * wash_volume / buffer[2]},
+            "blocks": blocks,
+        }
+    for protein in spec["proteins"]:
+        if "volume" in protein and plan["reagents"][protein["name"]] > protein["volume"]:
+            raise TitrationError(f"{protein['name']}: the plan needs {plan['reagents'][protein['name']]:,.0f} μL, "
+                                 f"only {protein['volume']:,.0f} μL available")
+    plan["reagents"]["Buffer"] = buffer_total
+
+    # One chip, one pump at a time, no splitting: the hand-run baseline
+    lines, buffer = chips[0]["lines"], chips[0]["buffer"]
+    fastest = max(lines, key=lambda line: line[2])
+    sequential = 60 * wash_volume / buffer[2] * (len(planner.series) - 1)
+    for protein, series in planner.series.items():
+        inj = injections(series, planner.stock[protein], spec["chamber_volume"], fastest, buffer)
+        sequential += float((inj["protein_seconds"] + inj["buffer_seconds"]).sum()) + len(series) * (spec["incubation"] + spec["acquisition"])
+    plan["sequential_seconds"] = sequential
+    return plan
+
+
+def _round(seconds):
+    return max(round(seconds, 3), 0.001)
+
+
+def plan_procedures(plan):
+    """{chip_id: procedure} running a plan; conditions are chained, each chip's lines primed in parallel"""
+    procedures = {}
+    for chip_id, chip in plan["chips"].items():
+        steps = []
+        after = []
+        for prime in chip["prime"]:
+            step_id = f"prime_{prime['pump']}"
+            steps.append({"id": step_id, "name": f"Prime pump {prime['pump']}", "type": "pump_injection",
+                          "pump": prime["pump"], "flow": prime["flow"], "duration": _round(prime["seconds"])})
+            after.append(step_id)
+        number = 0
+        for index, block in enumerate(chip["blocks"]):
+            if index:
+                wash = chip["wash"]
+                steps.append({"id": f"wash_{index}", "name": f"Wash before {block['protein']}", "type": "pump_injection",
+                              "pump": wash["pump"], "flow": wash["flow"], "duration": _round(wash["seconds"]), "after": after})
+                after = [f"wash_{index}"]
+            for condition in block["conditions"]:
+                number += 1
+                label = f"{condition['protein']} {condition['concentration']:g} μM"
+                injected = []
+                for reagent, pump in (("protein", block["pump"]), ("buffer", chip["buffer_pump"])):
+                    if condition[f"{reagent}_volume"] > 0:
+                        step_id = f"c{number}_{reagent}"
+                        steps.append({"id": step_id, "name": f"Inject {reagent} ({label})", "type": "pump_injection",
+                                      "pump": pump, "flow": round(condition[f"{reagent}_flow"], 3),
+                                      "duration": _round(condition[f"{reagent}_seconds"]), "after": after})
+                        injected.append(step_id)
+                incubate = {"id": f"c{number}_incubate", "name": f"Incubate {label}", "type": "incubation",
+                            "duration": plan["incubation"], "after": injected}
+                if condition["concentration"] > 0:
+                    incubate["concentration"] = condition["concentration"]
+                if plan["end_on_plateau"]:
+                    incubate["end_on_plateau"] = True
+                steps.append(incubate)
+                steps.append({"id": f"c{number}_read", "name": f"Read {label}", "type": "acquisition",
+                              "duration": plan["acquisition"], "after": [incubate["id"]]})
+                after = [f"c{number}_read"]
+        procedures[chip_id] = validate_procedure({"name": f"{plan['name']} ({chip['name']})", "steps": steps})
+    return procedures
+
+
+def describe_plan(plan):
+    """One-line summary: conditions, chips, duration against the hand-run baseline, reagent use"""
+    hours = plan["makespan"] / 3600
+    speedup = plan["sequential_seconds"] / plan["makespan"] if plan["makespan"] else 1.0
+    reagents = ", ".join(f"{name} {volume:,.0f} μL" for name, volume in plan["reagents"].items())
+    return (f"{plan['conditions']} conditions on {len(plan['chips'])} chip(s): {hours:.2f} h "
+            f"({speedup:.1f}x faster than one pump at a time) | {reagents}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("screen", help="screen definition (JSON)")
+    parser.add_argument("--topology", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "devices", "default.json"),
+                        help="device topology (default devices/default.json)")
+    parser.add_argument("--chips", nargs="+", help="chip IDs to use (default: all)")
+    parser.add_argument("--output", help="directory for one <chip id>.json procedure per chip")
+    args = parser.parse_args(argv)
+
+    with open(args.screen, encoding="utf-8") as f:
+        spec = json.load(f)
+    started = time.perf_counter()
+    try:
+        plan = plan_titration(spec, load_topology(args.topology), args.chips)
+    except TitrationError as e:
+        print(f"No plan: {e}", file=sys.stderr)
+        return 1
+    procedures = plan_procedures(plan)
+    print(f"{describe_plan(plan)} | solved in {1000 * (time.perf_counter() - started):.0f} ms")
+    for chip_id, chip in plan["chips"].items():
+        proteins = ", ".join(f"{block['protein']} ({len(block['conditions'])}, pump {block['pump']})" for block in chip["blocks"])
+        print(f"  {chip['name']}: {chip['seconds'] / 60:,.1f} min, {len(procedures[chip_id]['steps'])} steps | {proteins}")
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        for chip_id, procedure in procedures.items():
+            with open(os.path.join(args.output, f"{chip_id}.json"), "w", encoding="utf-8") as f:
+                json.dump(procedure, f, ensure_ascii=False, indent=2)
+        print(f"Procedures written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
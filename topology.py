@@ -0,0 +1,85 @@
+import copy
+import json
+import os
+
+from procedure import ProcedureError
+
+PUMP_DEFAULTS = {"flow": 50, "time": 10, "min_flow": 1, "max_flow": 1000}
+
+
+class TopologyError(ValueError):
+    pass
+
+
+def load_topology(path):
+    with open(path, encoding="utf-8") as f:
+        topology = validate_topology(json.load(f))
+    base = os.path.dirname(os.path.abspath(path))
+    for chip in topology["chips"]:
+        if chip.get("procedure"):
+            chip["procedure"] = os.path.join(base, chip["procedure"])
+    return topology
+
+
+def validate_topology(topology):
+    """Check a device topology and fill in defaults. Raises TopologyError.
+
+    A topology lists chips, each with its pumps in the order procedures
+    number them (pump 1 is the chip's first pump). Every pump also has a
+    platform-wide "address" on the pump bus; pumps without one are numbered
+    1, 2, ... across the whole file. min_flow/max_flow (μL/min) bound the
+    flows the titration planner may choose.
+    """
+    chips = topology.get("chips")
+    if not chips:
+        raise TopologyError("Topology has no chips")
+    ids = [chip.get("id") for chip in chips]
+    if None in ids or len(set(ids)) != len(ids):
+        raise TopologyError("Every chip needs a unique id")
+    addresses = set()
+    number = 0
+    for chip in chips:
+        chip.setdefault("name", str(chip["id"]))
+        if not chip.get("pumps"):
+            raise TopologyError(f"Chip {chip['id']}: no pumps")
+        for local, pump in enumerate(chip["pumps"], 1):
+            number += 1
+            address = pump.setdefault("address", number)
+            if not isinstance(address, int) or address < 0:
+                raise TopologyError(f"Chip {chip['id']}: pump address must be a non-negative integer, got {address!r}")
+            if address in addresses:
+                raise TopologyError(f"Chip {chip['id']}: pump address {address} is used twice")
+            addresses.add(address)
+            for key, value in PUMP_DEFAULTS.items():
+                pump.setdefault(key, value)
+            pump.setdefault("name", f"Pump {local}")
+            if not 0 < pump["min_flow"] <= pump["max_flow"]:
+                raise TopologyError(f"Chip {chip['id']}: pump {local} needs 0 < min_flow <= max_flow (μL/min)")
+    return topology
+
+
+def pump_table(topology):
+    """Controller pump state keyed by bus address, each pump tagged with its chip and number on the chip"""
+    return {
+        pump["address"]: {
+            "running": False, "flow": pump["flow"], "time": pump["time"], "name": pump["name"],
+            "completed": False, "chip": chip["id"], "number": number,
+        }
+        for chip in topology["chips"]
+        for number, pump in enumerate(chip["pumps"], 1)
+    }
+
+
+def bind_procedure(procedure, addresses):
+    """Copy of a procedure with its pump numbers (1 = the chip's first pump) replaced by bus addresses.
+
+    Procedures are written against pump numbers so the same file runs on any
+    chip; addresses lists the chip's pumps in order.
+    """
+    procedure = copy.deepcopy(procedure)
+    for step in procedure["steps"]:
+        if step["type"] == "pump_injection":
+            if not 1 <= step["pump"] <= len(addresses):
+                raise ProcedureError(f"Step {step['id']}: the chip has no pump {step['pump']}")
+            step["pump"] = addresses[step["pump"] - 1]
+    return procedure